@@ -0,0 +1,318 @@
+'''
+Batch compression or extraction of many files (directories, glob patterns or files) over a pool of worker processes.
+
+	python Batch.py compress ../Models --output-dir compressed --workers 4 --timeout 60
+	python Batch.py extract "compressed/**/*.rfcp" --output-dir extracted --password secret
+
+- A directory stands for every .obj (compress) or .rfcp (extract) file under it. With --output-dir, the outputs keep
+  the paths of the files relative to their common directory, otherwise they are written next to them.
+- Every worker processes one file at a time on one core (see Parallel.setDefaultWorkers), the largest files first.
+- A file failing, taking longer than --timeout seconds (its worker is killed and replaced) or crashing its worker is
+  reported, and the batch goes on.
+- The outputs are written under a temporary name (.part) and renamed once complete, the temporary output of a file
+  being removed when it fails or is stopped, and when the batch starts. A stopped batch is resumed by running it
+  again: the outputs newer than their input are skipped (--force processes them again, after a change of options).
+- The report (batch_report.json in the output directory by default) gives the status of every file (done, skipped,
+  failed, timeout or crashed), its time, its sizes, its compression ratio (size of the .obj over the size of the
+  .rfcp) and its error, and the totals of the batch.
+
+The exit code is 0 when every file is done or skipped, 1 otherwise.
+'''
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import signal
+import sys
+import time
+
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+
+from CommandLine import ConsoleLog, password
+from Main import cryptoCompress, cryptoExtract
+from Parallel import setDefaultWorkers
+
+import Profiling
+import Tracing
+
+STATUSES = ('done', 'skipped', 'failed', 'timeout', 'crashed')
+
+_extensions = {'compress': '.obj', 'extract': '.rfcp'}
+
+
+def outputName(mode, filename, outputDirectory):
+	stem = os.path.splitext(os.path.basename(filename))[0]
+	if mode == 'compress':
+		return stem + '.rfcp'
+	# Next to the .rfcp file, the extracted model must not replace the original one (see CommandLine.py)
+	return stem + '.obj' if outputDirectory is not None else stem + 'out.obj'
+
+
+def isUpToDate(job):
+	return os.path.exists(job['output']) and os.path.getmtime(job['output']) >= os.path.getmtime(job['input'])
+
+
+# Entry of a file in the report
+def entry(job, status, seconds = 0.0, error = None):
+	inputBytes = os.path.getsize(job['input'])
+	outputBytes = os.path.getsize(job['output']) if status in ('done', 'skipped') else None
+	modelBytes, compressedBytes = (inputBytes, outputBytes) if job['mode'] == 'compress' else (outputBytes, inputBytes)
+	return {
+		'input': job['input'],
+		'output': job['output'],
+		'status': status,
+		'seconds': seconds,
+		'inputBytes': inputBytes,
+		'outputBytes': outputBytes,
+		'ratio': modelBytes / compressedBytes if modelBytes and compressedBytes else None,
+		'error': error,
+	}
+
+
+# Removes the temporary output of a job, left by a job which did not complete
+def removePartial(job):
+	partial = job['output'] + '.part'
+	if os.path.exists(partial):
+		os.remove(partial)
+
+
+# One file, in a worker: the output is written under a temporary name, renamed once complete
+def runJob(job):
+	start = time.perf_counter()
+	partial = job['output'] + '.part'
+	try:
+		os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+		with contextlib.redirect_stdout(io.StringIO()):
+			if job['mode'] == 'compress':
+				cryptoCompress(job['password'], job['input'], partial, ConsoleLog(None), {}, **job['options'])
+			else:
+				cryptoExtract(job['password'], job['input'], partial, ConsoleLog(None), {}, show=False, **job['options'])
+		os.replace(partial, job['output'])
+	except Exception as e:
+		return entry(job, 'failed', time.perf_counter() - start, f'{type(e).__name__}: {e}')
+	finally:
+		# Also when the job is interrupted (KeyboardInterrupt, or SystemExit on SIGTERM)
+		removePartial(job)
+
+	return entry(job, 'done', time.perf_counter() - start)
+
+
+def terminate(signalNumber, frame):
+	sys.exit(128 + signalNumber)
+
+
+# Loop of a worker process: runs the jobs received on connection until None, sending back their entries
+# A SIGTERM exits through the finally blocks, which remove the temporary output of the running job
+def workerLoop(connection):
+	setDefaultWorkers(1)
+	signal.signal(signal.SIGTERM, terminate)
+	try:
+		for job in iter(connection.recv, None):
+			connection.send(runJob(job))
+	except (EOFError, KeyboardInterrupt):
+		pass
+	finally:
+		# The atexit functions do not run in the processes of multiprocessing
+		Tracing.disable()
+		Profiling.disable()
+
+
+# Worker process with its own pipe, so that killing it cannot break the pipes of the others
+class Worker:
+	def __init__(self, context):
+		self.connection, child = context.Pipe()
+		self.process = context.Process(target=workerLoop, args=(child,), daemon=True)
+		self.process.start()
+		child.close()
+		self.job = None
+		self.start = None
+
+	def submit(self, job):
+		self.connection.send(job)
+		self.job = job
+		self.start = time.monotonic()
+
+	def kill(self):
+		self.process.kill()
+		self.process.join()
+		self.connection.close()
+
+	def stop(self):
+		try:
+			self.connection.send(None)
+		except OSError:
+			pass
+		self.process.join(5)
+		if self.process.is_alive():
+			self.process.kill()
+			self.process.join()
+		self.connection.close()
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Files of the inputs (directories, glob patterns or files) with the extension of the mode, sorted
+def batchFiles(inputs, mode):
+	extension = _extensions[mode]
+	files = set()
+	for path in inputs:
+		if os.path.isdir(path):
+			files.update(glob.glob(os.path.join(path, '**', '*' + extension), recursive=True))
+		else:
+			files.update(filename for filename in glob.glob(path, recursive=True) if os.path.isfile(filename))
+	return sorted(files)
+
+
+# Job of every file: its output (see the module description), password and options of cryptoCompress or cryptoExtract
+def batchJobs(files, mode, key, outputDirectory = None, **options):
+	root = os.path.commonpath([os.path.dirname(os.path.abspath(filename)) for filename in files]) if len(files) > 0 else ''
+	jobs = []
+	for filename in files:
+		directory = os.path.dirname(filename)
+		if outputDirectory is not None:
+			directory = os.path.join(outputDirectory, os.path.relpath(os.path.dirname(os.path.abspath(filename)), root))
+		output = os.path.normpath(os.path.join(directory, outputName(mode, filename, outputDirectory)))
+		jobs.append({'mode': mode, 'input': filename, 'output': output, 'password': key, 'options': options})
+
+	return jobs
+
+
+# Runs the jobs on workers processes, yielding the entry of every file as soon as it is known (the up-to-date files
+# first, unless force); files taking more than timeout seconds are stopped
+# The temporary outputs left by a batch that was killed are removed first
+def runBatch(jobs, workers = None, timeout = None, force = False):
+	for job in jobs:
+		removePartial(job)
+
+	pending = []
+	for job in jobs:
+		if not force and isUpToDate(job):
+			yield entry(job, 'skipped')
+		else:
+			pending.append(job)
+	pending.sort(key=lambda job: os.path.getsize(job['input']), reverse=True)
+	if len(pending) == 0:
+		return
+
+	context = get_context('spawn')
+	pool = [Worker(context) for _ in range(min(workers or os.cpu_count() or 1, len(pending)))]
+	try:
+		while len(pending) > 0 or any(worker.job is not None for worker in pool):
+			for worker in pool:
+				if worker.job is None and len(pending) > 0:
+					worker.submit(pending.pop(0))
+
+			busy = [worker for worker in pool if worker.job is not None]
+			wait([worker.connection for worker in busy], 0.1)
+			for index, worker in enumerate(pool):
+				if worker.job is None:
+					continue
+
+				result = None
+				crashed = False
+				if worker.connection.poll():
+					try:
+						result = worker.connection.recv()
+					except (EOFError, OSError):
+						crashed = True
+				elif not worker.process.is_alive():
+					crashed = True
+				elif timeout is not None and time.monotonic() - worker.start > timeout:
+					result = entry(worker.job, 'timeout', time.monotonic() - worker.start, f'Stopped after {timeout} s')
+				if crashed:
+					worker.process.join(1)
+					result = entry(worker.job, 'crashed', time.monotonic() - worker.start, f'Worker exited with code {worker.process.exitcode}')
+				if result is None:
+					continue
+
+				if result['status'] in ('timeout', 'crashed'):
+					worker.kill()
+					removePartial(worker.job)
+					pool[index] = Worker(context)
+				worker.job = None
+				yield result
+	finally:
+		for worker in pool:
+			if worker.job is None:
+				worker.stop()
+			else:
+				worker.kill()
+				removePartial(worker.job)
+
+
+# Report of a batch: its settings, totals and the entries of every file (sorted by input)
+def batchReport(entries, mode, workers, timeout, seconds):
+	totals = {'files': len(entries), **{status: sum(entry['status'] == status for entry in entries) for status in STATUSES}}
+	processed = [entry for entry in entries if entry['status'] in ('done', 'skipped')]
+	totals['inputBytes'] = sum(entry['inputBytes'] for entry in processed)
+	totals['outputBytes'] = sum(entry['outputBytes'] for entry in processed)
+	modelBytes, compressedBytes = (totals['inputBytes'], totals['outputBytes']) if mode == 'compress' else (totals['outputBytes'], totals['inputBytes'])
+	totals['ratio'] = modelBytes / compressedBytes if compressedBytes else None
+	totals['seconds'] = seconds
+	totals['fileSeconds'] = sum(entry['seconds'] for entry in entries)
+
+	return {
+		'mode': mode,
+		'workers': workers,
+		'timeout': timeout,
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'totals': totals,
+		'files': sorted(entries, key=lambda entry: entry['input']),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Compresses or extracts many files over a pool of worker processes')
+	parser.add_argument('mode', choices=('compress', 'extract'))
+	parser.add_argument('inputs', nargs='+', help='directories, glob patterns (quoted, ** for any subdirectory) or files')
+	parser.add_argument('--output-dir', help='directory of the outputs (next to the inputs by default)')
+	parser.add_argument('--password', help='password (RFCP_PASSWORD, or asked, by default)')
+	parser.add_argument('--workers', type=int, help='worker processes (every core by default)')
+	parser.add_argument('--timeout', type=float, help='seconds after which a file is stopped')
+	parser.add_argument('--force', action='store_true', help='also process the files whose output is up to date')
+	parser.add_argument('--report', help='JSON report (batch_report.json in the output directory by default)')
+	parser.add_argument('--quiet', action='store_true', help='no progress on stderr')
+	parser.add_argument('--no-normals', action='store_true', help='compress: do not store the normals')
+	parser.add_argument('--chunks', type=int, default=0, help='compress: chunks of at most this many triangles')
+	parser.add_argument('--payload', action='store_true', help='compress: entropy code and encrypt the payload')
+	parser.add_argument('--compact', action='store_true', help='use less memory (integer positions, float32 normals)')
+	arguments = parser.parse_args()
+
+	files = batchFiles(arguments.inputs, arguments.mode)
+	if len(files) == 0:
+		parser.error(f'no {_extensions[arguments.mode]} file in {", ".join(arguments.inputs)}')
+
+	options = {'compact': arguments.compact}
+	if arguments.mode == 'compress':
+		options.update(storeNormals=not arguments.no_normals, chunkTriangles=arguments.chunks, compressPayload=arguments.payload)
+	jobs = batchJobs(files, arguments.mode, password(arguments), arguments.output_dir, **options)
+	reportFilename = arguments.report or os.path.join(arguments.output_dir or '.', 'batch_report.json')
+
+	entries = []
+	start = time.perf_counter()
+	try:
+		for result in runBatch(jobs, arguments.workers, arguments.timeout, arguments.force):
+			entries.append(result)
+			if not arguments.quiet:
+				print(f"[{len(entries)}/{len(jobs)}] {result['status']:<8}{result['seconds']:>8.2f} s  {result['input']}" + (f"  {result['error']}" if result['error'] else ''), file=sys.stderr)
+	except KeyboardInterrupt:
+		print('Interrupted: run the same command again to resume', file=sys.stderr)
+	finally:
+		report = batchReport(entries, arguments.mode, arguments.workers or os.cpu_count(), arguments.timeout, time.perf_counter() - start)
+		os.makedirs(os.path.dirname(reportFilename) or '.', exist_ok=True)
+		with open(reportFilename, 'w') as file:
+			json.dump(report, file, indent=4)
+
+	totals = report['totals']
+	print(', '.join(f'{totals[status]} {status}' for status in STATUSES) + f" in {totals['seconds']:.1f} s, report saved to {reportFilename}", file=sys.stderr)
+	return 0 if totals['done'] + totals['skipped'] == len(jobs) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,290 @@
+'''
+Stage-by-stage benchmark of the codec over the models of Models/ (or any list of .obj files), and over synthetic meshes
+of increasing sizes (see Synthetic.py).
+
+Every model goes through cryptoCompress and cryptoExtract, and each of their stages is timed by its tracing span (see
+Main.py): compress.import, compress.quantization (quantization and preprocessing), compress.traversal (Edgebreaker),
+compress.sections (positions, normals and CLERS), compress.encryption, compress.write, extract.read,
+extract.decryption, extract.traversal (Edgebreaker), extract.dequantization and extract.export. The first warmup runs
+are not kept, the next repeat runs give the min, median and mean time of each stage and of the whole run, and the
+triangles per second of the median. The vertices and triangles are the ones of the encoded mesh (once quantized and
+preprocessed), which the bits per vertex and per triangle are computed from. Each model runs in its own process, so the
+peak memory reported is the peak resident set size of that model only. A synthetic mesh is generated once per process,
+before the runs, and written to a temporary .obj file.
+
+With --memory, every stage also gets its peak memory traced by tracemalloc and its peak resident set size (sampled
+every 10 ms), the largest over the runs, and the lines which allocated the most memory still held at its end, in the
+last run (see the memory mode of Tracing.py). tracemalloc slows the stages down several times: measure the times and
+the memory in separate runs.
+
+The scaling curves give, for each synthetic shape, the median time of every stage and the peak memory against the
+number of triangles.
+
+The results are saved as JSON, with the machine, Python and NumPy versions, to compare machines and branches:
+	python Benchmark.py --repeat 5 --output benchmark.json
+	python Benchmark.py ../Models/bunny.obj --no-normals
+	python Benchmark.py --synthetic sphere,torus,terrain --sizes 10000,100000,1000000 --output scaling.json
+	python Benchmark.py ../Models/Igea.obj --memory --repeat 1
+	python Benchmark.py --profile "compress.*,extract.*" --profile-dir profiles		# one profile per stage and model
+'''
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from CommandLine import ConsoleLog
+from ImportExport import objExporter
+from Main import cryptoCompress, cryptoExtract
+from Synthetic import isSynthetic, syntheticMesh
+from Profiling import aggregate
+from Tracing import collect, enable, enableMemory, isEnabled
+
+STAGES = ('compress.import', 'compress.quantization', 'compress.traversal', 'compress.sections', 'compress.encryption', 'compress.write', 'extract.read', 'extract.decryption', 'extract.traversal', 'extract.dequantization', 'extract.export')
+
+# Prefix of the stages of the spans held by each pipeline function
+_pipelines = {'cryptoCompress': 'compress.', 'cryptoExtract': 'extract.'}
+
+_modelsDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Models')
+
+
+# One compression and extraction of the model (an .obj file) in directory, with cryptoCompress and cryptoExtract
+# Returns the time of every stage (from the events of their spans, tracing must be enabled) and of the whole run, the
+# memory of every stage in the memory mode, the vertices and triangles of the encoded mesh and the bits of the file
+# The files are named after the model, which labels their profiles (see Profiling.setLabel)
+def runPipeline(model, directory, password = 'benchmark', storeNormals = True, chunkTriangles = 0, compressPayload = False):
+	stem = os.path.join(directory, os.path.splitext(os.path.basename(model))[0])
+	filename = stem + '.rfcp'
+	log = ConsoleLog(None)
+
+	with collect() as events:
+		cryptoCompress(password, model, filename, log, {}, storeNormals=storeNormals, chunkTriangles=chunkTriangles, compressPayload=compressPayload)
+		cryptoExtract(password, filename, stem + 'out.obj', log, {}, show=False)
+
+	times = {}
+	memory = {}
+	total = 0.0
+	for event in events:
+		if event['name'] in _pipelines and event['args']['depth'] == 0:
+			total += event['dur'] / 1e6
+		prefix = _pipelines.get(event['args'].get('parent'))
+		if prefix is None:
+			continue
+		times[prefix + event['name']] = event['dur'] / 1e6
+		if 'memoryPeak' in event['args']:
+			memory[prefix + event['name']] = {key: event['args'][key] for key in ('memoryPeak', 'rssPeak', 'memoryAllocated', 'topSites') if key in event['args']}
+		if prefix + event['name'] == 'compress.quantization':
+			vertexCount, triangleCount = event['args']['vertices'], event['args']['triangles']
+
+	return times, total, memory, vertexCount, triangleCount, os.path.getsize(filename) * 8
+
+
+def summarize(values, triangleCount):
+	median = statistics.median(values)
+	return {
+		'min': min(values),
+		'median': median,
+		'mean': statistics.mean(values),
+		'trianglesPerSecond': triangleCount / median if median > 0 else None,
+	}
+
+
+def modelName(model):
+	return model if isSynthetic(model) else os.path.basename(model)
+
+
+# Largest peak memory of every stage over the runs, with the top allocation sites of the last run
+def stageMemory(runs):
+	memory = {}
+	for stage in STAGES:
+		measures = [run[stage] for run in runs if stage in run]
+		if len(measures) == 0:
+			continue
+		memory[stage] = {
+			'memoryPeak': max(measure['memoryPeak'] for measure in measures),
+			'rssPeak': max(measure['rssPeak'] for measure in measures),
+			'memoryAllocated': measures[-1]['memoryAllocated'],
+			'topSites': measures[-1].get('topSites', []),
+		}
+
+	return memory
+
+
+# Benchmark of one model (an .obj file or a synthetic mesh specification): warmup runs, then repeat timed runs (the
+# codec's own prints are silenced), with the memory of every stage in the memory mode
+def benchmarkModel(job):
+	model, warmup, repeat, options, memory = job
+	runs = []
+	totals = []
+	memoryRuns = []
+	try:
+		# The stages are timed by their spans, measured without being saved unless a trace file is given
+		if not isEnabled():
+			enable()
+		if memory:
+			enableMemory(sitesDepth=1)
+		with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+			if isSynthetic(model):
+				filename = os.path.join(directory, modelName(model).replace(':', '_') + '.obj')
+				objExporter(filename, syntheticMesh(model))
+				model = filename
+			for run in range(warmup + repeat):
+				times, total, stagesMemory, vertexCount, triangleCount, bits = runPipeline(model, directory, **options)
+				if run >= warmup:
+					runs.append(times)
+					totals.append(total)
+					memoryRuns.append(stagesMemory)
+	except Exception as e:
+		return {'model': modelName(job[0]), 'error': f'{type(e).__name__}: {e}'}
+
+	result = {
+		'model': modelName(job[0]),
+		'vertices': vertexCount,
+		'triangles': triangleCount,
+		'bits': bits,
+		'bitsPerVertex': bits / vertexCount if vertexCount > 0 else None,
+		'bitsPerTriangle': bits / triangleCount if triangleCount > 0 else None,
+		'stages': {stage: summarize([times[stage] for times in runs], triangleCount) for stage in STAGES},
+		'total': summarize(totals, triangleCount),
+		'peakMemory': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+	}
+	if memory:
+		result['memory'] = stageMemory(memoryRuns)
+	return result
+
+
+def environment():
+	return {
+		'machine': platform.machine(),
+		'processor': platform.processor(),
+		'system': platform.platform(),
+		'cpuCount': os.cpu_count(),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+	}
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Every .obj file of the Models/ directory
+def corpusModels(directory = _modelsDirectory):
+	return sorted(glob.glob(os.path.join(directory, '*.obj')))
+
+
+# Synthetic mesh specifications of every shape at every size, like "sphere:10000"
+def syntheticModels(shapes, sizes):
+	return [f'{shape}:{size}' for shape in shapes for size in sizes]
+
+
+# Time of every stage and peak memory against the number of triangles, for every synthetic shape of the results
+def scalingCurves(results):
+	curves = {}
+	for result in results:
+		if 'error' in result or not isSynthetic(result['model']):
+			continue
+		curve = curves.setdefault(result['model'].split(':')[0], {'triangles': [], 'total': [], 'peakMemory': [], 'stages': {stage: [] for stage in STAGES}})
+		curve['triangles'].append(result['triangles'])
+		curve['total'].append(result['total']['median'])
+		curve['peakMemory'].append(result['peakMemory'])
+		for stage in STAGES:
+			curve['stages'][stage].append(result['stages'][stage]['median'])
+
+	return curves
+
+
+# Benchmark results of every model (see runPipeline for the options), each model in a fresh process, with the memory of
+# every stage when memory is True
+def benchmark(models, warmup = 1, repeat = 3, memory = False, **options):
+	results = []
+	for model in models:
+		with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+			results.append(pool.submit(benchmarkModel, (model, warmup, repeat, options, memory)).result())
+
+	return {
+		'environment': environment(),
+		'warmup': warmup,
+		'repeat': repeat,
+		'memory': memory,
+		'options': options,
+		'models': results,
+		'scaling': scalingCurves(results),
+	}
+
+
+def printResults(results):
+	print(f"{'model':<28}{'triangles':>10}{'bits/vertex':>13}{'total (s)':>11}{'triangles/s':>13}{'peak (MB)':>11}")
+	for result in results['models']:
+		if 'error' in result:
+			print(f"{result['model']:<28}{result['error']}")
+			continue
+		print(f"{result['model']:<28}{result['triangles']:>10}{result['bitsPerVertex']:>13.2f}{result['total']['median']:>11.3f}{result['total']['trianglesPerSecond']:>13.0f}{result['peakMemory'] / 2 ** 20:>11.1f}")
+
+	for result in results['models']:
+		if 'memory' not in result:
+			continue
+		print(f"\n{result['model']:<28}{'traced (MB)':>13}{'RSS (MB)':>11}  top allocation site")
+		for stage, memory in result['memory'].items():
+			site = memory['topSites'][0] if memory['topSites'] else None
+			print(f"  {stage:<26}{memory['memoryPeak'] / 2 ** 20:>13.1f}{memory['rssPeak'] / 2 ** 20:>11.1f}" + (f"  {site['site']} ({site['size'] / 2 ** 20:.1f} MB)" if site else ''))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Stage-by-stage benchmark of the codec')
+	parser.add_argument('models', nargs='*', help='.obj files or synthetic meshes like sphere:100000 (every model of Models/ by default)')
+	parser.add_argument('--synthetic', help='comma separated synthetic shapes to run at every size of --sizes (sphere, torus, terrain)')
+	parser.add_argument('--sizes', default='10000,100000,1000000', help='comma separated numbers of triangles of the synthetic meshes')
+	parser.add_argument('--warmup', type=int, default=1, help='untimed runs before the timed ones')
+	parser.add_argument('--repeat', type=int, default=3, help='timed runs')
+	parser.add_argument('--output', help='JSON file to save the results to')
+	parser.add_argument('--no-normals', action='store_true', help='do not store the normals')
+	parser.add_argument('--chunks', type=int, default=0, help='compress as chunks of at most this many triangles')
+	parser.add_argument('--payload', action='store_true', help='entropy code the payload')
+	parser.add_argument('--memory', action='store_true', help='peak memory and top allocation sites of every stage (slows the stages down)')
+	parser.add_argument('--profile', metavar='STAGES', help='comma separated patterns of the stages to profile, like compress.traversal or "*" (see Profiling.py)')
+	parser.add_argument('--profile-dir', default='profiles', help='directory of the profiles')
+	parser.add_argument('--profile-sampling', type=float, metavar='INTERVAL', help='sample the stacks every INTERVAL seconds instead of using cProfile')
+	arguments = parser.parse_args()
+
+	# The models run in their own processes, which enable the profiling from the environment
+	if arguments.profile:
+		os.environ['RFCP_PROFILE'] = arguments.profile
+		os.environ['RFCP_PROFILE_DIR'] = arguments.profile_dir
+		if arguments.profile_sampling:
+			os.environ['RFCP_PROFILE_SAMPLING'] = str(arguments.profile_sampling)
+
+	models = list(arguments.models)
+	if arguments.synthetic:
+		models += syntheticModels(arguments.synthetic.split(','), [int(float(size)) for size in arguments.sizes.split(',')])
+
+	results = benchmark(models or corpusModels(), arguments.warmup, arguments.repeat, arguments.memory, storeNormals=not arguments.no_normals, chunkTriangles=arguments.chunks, compressPayload=arguments.payload)
+	printResults(results)
+
+	if arguments.output:
+		with open(arguments.output, 'w') as file:
+			json.dump(results, file, indent=4)
+
+	if arguments.profile:
+		aggregate(arguments.profile_dir)
+		print(f'\nProfiles of every stage merged in {os.path.join(arguments.profile_dir, "aggregate")}')
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,132 @@
+'''
+Mesh cleanup on index arrays, replacing the Open3D chain: duplicated vertices, degenerate triangles, duplicated
+triangles, triangles on non-manifold edges and unreferenced vertices are removed with sorts and numpy.unique, without
+building an intermediate mesh. The vertices are merged first, so that the triangles the merge makes degenerate or
+duplicated are removed too.
+'''
+
+import numpy
+
+from Tracing import traced
+
+
+# Distinct rows of an integer array, like numpy.unique(axis=0) but with a lexsort instead of sorting the rows as
+# structured values: returns the index of the first occurrence of every distinct row, the distinct row of every row,
+# and how many times each distinct row occurs
+def groupRows(rows):
+	rows = rows.reshape(len(rows), -1)
+	order = numpy.lexsort(rows.T[::-1])
+	sortedRows = rows[order]
+	starts = numpy.r_[True, (sortedRows[1:] != sortedRows[:-1]).any(axis=1)]
+
+	inverse = numpy.empty(len(rows), dtype=numpy.int64)
+	inverse[order] = numpy.cumsum(starts) - 1
+	return order[starts], inverse, numpy.diff(numpy.r_[numpy.flatnonzero(starts), len(rows)])
+
+
+# Edge of every corner of the triangles (from the corner to the next one) as a distinct edge id, and the number of
+# corners on every edge
+def edgeValences(triangles, vertexCount):
+	next = numpy.roll(triangles, -1, axis=1)
+	keys = numpy.minimum(triangles, next) * vertexCount + numpy.maximum(triangles, next)
+	_, edgeIds, edgeCounts = groupRows(keys.reshape(-1, 1))
+	return edgeIds, edgeCounts
+
+
+def triangleAreas(vertices, triangles):
+	vertices = vertices.astype(numpy.float64, copy=False)
+	a = vertices[triangles[:, 0]]
+	return 0.5 * numpy.linalg.norm(numpy.cross(vertices[triangles[:, 1]] - a, vertices[triangles[:, 2]] - a), axis=1)
+
+
+# Triangles to keep so that no edge has more than 2 triangles: the smallest remaining triangle of every such edge is
+# removed, until all of them are manifold
+def manifoldTriangles(vertices, triangles):
+	keep = numpy.ones(len(triangles), dtype=bool)
+	edgeIds, edgeCounts = edgeValences(triangles, len(vertices))
+	if not (edgeCounts > 2).any():
+		return keep
+
+	areas = triangleAreas(vertices, triangles)
+	cornerTriangles = numpy.arange(3 * len(triangles)) // 3
+	while True:
+		corners = numpy.flatnonzero(keep[cornerTriangles])
+		counts = numpy.bincount(edgeIds[corners], minlength=len(edgeCounts))
+		corners = corners[counts[edgeIds[corners]] > 2]
+		if len(corners) == 0:
+			return keep
+
+		# Last triangle of each non-manifold edge, by decreasing area (the last one on ties)
+		order = numpy.lexsort((cornerTriangles[corners], -areas[cornerTriangles[corners]], edgeIds[corners]))
+		sortedEdges = edgeIds[corners][order]
+		ends = numpy.r_[sortedEdges[1:] != sortedEdges[:-1], True]
+		keep[cornerTriangles[corners[order[ends]]]] = False
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Returns the cleaned vertices, normals (None if there are none) and triangles, and the number of removed elements
+# Duplicated vertices are merged on their exact position, the first one (and its normal) is kept
+def cleanMesh(vertices, triangles, normals = None):
+	vertices = numpy.asarray(vertices)
+	triangles = numpy.asarray(triangles, dtype=numpy.int64).reshape(-1, 3)
+	if normals is not None and len(normals) != len(vertices):
+		normals = None
+	removed = {}
+
+	# Merge each vertex into the first vertex at the exact same position (-0.0 and 0.0 included)
+	firstVertex, welded, _ = groupRows((numpy.ascontiguousarray(vertices, dtype=numpy.float64) + 0.0).view(numpy.int64))
+	merged = firstVertex[welded]
+	removed['duplicatedVertices'] = len(vertices) - len(firstVertex)
+	triangles = merged[triangles]
+
+	degenerate = (triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2]) | (triangles[:, 2] == triangles[:, 0])
+	triangles = triangles[~degenerate]
+	removed['degenerateTriangles'] = int(degenerate.sum())
+
+	# Duplicated triangles have the same vertices in the same cyclic order (opposite orientations are kept)
+	rotations = (numpy.argmin(triangles, axis=1)[:, None] + numpy.arange(3)) % 3
+	first, _, _ = groupRows(numpy.take_along_axis(triangles, rotations, axis=1))
+	removed['duplicatedTriangles'] = len(triangles) - len(first)
+	triangles = triangles[numpy.sort(first)]
+
+	keep = manifoldTriangles(vertices, triangles)
+	triangles = triangles[keep]
+	removed['nonManifoldTriangles'] = int((~keep).sum())
+
+	# Compact the referenced vertices, in their original order
+	referenced = numpy.zeros(len(vertices), dtype=bool)
+	referenced[triangles.ravel()] = True
+	newIds = numpy.cumsum(referenced) - 1
+	removed['unreferencedVertices'] = int(len(vertices) - removed['duplicatedVertices'] - referenced.sum())
+
+	vertices = vertices[referenced]
+	if normals is not None:
+		normals = numpy.asarray(normals)[referenced]
+	return vertices, normals, newIds[triangles], removed
+
+
+# Clean a mesh in place with cleanMesh (its triangle normals are dropped)
+@traced
+def preProcess(mesh, doPrint = False):
+	if doPrint:
+		print(f'Before preprocessing:')
+		print(f'Vertices: {len(mesh.vertices)}')
+		print(f'Triangles: {len(mesh.triangles)}')
+
+	normals = numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+	vertices, normals, triangles, removed = cleanMesh(numpy.asarray(mesh.vertices), numpy.asarray(mesh.triangles), normals)
+	mesh.triangle_normals = None
+	mesh.triangles = triangles
+	mesh.vertices = vertices
+	mesh.vertex_normals = normals
+
+	if doPrint:
+		print(f'Removed: {removed}')
+		print(f'After preprocessing:')
+		print(f'Vertices: {len(mesh.vertices)}')
+		print(f'Triangles: {len(mesh.triangles)}')
+
+	return mesh
@@ -0,0 +1,210 @@
+'''
+Headless command line of the codec, for scripts and job runners: compresses, extracts and inspects files without
+tkinter or Open3D, which are only imported by the GUI (Main.main) and by the viewer of extract --show.
+
+	python CommandLine.py compress ../Models/bunny.obj bunny.rfcp --password secret
+	python CommandLine.py extract bunny.rfcp bunny.obj --password secret
+	python CommandLine.py inspect bunny.rfcp					# header only, no password needed
+	python CommandLine.py inspect bunny.rfcp --password secret --json
+
+The password is read from --password, else from the RFCP_PASSWORD environment variable, else asked on the terminal.
+The progress goes to stderr (--quiet silences it) and the codec's own debug prints are dropped (--verbose keeps them),
+so that stdout only holds the output of inspect. The exit code is 0 on success, 1 on error.
+
+--trace and --profile enable the tracing (see Tracing.py) and the profiling (see Profiling.py) of the run.
+
+Most of the startup of a process is the import of NumPy: the imports of the codec come next, and multiprocessing,
+cProfile and the Metrics are only imported when they are used (a parallel map, profiling, or compress --report).
+'''
+
+import argparse
+import contextlib
+import getpass
+import io
+import json
+import os
+import sys
+
+from ImportExport import objImporter, readFile
+from Main import cryptoCompress, cryptoExtract, decodeMesh
+from Encryption import decrypt
+from Quantization import CIPHER_KEYED_PERMUTATION, CIPHER_COUNTER_KEYSTREAM, CIPHER_BLOCK_PERMUTATION, CIPHER_PAYLOAD, CIPHER_PLANES_SHIFT, FLAG_NO_NORMALS, FLAG_COMPONENTS, FLAG_CHUNKS, FLAG_PROGRESSIVE, FLAG_SEQUENCE, FLAG_NONCE, headerSize, readHeader
+
+import Profiling
+import Tracing
+
+FLAGS = {
+	'noNormals': FLAG_NO_NORMALS,
+	'components': FLAG_COMPONENTS,
+	'chunks': FLAG_CHUNKS,
+	'progressive': FLAG_PROGRESSIVE,
+	'sequence': FLAG_SEQUENCE,
+	'nonce': FLAG_NONCE,
+}
+
+CIPHERS = {
+	'keyedPermutation': CIPHER_KEYED_PERMUTATION,
+	'counterKeystream': CIPHER_COUNTER_KEYSTREAM,
+	'blockPermutation': CIPHER_BLOCK_PERMUTATION,
+	'payload': CIPHER_PAYLOAD,
+}
+
+
+# Log widget of the crypto functions of Main, writing to a stream (nothing if None)
+class ConsoleLog:
+	def __init__(self, stream):
+		self.stream = stream
+
+	def insert(self, index, text):
+		if self.stream is not None:
+			self.stream.write(text)
+			self.stream.flush()
+
+
+def password(arguments):
+	if arguments.password is not None:
+		return arguments.password
+	if os.environ.get('RFCP_PASSWORD'):
+		return os.environ['RFCP_PASSWORD']
+	return getpass.getpass('Password: ')
+
+
+# The codec's debug prints, dropped unless verbose
+def codecOutput(arguments):
+	if arguments.verbose:
+		return contextlib.nullcontext()
+	return contextlib.redirect_stdout(io.StringIO())
+
+
+def compressCommand(arguments):
+	output = arguments.output or os.path.splitext(arguments.model)[0] + '.rfcp'
+	log = ConsoleLog(None if arguments.quiet else sys.stderr)
+	key = password(arguments)
+	with codecOutput(arguments):
+		cryptoCompress(key, arguments.model, output, log, {}, storeNormals=not arguments.no_normals, chunkTriangles=arguments.chunks, progressive=arguments.progressive, blockScrambling=arguments.block_scrambling, planes=arguments.planes, compressPayload=arguments.payload, compact=arguments.compact, reportFilename=arguments.report)
+
+
+def extractCommand(arguments):
+	output = arguments.output or os.path.splitext(arguments.file)[0] + 'out.obj'
+	log = ConsoleLog(None if arguments.quiet else sys.stderr)
+	key = password(arguments)
+	with codecOutput(arguments):
+		cryptoExtract(key, arguments.file, output, log, {}, levels=arguments.levels, compact=arguments.compact, show=arguments.show)
+
+
+# Header of a .rfcp file (and its decoded mesh with a password), or the size and AABB of an .obj file
+def inspectFile(filename, key = None):
+	if filename.endswith('.obj'):
+		mesh = objImporter(filename)
+		return {
+			'file': filename,
+			'bytes': os.path.getsize(filename),
+			'vertices': len(mesh.vertices),
+			'triangles': len(mesh.triangles),
+			'normals': mesh.has_vertex_normals(),
+			'min': mesh.vertices.min(axis=0).tolist() if len(mesh.vertices) > 0 else None,
+			'max': mesh.vertices.max(axis=0).tolist() if len(mesh.vertices) > 0 else None,
+		}
+
+	bitstring = readFile(filename)
+	if len(bitstring) < headerSize:
+		raise ValueError(f'{filename} is too short to hold a header')
+	header = readHeader(bitstring)
+	information = {
+		'file': filename,
+		'bytes': os.path.getsize(filename),
+		'bits': len(bitstring),
+		'bitsPerVertex': len(bitstring) / header['vertexCount'] if header['vertexCount'] > 0 else None,
+		**header,
+		'flagNames': [name for name, flag in FLAGS.items() if header['flags'] & flag],
+		'cipherNames': [name for name, cipher in CIPHERS.items() if header['cipher'] & cipher],
+		'encryptedPlanes': header['cipher'] >> CIPHER_PLANES_SHIFT,
+	}
+
+	if key is not None:
+		bitstring = decrypt(bitstring, 10, key)
+		mesh = decodeMesh(bitstring)
+		information['decodedVertices'] = len(mesh.vertices)
+		information['decodedTriangles'] = len(mesh.triangles)
+		information['decodedNormals'] = mesh.has_vertex_normals()
+
+	return information
+
+
+def inspectCommand(arguments):
+	key = None
+	if arguments.password is not None or os.environ.get('RFCP_PASSWORD'):
+		key = password(arguments)
+	with codecOutput(arguments):
+		information = inspectFile(arguments.file, key)
+
+	if arguments.json:
+		print(json.dumps(information, indent=4))
+	else:
+		for name, value in information.items():
+			print(f'{name + ":":<18}{value}')
+
+
+def main(argv = None):
+	# Options of every command
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument('--quiet', action='store_true', help='no progress on stderr')
+	common.add_argument('--verbose', action='store_true', help="keep the codec's debug prints")
+	common.add_argument('--trace', metavar='FILE', help='save a trace of the run (a Chrome trace, or JSON lines for .jsonl)')
+	common.add_argument('--profile', metavar='STAGES', help='comma separated patterns of the stages to profile, like "compress.*" (see Profiling.py)')
+	common.add_argument('--profile-dir', default='profiles', help='directory of the profiles')
+	common.add_argument('--profile-sampling', type=float, metavar='INTERVAL', help='sample the stacks every INTERVAL seconds instead of using cProfile')
+
+	parser = argparse.ArgumentParser(description='Compresses, extracts and inspects RFCP files without a GUI')
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	compress = commands.add_parser('compress', parents=[common], help='compress and encrypt an .obj file')
+	compress.add_argument('model', help='.obj file')
+	compress.add_argument('output', nargs='?', help='.rfcp file (the model with the .rfcp extension by default)')
+	compress.add_argument('--password', help='password (RFCP_PASSWORD, or asked, by default)')
+	compress.add_argument('--no-normals', action='store_true', help='do not store the normals, they are rebuilt on extraction')
+	compress.add_argument('--chunks', type=int, default=0, help='compress as chunks of at most this many triangles')
+	compress.add_argument('--progressive', action='store_true', help='store a base mesh followed by refinement batches')
+	compress.add_argument('--block-scrambling', action='store_true', help='permute the positions inside blocks')
+	compress.add_argument('--planes', type=int, default=0, help='only encrypt this many high bit-planes')
+	compress.add_argument('--payload', action='store_true', help='entropy code and encrypt the payload')
+	compress.add_argument('--compact', action='store_true', help='use less memory (integer positions, float32 normals)')
+	compress.add_argument('--report', metavar='FILE', help='save the quality metrics of the compression as JSON')
+	compress.set_defaults(function=compressCommand)
+
+	extract = commands.add_parser('extract', parents=[common], help='decrypt and decompress an .rfcp file')
+	extract.add_argument('file', help='.rfcp file')
+	extract.add_argument('output', nargs='?', help='.obj file (the file name followed by out.obj by default)')
+	extract.add_argument('--password', help='password (RFCP_PASSWORD, or asked, by default)')
+	extract.add_argument('--levels', type=int, help='refinement batches to apply to a progressive file (all by default)')
+	extract.add_argument('--compact', action='store_true', help='use less memory (integer positions, float32 normals)')
+	extract.add_argument('--show', action='store_true', help='open the decoded mesh in the Open3D viewer')
+	extract.set_defaults(function=extractCommand)
+
+	inspect = commands.add_parser('inspect', parents=[common], help='print the header of an .rfcp file, or the size of an .obj file')
+	inspect.add_argument('file', help='.rfcp or .obj file')
+	inspect.add_argument('--password', help='also decode the mesh (or RFCP_PASSWORD)')
+	inspect.add_argument('--json', action='store_true', help='print JSON')
+	inspect.set_defaults(function=inspectCommand)
+
+	arguments = parser.parse_args(argv)
+
+	if arguments.trace:
+		Tracing.enable(arguments.trace)
+	if arguments.profile:
+		Profiling.enable(arguments.profile, arguments.profile_dir, arguments.profile_sampling)
+
+	try:
+		arguments.function(arguments)
+	except Exception as e:
+		print(f'error: {type(e).__name__}: {e}', file=sys.stderr)
+		return 1
+	finally:
+		Tracing.disable()
+		Profiling.disable()
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,18 +1,23 @@
 '''
-Python EdgeBreaker algorithm working with the Open3D library.
+Python EdgeBreaker algorithm working on NumPy arrays (Open3D is only used to draw the debug view).
 
 Implemented and improved from:
 https://www.cs.cmu.edu/~alla/edgebreaker_simple.pdf
 '''
 
-import cProfile
 import numpy
-import open3d
 import sys
 import time
 
+from array import array
 from datetime import datetime
-from pstats import Stats
+
+from EdgebreakerDecompression import decompressComponent
+from ImportExport import objImporter
+from Mesh import Mesh, toOpen3D
+from Parallel import parallelMap
+from Profiling import profiled
+from Tracing import traced
 
 
 # ------------------------------------------------------------
@@ -21,8 +26,6 @@ from pstats import Stats
 
 ## DEBUG AND VISUALIZATION
 
-_doProfiling = False				# Do some profiling
-
 _debug = False						# True if you want to enable color changes and delay between draw calls
 _debugPrint = False					# True if you want to enable debug prints
 
@@ -40,7 +43,10 @@ _lastUpdateTime = 0					# Last visual update time in seconds
 ## DATA STORAGE
 
 # Store frequently accessed data in numpy arrays to accelerate access time
-_halfEdges = None
+# Half-edge h goes from the corner h % 3 of the triangle h // 3 to the next corner
+_heVertex = None			# Vertex id the half-edge starts from
+_heNext = None				# Next half-edge in the triangle
+_heTwin = None				# Opposite half-edge in the adjacent triangle, -1 on a boundary
 _vertices = None
 _normals = None
 _triangles = None
@@ -49,11 +55,14 @@ _triangles = None
 ## EDGEBREAKER RELATED
 
 _mesh = None				# The original mesh
-_heMesh = None 				# The mesh containing half-edges data
+_heMesh = None 				# The Open3D mesh drawn in debug mode
 
 _clers = ""					# String storing the CLERS steps of the EdgeBreaker algorithm's path
-_deltas = []				# List of 3D points/vectors storing the first points and the correction vectors
-_outputNormals = []			# List of vertex normals
+_deltas = []				# Array of the first points and the correction vectors (see collectDeltas)
+_outputNormals = []			# Array of vertex normals
+_outputVertexIds = array('i')	# Vertex ids, in the order of the deltas
+_deltaTerms = array('i')	# For each delta, the vertex ids subtracted twice then added to its vertex position (-1 if unused)
+_storeNormals = True		# False if the vertex normals are not collected (they are rebuilt from the geometry on decode)
 
 _marked = []				# List of bool indicating whether a vertex has already been visited: M in the paper
 _flagged = []				# List of bool indicating whether a triangle has already been visited: U in the paper
@@ -72,8 +81,8 @@ _previousHeId = 0			# Id of the previously visited half-edge, used to calculate
 def initVars():
 	global _debugTriangleColor, _debugColorOffset, _debugRGBIndex, _debugRGBIncrease
 	global _visualizer, _lastUpdateTime
-	global _halfEdges, _vertices, _normals, _triangles
-	global _mesh, _heMesh, _clers, _deltas, _outputNormals, _marked, _flagged
+	global _heVertex, _heNext, _heTwin, _vertices, _normals, _triangles
+	global _mesh, _heMesh, _clers, _deltas, _outputNormals, _outputVertexIds, _deltaTerms, _storeNormals, _marked, _flagged
 	global _startingHalfEdge, _previousHeId
 
 	## DEBUG AND VISUALIZATION
@@ -89,7 +98,9 @@ def initVars():
 	## DATA STORAGE
 
 	# Store frequently accessed data in numpy arrays to accelerate access time
-	_halfEdges = None
+	_heVertex = None
+	_heNext = None
+	_heTwin = None
 	_vertices = None
 	_normals = None
 	_triangles = None
@@ -97,11 +108,14 @@ def initVars():
 	## EDGEBREAKER RELATED
 
 	_mesh = None				# The original mesh
-	_heMesh = None 				# The mesh containing half-edges data
+	_heMesh = None 				# The Open3D mesh drawn in debug mode
 
 	_clers = ""					# String storing the CLERS steps of the EdgeBreaker algorithm's path
-	_deltas = []				# List of 3D points/vectors storing the first points and the correction vectors
-	_outputNormals = []			# List of vertex normals
+	_deltas = []				# Array of the first points and the correction vectors (see collectDeltas)
+	_outputNormals = []			# Array of vertex normals
+	_outputVertexIds = array('i')	# Vertex ids, in the order of the deltas
+	_deltaTerms = array('i')	# For each delta, the vertex ids subtracted twice then added to its vertex position (-1 if unused)
+	_storeNormals = True		# False if the vertex normals are not collected (they are rebuilt from the geometry on decode)
 
 	_marked = []				# List of bool indicating whether a vertex has already been visited: M in the paper
 	_flagged = []				# List of bool indicating whether a triangle has already been visited: U in the paper
@@ -121,7 +135,7 @@ def initVars():
 def getVertexId(halfEdgeId):
 	if halfEdgeId == -1:
 		return -1
-	return _halfEdges[halfEdgeId].vertex_indices[0]
+	return _heVertex[halfEdgeId]
 
 
 ## HALF-EDGES
@@ -129,7 +143,7 @@ def getVertexId(halfEdgeId):
 def getNextHeId(halfEdgeId):
 	if halfEdgeId == -1:
 		return -1
-	return _halfEdges[halfEdgeId].next
+	return _heNext[halfEdgeId]
 
 
 def getPreviousHeId(halfEdgeId):
@@ -141,7 +155,7 @@ def getPreviousHeId(halfEdgeId):
 def getTwinHeId(halfEdgeId):
 	if halfEdgeId == -1:
 		return -1
-	return _halfEdges[halfEdgeId].twin
+	return _heTwin[halfEdgeId]
 
 
 def getOppositeCornerHeId(halfEdgeId):
@@ -187,7 +201,7 @@ def getVertexNormalFromHeId(halfEdgeId):
 def getTriangleFromHeId(halfEdgeId):
 	if halfEdgeId == -1:
 		return -1
-	return _halfEdges[halfEdgeId].triangle_index
+	return halfEdgeId // 3
 
 
 # ------------------------------------------------------------
@@ -258,43 +272,39 @@ def addVectors3D(v1, v2):
 # DELTAS
 # ------------------------------------------------------------
 
-def addPosToDeltas(halfEdgeId):
-	global _deltas, _outputNormals
-
-	vertexId = getVertexId(halfEdgeId)
-	_deltas.append(getVertexPosFromVertexId(vertexId))
+# The deltas are recorded as vertex ids and computed at once by collectDeltas
 
-	# Save vertex normal if there is
-	if _mesh.has_vertex_normals():
-		_outputNormals.append(getVertexNormalFromVertexId(vertexId))
+def addPosToDeltas(halfEdgeId):
+	_outputVertexIds.append(getVertexId(halfEdgeId))
+	_deltaTerms.extend((-1, -1, -1))
 
 
 def addDifferenceVectorToDeltas(previousHalfEdgeId, halfEdgeId):
-	global _deltas, _outputNormals
+	_outputVertexIds.append(getVertexId(halfEdgeId))
+	_deltaTerms.extend((getVertexId(previousHalfEdgeId), -1, -1))
 
-	vector = getDistanceVectorFromHeId(previousHalfEdgeId, halfEdgeId)
-	_deltas.append(vector)
 
-	# Save vertex normal if there is
-	if _mesh.has_vertex_normals():
-		_outputNormals.append(getVertexNormalFromHeId(halfEdgeId))
+def addCorrectionVectorToDeltas(halfEdgeId):
+	_outputVertexIds.append(getVertexId(halfEdgeId))
+	_deltaTerms.extend((getVertexId(getPreviousHeId(halfEdgeId)), getVertexId(getNextHeId(halfEdgeId)), getVertexId(getOppositeCornerHeId(halfEdgeId))))
 
 
-def addCorrectionVectorToDeltas(halfEdgeId):
+# Deltas and normals of the recorded vertices, as arrays
+# Integer positions give int32 deltas, since the difference and correction vectors can be negative
+def collectDeltas():
 	global _deltas, _outputNormals
 
-	hePos = getVertexPosFromHeId(halfEdgeId)
-	previousHePos = getVertexPosFromHeId(getPreviousHeId(halfEdgeId))
-	nextHePos = getVertexPosFromHeId(getNextHeId(halfEdgeId))
-	oppositeHePos = getVertexPosFromHeId(getOppositeCornerHeId(halfEdgeId))
+	vertexIds = numpy.asarray(_outputVertexIds)
+	terms = numpy.asarray(_deltaTerms).reshape(-1, 3)
+	vertices = _vertices if _vertices.dtype.kind == 'f' else _vertices.astype(numpy.int32)
 
-	correctionVector = addVectors3D(addVectors3D(addVectors3D(hePos, oppositeVector(previousHePos)), oppositeVector(nextHePos)), oppositeHePos)
+	_deltas = vertices[vertexIds]
+	for column, sign in enumerate((-1, -1, 1)):
+		used = terms[:, column] >= 0
+		if used.any():
+			_deltas[used] += sign * vertices[terms[used, column]]
 
-	_deltas.append(correctionVector)
-
-	# Save vertex normal if there is
-	if _mesh.has_vertex_normals():
-		_outputNormals.append(getVertexNormalFromHeId(halfEdgeId))
+	_outputNormals = _normals[vertexIds] if _storeNormals else numpy.empty((0, 3), dtype=_normals.dtype)
 
 
 # ------------------------------------------------------------
@@ -302,9 +312,12 @@ def addCorrectionVectorToDeltas(halfEdgeId):
 # ------------------------------------------------------------
 
 def debugInit():
-	global _debug, _visualizer
+	global _debug, _visualizer, _heMesh
 
 	if _debug:
+		import open3d
+
+		_heMesh = toOpen3D(_mesh)
 		_visualizer = open3d.visualization.Visualizer()
 		_visualizer.create_window()
 		_visualizer.add_geometry(_heMesh)
@@ -375,10 +388,10 @@ def debugPrintInfos():
 	debugPrint(f'\n##########   DEBUG   ##########')
 	nbChar = len(_clers)
 
-	debugPrint(f'  nbTriangles = {len(_heMesh.triangles)}')
-	debugPrint(f'? nbChar = {nbChar}/{(len(_heMesh.triangles) - 1)}')
+	debugPrint(f'  nbTriangles = {len(_triangles)}')
+	debugPrint(f'? nbChar = {nbChar}/{(len(_triangles) - 1)}')
 
-	debugPrint(f'  nbHalfEdges = {_halfEdges.size}')
+	debugPrint(f'  nbHalfEdges = {len(_heNext)}')
 	
 	C = _clers.count("C")
 	L = _clers.count("L")
@@ -386,8 +399,8 @@ def debugPrintInfos():
 	R = _clers.count("R")
 	S = _clers.count("S")
 
-	debugPrint(f'  nbVertices = {len(_heMesh.vertices)}')
-	debugPrint(f'? Identified as new during compression: {3 + C}/{len(_heMesh.vertices)}')
+	debugPrint(f'  nbVertices = {len(_vertices)}')
+	debugPrint(f'? Identified as new during compression: {3 + C}/{len(_vertices)}')
 
 	debugPrint(f'? C = {C}')
 	debugPrint(f'? L = {L}')
@@ -395,10 +408,7 @@ def debugPrintInfos():
 	debugPrint(f'? R = {R}')
 	debugPrint(f'? S = {S}')
 
-	borderVertexCounter = 0
-	for he in _heMesh.half_edges:
-		if he.is_boundary():
-			borderVertexCounter += 1
+	borderVertexCounter = _heTwin.count(-1)
 	debugPrint(f'? Border vertices: {borderVertexCounter}')
 	debugPrint(f'#######  END OF DEBUG   #######\n')
 
@@ -407,25 +417,56 @@ def debugPrintInfos():
 # Edgebreaker compression part
 # ------------------------------------------------------------
 
+# Half-edges of the triangles, in the order of Open3D's HalfEdgeTriangleMesh: half-edge 3 * t + i goes from the
+# corner i of the triangle t to the next corner, its twin is the half-edge going the other way (-1 if there is none)
+def buildHalfEdges(triangles, vertexCount):
+	starts = triangles.ravel().astype(numpy.int64)
+	ends = triangles[:, [1, 2, 0]].ravel().astype(numpy.int64)
+	halfEdgeIds = numpy.arange(len(starts))
+
+	keys = starts * vertexCount + ends
+	order = numpy.argsort(keys, kind='stable')
+	sortedKeys = keys[order]
+	twinKeys = ends * vertexCount + starts
+	found = numpy.minimum(numpy.searchsorted(sortedKeys, twinKeys), len(keys) - 1)
+	twins = numpy.where(sortedKeys[found] == twinKeys, order[found], -1)
+
+	nexts = halfEdgeIds - halfEdgeIds % 3 + (halfEdgeIds + 1) % 3
+	return starts, nexts, twins
+
+
 # Initialize the data used by EdgeBreaker
 def initData():
-	global _marked, _flagged, _halfEdges, _vertices, _normals, _triangles
+	global _marked, _flagged, _heVertex, _heNext, _heTwin, _vertices, _normals, _triangles
+
+	# Arrays of the mesh, without copies; the half-edges are int32 arrays of the array module, as fast as lists for
+	# single item access at a fraction of their size
+	_vertices = numpy.asarray(_mesh.vertices)
+	_normals = numpy.asarray(_mesh.vertex_normals)
+	_triangles = numpy.asarray(_mesh.triangles)
+	starts, nexts, twins = buildHalfEdges(_triangles, len(_vertices))
+	_heVertex = array('i', starts.astype(numpy.int32).tobytes())
+	_heNext = array('i', nexts.astype(numpy.int32).tobytes())
+	_heTwin = array('i', twins.astype(numpy.int32).tobytes())
+
+	# Marks and flags, one byte each
+	_flagged = bytearray(len(_triangles))		# Flags: if a triangle has been visited or not
+
+	# Marks: if a vertex has been visited or not, boundary vertices are marked as "seen"
+	marked = numpy.zeros(len(_vertices), dtype=bool)
+	boundary = twins == -1
+	marked[starts[boundary]] = True
+	marked[_triangles[:, [1, 2, 0]].ravel()[boundary]] = True
+	_marked = bytearray(marked.tobytes())
 
-	# Marks and flags
-	_marked = [False] * len(_heMesh.vertices) 		# Marks: if a vertex has been visited or not
-	_flagged = [False] * len(_heMesh.triangles)		# Flags: if a triangle has been visited or not
 
-	# Numpy arrays for acceleration
-	_halfEdges = numpy.array(_heMesh.half_edges)
-	_vertices = numpy.array(_heMesh.vertices)
-	_normals = numpy.array(_heMesh.vertex_normals)
-	_triangles = numpy.array(_heMesh.triangles)
+# Release the traversal data once the deltas are collected
+def releaseData():
+	global _marked, _flagged, _heVertex, _heNext, _heTwin
 
-	# Mark boundary vertices as "seen"
-	for halfEdge in _halfEdges:
-		if halfEdge.twin == -1:
-			_marked[halfEdge.vertex_indices[0]] = True
-			_marked[halfEdge.vertex_indices[1]] = True
+	_heVertex = _heNext = _heTwin = None
+	_marked = []
+	_flagged = []
 
 
 # Initialize the EdgeBreaker algorithm by choosing the best fitting starting vertex in the first mesh's triangle
@@ -524,11 +565,248 @@ def compressRecursive(halfEdgeId):
 
 
 # ------------------------------------------------------------
-# ONLY "PUBLIC" FUNCTION (TO IMPORT)
+# Connected components
+# ------------------------------------------------------------
+
+# Label each triangle with the id of its connected component (triangles sharing an edge are connected)
+# Components are numbered in order of their first triangle, so the component of triangle 0 is always 0
+def labelComponents(triangles):
+	triangleCount = len(triangles)
+	vertexCount = int(triangles.max()) + 1 if triangleCount > 0 else 0
+
+	# Every edge of every triangle, as a key built from its sorted vertex pair
+	edges = numpy.sort(triangles[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1).astype(numpy.int64)
+	edgeKeys = edges[:, 0] * vertexCount + edges[:, 1]
+	edgeTriangles = numpy.repeat(numpy.arange(triangleCount), 3)
+
+	# Consecutive equal keys once sorted are pairs of triangles sharing an edge
+	order = numpy.argsort(edgeKeys, kind='stable')
+	sortedKeys = edgeKeys[order]
+	sortedTriangles = edgeTriangles[order]
+	shared = sortedKeys[1:] == sortedKeys[:-1]
+	a = sortedTriangles[:-1][shared]
+	b = sortedTriangles[1:][shared]
+
+	_, labels = numpy.unique(lowestLabels(triangleCount, a, b), return_inverse=True)
+	return labels.reshape(-1)
+
+
+# Label each of count items with the lowest id of the items it is linked to, through the links a[i] - b[i]
+# The lowest label is propagated along the links, with pointer jumping to converge quickly
+def lowestLabels(count, a, b):
+	labels = numpy.arange(count)
+	while True:
+		previousLabels = labels.copy()
+		lowest = numpy.minimum(labels[a], labels[b])
+		numpy.minimum.at(labels, a, lowest)
+		numpy.minimum.at(labels, b, lowest)
+		labels = labels[labels]
+		if numpy.array_equal(labels, previousLabels):
+			break
+
+	return labels
+
+
+# Rows of the arrays one after the other (no rows when there are no arrays)
+def concatenateRows(arrays):
+	return numpy.concatenate(arrays) if len(arrays) > 0 else numpy.empty((0, 3))
+
+
+# Split the mesh arrays into one (vertices, normals, triangles) set per connected component
+def splitComponents(vertices, normals, triangles):
+	labels = labelComponents(triangles)
+	componentCount = int(labels.max()) + 1 if len(labels) > 0 else 0
+
+	order = numpy.argsort(labels, kind='stable')
+	bounds = numpy.searchsorted(labels[order], numpy.arange(componentCount + 1))
+
+	components = []
+	for i in range(componentCount):
+		componentTriangles = triangles[order[bounds[i]:bounds[i + 1]]]
+		usedVertices, localTriangles = numpy.unique(componentTriangles, return_inverse=True)
+		components.append((
+			vertices[usedVertices],
+			None if normals is None else normals[usedVertices],
+			localTriangles.reshape(-1, 3)
+		))
+
+	return components
+
+
+# Worker: compress a single component given as arrays
+def compressComponent(job):
+	vertices, normals, triangles, storeNormals, debug = job
+
+	return compress(Mesh(vertices, triangles, normals), debug, storeNormals)
+
+
+# ------------------------------------------------------------
+# Spatial chunks
 # ------------------------------------------------------------
 
-def compress(mesh, debug = False):
-	global _mesh, _heMesh, _debugPrint
+# Split the triangles into spatial chunks of at most maxTriangles triangles
+# k-d split: each chunk is cut in two at the median of the triangle centroids, along its longest axis
+# Returns a list of triangle id arrays
+def splitChunks(vertices, triangles, maxTriangles):
+	centroids = vertices[triangles].mean(axis=1)
+
+	chunks = []
+	stack = [numpy.arange(len(triangles))]
+	while len(stack) > 0:
+		ids = stack.pop()
+		if len(ids) <= maxTriangles:
+			chunks.append(ids)
+			continue
+
+		points = centroids[ids]
+		axis = numpy.argmax(points.max(axis=0) - points.min(axis=0))
+		half = len(ids) // 2
+		order = numpy.argpartition(points[:, axis], half)
+		stack.append(ids[order[half:]])
+		stack.append(ids[order[:half]])
+
+	return chunks
+
+
+# Split the pinched vertices, whose triangles form several fans (like a vertex where two boundary loops touch), into
+# one vertex per fan: the copies are added after the vertices, with the same position and normal
+# The fans only go through the edges of consistently oriented triangles, so the mesh is also cut along the others
+# Returns the mesh arrays, unchanged if no vertex is pinched
+def splitPinchedVertices(vertices, normals, triangles):
+	vertexCount = len(vertices)
+	starts, nexts, twins = buildHalfEdges(triangles, vertexCount)
+
+	# The corner 3 * t + i (the start of the half-edge 3 * t + i) is in the fan of the corner across its half-edge:
+	# the twin of the half-edge ends at the same vertex, so the next half-edge of the twin starts there
+	across = twins >= 0
+	fans = lowestLabels(len(starts), numpy.flatnonzero(across), nexts[twins[across]])
+	_, firstCorners, cornerFans = numpy.unique(fans, return_index=True, return_inverse=True)
+	fanVertices = starts[firstCorners]
+
+	# The first fan of a vertex keeps its id, the others use copies of the vertex
+	order = numpy.argsort(fanVertices, kind='stable')
+	sortedVertices = fanVertices[order]
+	first = numpy.concatenate([[True], sortedVertices[1:] != sortedVertices[:-1]])
+	copies = sortedVertices[~first]
+	if len(copies) == 0:
+		return vertices, normals, triangles
+
+	fanIds = numpy.empty(len(fanVertices), dtype=numpy.int64)
+	fanIds[order[first]] = sortedVertices[first]
+	fanIds[order[~first]] = vertexCount + numpy.arange(len(copies))
+
+	if normals is not None:
+		normals = numpy.concatenate([normals, normals[copies]])
+
+	return numpy.concatenate([vertices, vertices[copies]]), normals, fanIds[cornerFans.reshape(-1)].reshape(-1, 3).astype(triangles.dtype)
+
+
+# Close each boundary loop with a fan around an added dummy vertex (placed at the loop centroid)
+# Edgebreaker only stores the vertices it reaches through C triangles, and the boundary vertices are
+# never reached, so a mesh with boundaries (like a chunk cut out of a mesh) has to be closed first
+# The pinched vertices must have been split (see splitPinchedVertices), so that each boundary vertex starts a single
+# boundary half-edge and the loops can be followed
+# Returns the closed mesh arrays and the ids of the dummy vertices
+def closeHoles(vertices, normals, triangles):
+	vertexCount = len(vertices)
+
+	# Boundary half-edges: half-edges a → b without a twin b → a
+	starts = triangles.ravel().astype(numpy.int64)
+	ends = triangles[:, [1, 2, 0]].ravel().astype(numpy.int64)
+	boundary = ~numpy.isin(ends * vertexCount + starts, starts * vertexCount + ends)
+	starts = starts[boundary]
+	ends = ends[boundary]
+
+	edgeCount = len(starts)
+	if edgeCount == 0:
+		return vertices, normals, triangles, numpy.empty(0, dtype=numpy.int64)
+
+	# Chain the boundary half-edges: the next half-edge of a loop starts where the current one ends
+	nextEdge = numpy.empty(edgeCount, dtype=numpy.int64)
+	nextEdge[numpy.argsort(ends, kind='stable')] = numpy.argsort(starts, kind='stable')
+
+	# Label each loop with its lowest half-edge id, by pointer doubling along the loops
+	loops = numpy.arange(edgeCount)
+	jump = nextEdge
+	for _ in range(int(numpy.ceil(numpy.log2(edgeCount))) + 1):
+		loops = numpy.minimum(loops, loops[jump])
+		jump = jump[jump]
+	_, loops = numpy.unique(loops, return_inverse=True)
+	loops = loops.reshape(-1)
+	loopCount = int(loops.max()) + 1
+
+	# One dummy vertex per loop, at the centroid of its vertices
+	counts = numpy.bincount(loops, minlength=loopCount)[:, None]
+	dummyVertices = numpy.stack([numpy.bincount(loops, weights=vertices[starts, axis], minlength=loopCount) for axis in range(3)], axis=1) / counts
+	dummyVertices = dummyVertices.astype(vertices.dtype)
+	dummyIds = vertexCount + numpy.arange(loopCount)
+
+	if normals is not None:
+		dummyNormals = numpy.stack([numpy.bincount(loops, weights=normals[starts, axis], minlength=loopCount) for axis in range(3)], axis=1) / counts
+		normals = numpy.concatenate([normals, dummyNormals.astype(normals.dtype)])
+
+	# Fan triangles b → a → dummy, oriented like the rest of the mesh
+	fans = numpy.stack([ends, starts, dummyIds[loops]], axis=1)
+
+	return numpy.concatenate([vertices, dummyVertices]), normals, numpy.concatenate([triangles, fans]).astype(triangles.dtype), dummyIds
+
+
+# Triangles starting with their lowest vertex id (keeping their orientation), sorted
+def sortedTriangles(triangles):
+	rotations = numpy.argmin(triangles, axis=1)[:, None] + numpy.arange(3)
+	triangles = numpy.take_along_axis(triangles, rotations % 3, axis=1)
+
+	return triangles[numpy.lexsort(triangles.T[::-1])]
+
+
+# Decompress a compressed chunk and check that it gives back the triangles of the chunk
+# vertexIds is the id in the chunk of each decompressed vertex (the order of the deltas)
+# The traversal of a mesh Edgebreaker cannot handle (like a handle of a closed mesh) loses triangles without any error
+def decompressesToChunk(triangles, clers, deltas, vertexIds):
+	_, decodedTriangles, _, _ = decompressComponent((clers, deltas, None, False))
+	return numpy.array_equal(sortedTriangles(triangles), sortedTriangles(numpy.asarray(vertexIds)[decodedTriangles]))
+
+
+# Connected components of the triangles ids of a mesh, as (vertices, normals, triangles) arrays, the pinched vertices
+# being split first (see splitPinchedVertices)
+def chunkComponents(vertices, normals, triangles, ids):
+	usedVertices, chunkTriangles = numpy.unique(triangles[ids], return_inverse=True)
+	chunkNormals = None if normals is None else normals[usedVertices]
+
+	return splitComponents(*splitPinchedVertices(vertices[usedVertices], chunkNormals, chunkTriangles.reshape(-1, 3)))
+
+
+# Worker: close the holes of a chunk (its pinched vertices being split), compress it and check that it decompresses
+# to the closed chunk. A chunk which does not is cut in two halves (see splitChunks), compressed the same way, until
+# every part decompresses (a single triangle always does)
+# Returns a list of (CLERS, deltas, normals, indices in the deltas of the dummy vertices), one per part of the chunk
+def compressChunk(job):
+	vertices, normals, triangles, storeNormals, debug = job
+
+	closedVertices, closedNormals, closedTriangles, dummyIds = closeHoles(vertices, normals, triangles)
+	clers, deltas, outputNormals = compressComponent((closedVertices, closedNormals, closedTriangles, storeNormals, debug))
+	if decompressesToChunk(closedTriangles, clers, deltas, _outputVertexIds):
+		return [(clers, deltas, outputNormals, numpy.flatnonzero(numpy.isin(_outputVertexIds, dummyIds)).tolist())]
+
+	if len(triangles) == 1:
+		raise ValueError('A triangle does not decompress to itself')
+	print(f'Edgebreaker cannot encode a chunk of {len(triangles)} triangles, cutting it in two')
+
+	results = []
+	for half in splitChunks(vertices, triangles, (len(triangles) + 1) // 2):
+		for v, n, t in chunkComponents(vertices, normals, triangles, half):
+			results += compressChunk((v, n, t, storeNormals, debug))
+
+	return results
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+@traced
+def compress(mesh, debug = False, storeNormals = True):
+	global _mesh, _heMesh, _storeNormals, _debugPrint
 
 	_debugPrint = debug
 
@@ -537,8 +815,8 @@ def compress(mesh, debug = False):
 	initVars()
 
 	_mesh = mesh
-	_heMesh = open3d.geometry.HalfEdgeTriangleMesh.create_from_triangle_mesh(_mesh)
-	
+	_storeNormals = storeNormals and _mesh.has_vertex_normals()
+
 	debugInit()
 
 	initCompression()
@@ -548,30 +826,72 @@ def compress(mesh, debug = False):
 
 	debugEnd()
 
+	collectDeltas()
+	releaseData()
+
 	print(f'Edgebreaker compression ending at: {datetime.now().strftime("%d/%m/%Y %H:%M:%S")}')
 
 	return _clers, _deltas, _outputNormals
 
 
-# ------------------------------------------------------------
-# Main
-# ------------------------------------------------------------
+# Compress every connected component of the mesh, each one as its own CLERS string
+# The pinched vertices are split first (see splitPinchedVertices), and the holes of an open component are closed with
+# dummy vertices (see closeHoles), like the ones of a chunk; both are welded back or removed on decompression
+# Components are compressed in a process pool (workers = None uses every core, 1 runs in this process)
+# A component Edgebreaker cannot encode (like a closed mesh with handles) is stored as several chunks (see compressChunk)
+# Returns the list of CLERS strings, the deltas and normals of all the components one after the other, and the dummy
+# vertices of each component (all the lists are empty for a closed mesh)
+@traced
+def compressComponents(mesh, debug = False, storeNormals = True, workers = None):
+	vertices = numpy.asarray(mesh.vertices)
+	normals = numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+	triangles = numpy.asarray(mesh.triangles)
 
-def doProfiling():
-	if _doProfiling:
-		with cProfile.Profile() as pr:
-			main()
-		
-		with open('profiling_stats.txt', 'w') as stream:
-			stats = Stats(pr, stream=stream)
-			stats.strip_dirs()
-			stats.sort_stats('time')
-			stats.dump_stats('.prof_stats')
-			stats.print_stats()
+	components = splitComponents(*splitPinchedVertices(vertices, normals, triangles))
+	print(f'Edgebreaker compression of {len(components)} connected component(s)')
 
-	return 0
+	jobs = [(v, n, t, storeNormals, debug) for v, n, t in components]
+	results = [result for results in parallelMap(compressChunk, jobs, 1 if debug else workers) for result in results]
+
+	clersList = [clers for clers, _, _, _ in results]
+	deltas = concatenateRows([componentDeltas for _, componentDeltas, _, _ in results])
+	outputNormals = concatenateRows([componentNormals for _, _, componentNormals, _ in results])
+	dummiesList = [dummies for _, _, _, dummies in results]
+
+	return clersList, deltas, outputNormals, dummiesList
+
+
+# Compress the mesh as independent spatial chunks of at most maxTriangles triangles (each connected part of a chunk
+# being its own chunk), in a process pool (workers = None uses every core, 1 runs in this process)
+# The vertices on the border between chunks are stored in each chunk using them and welded back on decompression
+# Returns the list of CLERS strings, the deltas and normals of all the chunks, and the dummy vertices of each chunk
+@traced
+def compressChunks(mesh, maxTriangles = 50000, debug = False, storeNormals = True, workers = None):
+	vertices = numpy.asarray(mesh.vertices)
+	normals = numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+	triangles = numpy.asarray(mesh.triangles)
+
+	jobs = []
+	for chunk in splitChunks(vertices, triangles, maxTriangles):
+		for v, n, t in chunkComponents(vertices, normals, triangles, chunk):
+			jobs.append((v, n, t, storeNormals, debug))
+	print(f'Edgebreaker compression of {len(jobs)} chunk(s)')
 
+	results = [result for results in parallelMap(compressChunk, jobs, 1 if debug else workers) for result in results]
 
+	clersList = [clers for clers, _, _, _ in results]
+	deltas = concatenateRows([chunkDeltas for _, chunkDeltas, _, _ in results])
+	outputNormals = concatenateRows([chunkNormals for _, _, chunkNormals, _ in results])
+	dummiesList = [dummies for _, _, _, dummies in results]
+
+	return clersList, deltas, outputNormals, dummiesList
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+
+@profiled('main')
 def main():
 	global _debug
 
@@ -579,7 +899,7 @@ def main():
 	doDebugPrint = True
 
 	print(f'\n\n\n\n\nRunning MAIN from EdgeBreakerCompression.py\n')
-	mesh = open3d.io.read_triangle_mesh("Models/cube2.obj")
+	mesh = objImporter("Models/cube2.obj")
 	# Quantization.quantizeVertices(mesh, 4)
 	
 	clers, deltas, normals = compress(mesh, doDebugPrint)
@@ -594,7 +914,4 @@ def main():
 
 
 if __name__ == '__main__':
-	if _doProfiling:
-		sys.exit(doProfiling())
-	else:
-		sys.exit(main())
+	sys.exit(main())
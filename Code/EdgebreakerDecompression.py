@@ -1,19 +1,22 @@
 '''
-Python EdgeBreaker algorithm working with the Open3D library.
+Python EdgeBreaker algorithm working on NumPy arrays (Open3D is only used to draw the debug view).
 
 Implemented and improved from:
 https://www.cs.cmu.edu/~alla/edgebreaker_simple.pdf
 '''
 
-import cProfile
 import math
 import numpy
-import open3d
 import sys
 import time
 
+from array import array
 from datetime import datetime
-from pstats import Stats
+
+from Mesh import Mesh
+from Parallel import parallelMap
+from Profiling import profiled
+from Tracing import traced
 
 
 # ------------------------------------------------------------
@@ -22,8 +25,6 @@ from pstats import Stats
 
 ## DEBUG AND VISUALIZATION
 
-_doProfiling = False				# Do some profiling
-
 _debug = False						# True if you want to enable color changes and delay between draw calls
 _debugPrint = False					# True if you want to enable debug prints
 
@@ -176,6 +177,8 @@ def debugInit():
 	global _debug, _visualizer
 
 	if _debug:
+		import open3d
+
 		_visualizer = open3d.visualization.Visualizer()
 		_visualizer.create_window()
 		_visualizer.add_geometry(_heMesh)
@@ -289,30 +292,44 @@ def calculateMeshNormals(mesh):
 		triangleNormals[i] = triangleNormal
 		i += 1
 
-	mesh.vertex_normals = open3d.utility.Vector3dVector(_normals)
-	mesh.triangle_normals = open3d.utility.Vector3dVector(triangleNormals)
+	mesh.vertex_normals = _normals
+	mesh.triangle_normals = triangleNormals
 
 	return mesh
 
 
-def recreateMesh():
-	triangles = []
-	triangle = []
+# Rebuild area-weighted vertex normals when the file does not store them
+def reconstructVertexNormals(mesh):
+	vertices = numpy.asarray(mesh.vertices)
+	triangles = numpy.asarray(mesh.triangles)
 
-	i = 0
-	for vertexId in _V:
-		i += 1
-		triangle.append(vertexId)
-		if i == 3:
-			i = 0
-			triangles.append(triangle)
-			triangle = []
+	# Non-normalized cross product: its length is twice the triangle area, which gives the weighting
+	a = vertices[triangles[:, 0]]
+	b = vertices[triangles[:, 1]]
+	c = vertices[triangles[:, 2]]
+	triangleNormals = numpy.cross(b - a, c - a)
 
-	vertices = open3d.utility.Vector3dVector(_G)
-	triangles = open3d.utility.Vector3iVector(triangles)
+	# Scatter-add each triangle normal onto its 3 corners in a single pass
+	corners = triangles.ravel()
+	cornerNormals = numpy.repeat(triangleNormals, 3, axis=0)
+	vertexNormals = numpy.empty((len(vertices), 3))
+	for axis in range(3):
+		vertexNormals[:, axis] = numpy.bincount(corners, weights=cornerNormals[:, axis], minlength=len(vertices))
 
-	mesh = open3d.geometry.TriangleMesh(vertices, triangles)
-	mesh = calculateMeshNormals(mesh)
+	vertexNormals /= numpy.maximum(numpy.linalg.norm(vertexNormals, axis=1), 1e-12)[:, None]
+	triangleNormals /= numpy.maximum(numpy.linalg.norm(triangleNormals, axis=1), 1e-12)[:, None]
+
+	mesh.vertex_normals = vertexNormals
+	mesh.triangle_normals = triangleNormals
+
+	return mesh
+
+
+# The mesh keeps the types of the deltas and normals
+def recreateMesh():
+	mesh = Mesh(_G, numpy.asarray(_V).reshape(-1, 3), positionType=_G.dtype, normalType=numpy.float64 if _normals is None else _normals.dtype)
+	if _normals is not None:
+		mesh = calculateMeshNormals(mesh)
 
 	return mesh
 
@@ -395,10 +412,11 @@ def initDecompression():
 	debugPrint(f'_triangles: {trianglesCount}')
 	debugPrint(f'_halfEdges: {halfEdgesCount}')
 
-	_V = [0] * halfEdgesCount
+	# Corner tables as int32 arrays of the array module, marks as bytes
+	_V = array('i', [0]) * halfEdgesCount
 	_V[1], _V[2] = 1, 2
 
-	_O = [-3] * halfEdgesCount
+	_O = array('i', [-3]) * halfEdgesCount
 	_O[0], _O[2] = -1, -1
 
 	_T = 0
@@ -406,10 +424,10 @@ def initDecompression():
 
 	decompressConnectivity(1)
 
-	_M = [False] * verticesCount
-	_U = [False] * trianglesCount
+	_M = bytearray(verticesCount)
+	_U = bytearray(trianglesCount)
 
-	_G = [[0, 0, 0]] * verticesCount
+	_G = numpy.zeros((verticesCount, 3), dtype=_deltas.dtype)
 	_G[0] = readDeltas()
 	# _G[1] = addVectors3D(_G[0], readDeltas())		# TODO: add back
 	# _G[2] = addVectors3D(_G[1], readDeltas())		# TODO: add back
@@ -426,9 +444,28 @@ def initDecompression():
 
 
 # ------------------------------------------------------------
-# ONLY "PUBLIC" FUNCTION (TO IMPORT)
+# Connected components
+# ------------------------------------------------------------
+
+# Worker: decompress a single component, returned as arrays so it can be sent back from a process
+def decompressComponent(job):
+	clers, deltas, normals, debug = job
+
+	mesh = decompress(clers, deltas, normals, debug)
+
+	return (
+		numpy.asarray(mesh.vertices),
+		numpy.asarray(mesh.triangles),
+		numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None,
+		numpy.asarray(mesh.triangle_normals) if mesh.has_triangle_normals() else None
+	)
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
 # ------------------------------------------------------------
 
+@traced
 def decompress(clers, deltas, normals, debug = False):
 	global _clers, _deltas, _normals, _debugPrint
 
@@ -441,7 +478,7 @@ def decompress(clers, deltas, normals, debug = False):
 	debugInit()
 
 	_clers = clers
-	_deltas = deltas
+	_deltas = numpy.asarray(deltas)
 	_normals = normals
 
 	initDecompression()
@@ -457,25 +494,128 @@ def decompress(clers, deltas, normals, debug = False):
 	return mesh
 
 
-# ------------------------------------------------------------
-# Main
-# ------------------------------------------------------------
+# Decompress a mesh made of several connected components, one CLERS string per component
+# The deltas (and normals) of the components follow each other, each component using 3 + #C of them
+# The copies of the pinched vertices (see EdgebreakerCompression.splitPinchedVertices) are welded back
+# Components are decompressed in a process pool (workers = None uses every core, 1 runs in this process)
+@traced
+def decompressComponents(clersList, deltas, normals, debug = False, workers = None):
+	if len(clersList) == 1:
+		return weldMesh(decompress(clersList[0], deltas, normals, debug))
+
+	jobs = []
+	start = 0
+	for clers in clersList:
+		end = start + 3 + clers.count('C')
+		jobs.append((clers, deltas[start:end], None if normals is None else normals[start:end], debug))
+		start = end
+
+	results = parallelMap(decompressComponent, jobs, 1 if debug else workers)
+
+	# Merge the components, shifting the vertex ids of each component's triangles
+	# (the zip builtin is shadowed by the Edgebreaker zip in this module)
+	offsets = numpy.cumsum([0] + [len(vertices) for vertices, _, _, _ in results])
+	vertices = numpy.concatenate([vertices for vertices, _, _, _ in results])
+	triangles = numpy.concatenate([results[i][1] + offsets[i] for i in range(len(results))])
+
+	mesh = Mesh(vertices, triangles, positionType=vertices.dtype, normalType=numpy.float64 if normals is None else normals.dtype)
+	if normals is not None:
+		mesh.vertex_normals = numpy.concatenate([n for _, _, n, _ in results])
+		mesh.triangle_normals = numpy.concatenate([n for _, _, _, n in results])
+
+	return weldMesh(mesh)
+
+
+# Decompress a mesh compressed as spatial chunks, one CLERS string and one list of dummy vertices per chunk
+# The dummy vertices (closing the chunk holes) are removed, then the border vertices stored by several chunks and the
+# copies of the pinched vertices are welded back together: they share the same position, which is unique to a vertex
+# once the mesh is preprocessed
+# Chunks are decompressed in a process pool (workers = None uses every core, 1 runs in this process)
+@traced
+def decompressChunks(clersList, dummiesList, deltas, normals, debug = False, workers = None):
+	jobs = []
+	start = 0
+	for clers in clersList:
+		end = start + 3 + clers.count('C')
+		jobs.append((clers, deltas[start:end], None if normals is None else normals[start:end], debug))
+		start = end
+
+	results = parallelMap(decompressComponent, jobs, 1 if debug else workers)
+
+	# Remove the dummy vertices and their fans from each chunk, and shift the vertex ids of the chunks
+	verticesList = []
+	trianglesList = []
+	normalsList = []
+	offset = 0
+	for i in range(len(results)):
+		vertices, triangles, vertexNormals, _ = results[i]
+
+		keep = numpy.ones(len(vertices), dtype=bool)
+		keep[dummiesList[i]] = False
+		newIds = numpy.cumsum(keep) - 1 + offset
+
+		verticesList.append(vertices[keep])
+		trianglesList.append(newIds[triangles[keep[triangles].all(axis=1)]])
+		if vertexNormals is not None:
+			normalsList.append(vertexNormals[keep])
+		offset += int(keep.sum())
+
+	vertices = numpy.concatenate(verticesList)
+	triangles = numpy.concatenate(trianglesList)
+
+	kept, ids = weldVertices(vertices)
+	mesh = Mesh(vertices[kept], ids[triangles], positionType=vertices.dtype, normalType=numpy.float64 if normals is None else normals.dtype)
+	if normals is not None:
+		mesh.vertex_normals = numpy.concatenate(normalsList)[kept]
+		mesh.compute_triangle_normals()
 
-def doProfiling():
-	if _doProfiling:
-		with cProfile.Profile() as pr:
-			main()
-		
-		with open('profiling_stats.txt', 'w') as stream:
-			stats = Stats(pr, stream=stream)
-			stats.strip_dirs()
-			stats.sort_stats('time')
-			stats.dump_stats('.prof_stats')
-			stats.print_stats()
+	return mesh
 
-	return 0
+
+# The mesh with its vertices at the same position welded, the mesh itself if it has none
+def weldMesh(mesh):
+	vertices = numpy.asarray(mesh.vertices)
+	kept, ids = weldVertices(vertices)
+	if len(kept) == len(vertices):
+		return mesh
+
+	welded = Mesh(vertices[kept], ids[numpy.asarray(mesh.triangles)], positionType=mesh.positionType, normalType=mesh.normalType)
+	if mesh.has_vertex_normals():
+		welded.vertex_normals = numpy.asarray(mesh.vertex_normals)[kept]
+		welded.compute_triangle_normals()
+
+	return welded
+
+
+# Weld the vertices at the same position, keeping the vertices in order of first appearance
+# Returns the ids of the kept vertices, and the new id of every vertex
+def weldVertices(vertices):
+	_, first, inverse = numpy.unique(vertices, axis=0, return_index=True, return_inverse=True)
+	order = numpy.argsort(first)
+	rank = numpy.empty(len(order), dtype=numpy.int64)
+	rank[order] = numpy.arange(len(order))
+
+	return first[order], rank[inverse.reshape(-1)]
 
 
+
+# For each decompressed vertex, the id of the vertex at the same position in vertices (-1 if there is none)
+# Used by the encoders that need the vertex order of the decoder
+def matchVertices(decompressedVertices, vertices):
+	_, inverse = numpy.unique(numpy.concatenate([decompressedVertices, vertices]), axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+
+	positionToVertex = numpy.full(inverse.max() + 1, -1)
+	positionToVertex[inverse[len(decompressedVertices):]] = numpy.arange(len(vertices))
+
+	return positionToVertex[inverse[:len(decompressedVertices)]]
+
+
+# ------------------------------------------------------------
+# Main
+# ------------------------------------------------------------
+
+@profiled('main')
 def main():
 	global _debug
 
@@ -490,7 +630,4 @@ def main():
 
 
 if __name__ == '__main__':
-	if _doProfiling:
-		sys.exit(doProfiling())
-	else:
-		sys.exit(main())
+	sys.exit(main())
@@ -4,14 +4,17 @@ import numpy
 import open3d
 import sys
 
-from EdgebreakerCompression import compress
-from EdgebreakerDecompression import decompress
+from Cleanup import preProcess
+from EdgebreakerCompression import compressComponents
+from EdgebreakerDecompression import decompressChunks
+from Mesh import toMesh, toOpen3D
 from MeshQualityEvaluation import evaluateWithHausdorff
 
 from Quantization import quantizeVertices, quantizeVerticesRescale
 
 
 def showMesh(mesh):
+	mesh = toOpen3D(mesh)
 	mesh.paint_uniform_color([0.6, 0.6, 0.6])
 	open3d.visualization.draw_geometries([mesh])
 
@@ -35,23 +38,8 @@ def calculateTriangleNormals(mesh):
 		triangleNormals[i] = triangleNormal
 		i += 1
 
-	mesh.vertex_normals = open3d.utility.Vector3dVector(vertexNormals)
-	mesh.triangle_normals = open3d.utility.Vector3dVector(triangleNormals)
-
-	return mesh
-
-
-def preProcess(mesh, doPrint = False):
-	mesh = mesh.remove_degenerate_triangles()
-	mesh = mesh.remove_duplicated_triangles()
-	mesh = mesh.remove_duplicated_vertices()
-	mesh = mesh.remove_non_manifold_edges()
-	mesh = mesh.remove_unreferenced_vertices()
-
-	if doPrint:
-		print(f'After preprocessing:')
-		print(f'Vertices: {len(mesh.vertices)}')
-		print(f'Triangles: {len(mesh.triangles)}')
+	mesh.vertex_normals = vertexNormals
+	mesh.triangle_normals = triangleNormals
 
 	return mesh
 
@@ -64,7 +52,7 @@ def main():
 	model = "XYZ Dragon.obj"
 
 	# Read original mesh and print stats
-	originalMesh = open3d.io.read_triangle_mesh(f'Models/{model}')
+	originalMesh = toMesh(open3d.io.read_triangle_mesh(f'Models/{model}'))
 	mesh = open3d.io.read_triangle_mesh(f'Models/{model}')
 	
 	# quantizeVertices(mesh, 20)			# Use one...
@@ -77,11 +65,12 @@ def main():
 	# Verify if normals are specified, if not, calculate them
 	if mesh.has_vertex_normals():
 		print(f'V - Mesh has vertex normals')
-		mesh = calculateTriangleNormals(mesh)
+		mesh = calculateTriangleNormals(toMesh(mesh))
 	else:
 		print(f'X - Mesh doesn\'t have vertex normals')
 		mesh.compute_vertex_normals()
 		mesh.compute_triangle_normals()
+		mesh = toMesh(mesh)
 	
 	# Pre-process the mesh if specified
 	if doPreProcess:
@@ -92,13 +81,14 @@ def main():
 		showMesh(mesh)
 	else:					# Compress original or pre-processed mesh, decompress compressed mesh, and show decompressed mesh
 		try:
-			# Compress the mesh
-			clers, deltas, normals = compress(mesh, False)
+			# Compress the mesh, one CLERS string per connected component
+			clers, deltas, normals, dummies = compressComponents(mesh, False)
 		except:
 			print(f'{model} is not suitable to Edgebreaker. Use a simple compression.')
+			return 1
 
 		# Decompress and show the mesh
-		decompressedMesh = decompress(clers, deltas, normals, False)
+		decompressedMesh = decompressChunks(clers, dummies, deltas, normals, False)
 
 		# Evaluate decompressed mesh quality
 		# distance = evaluateWithHausdorff(originalMesh, decompressedMesh)
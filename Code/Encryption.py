@@ -1,12 +1,92 @@
+import glob
+import hashlib
+import hmac
+import os
 import random
 
-from Quantization import headerSize
+import numpy
+
+from Quantization import headerSize, nonceSize, keyCheckSize, nonceBlockSize, readHeader, readHeaderFlags, writeHeaderFlags, readHeaderCipher, readHeaderPlanes, readHeaderNonce, readHeaderKeyCheck, readHeaderSectionsStart, clersSectionEnd, packBits, unpackBits, FLAG_NO_NORMALS, FLAG_NONCE, FLAG_PROGRESSIVE, FLAG_SEQUENCE, CIPHER_KEYED_PERMUTATION, CIPHER_COUNTER_KEYSTREAM, CIPHER_BLOCK_PERMUTATION, CIPHER_PAYLOAD
+from EntropyCoding import encodePayload, decodePayload
+from ImportExport import readFile, writeFile
+from Parallel import parallelMap
+from Progressive import batchesBounds
+from Sequence import framesBounds
+from Tracing import traced
 
 SALTPOS = "salty_positions"
 SALTNRM = "salty_normals"
+SALTREF = "salty_refinements"
+SALTFRM = "salty_frames"
+SALTPAY = "salty_payload"
+SALTTAG = "salty_tag"
+SALTCHK = "salty_check"
+
+# Size of a keystream block (one BLAKE2b digest) and of the chunks XORed by one job
+KEYSTREAMBLOCK = 64
+KEYSTREAMCHUNK = 1 << 16
+
+# Keystream bytes set aside for each section of xorifySections (2^32 blocks), so that section i starts at i * SECTIONSTRIDE
+SECTIONSTRIDE = KEYSTREAMBLOCK << 32
+
+# Bits of the tag authenticating an encrypted payload
+TAGSIZE = 128
+
+# Number of vertices permuted together with CIPHER_BLOCK_PERMUTATION (the last block may be smaller)
+SCRAMBLEBLOCK = 4096
+
+
+#Bytes [start, start + count) of the keystream of (key, salt, nonce): block i is BLAKE2b(i) keyed with a digest of the
+#key, the salt and the random nonce of the file, so any part of the keystream can be computed without the ones before it
+#and two files never share a keystream (the legacy files have no nonce)
+def keystream(key, salt, start, count, nonce = b''):
+    subkey = hashlib.blake2b((key + salt).encode() + nonce, digest_size=32).digest()
+    first = start // KEYSTREAMBLOCK
+    last = (start + count + KEYSTREAMBLOCK - 1) // KEYSTREAMBLOCK
+    blocks = b''.join(hashlib.blake2b(i.to_bytes(8, 'little'), key=subkey).digest() for i in range(first, last))
+    offset = start - first * KEYSTREAMBLOCK
+    return numpy.frombuffer(blocks, dtype=numpy.uint8)[offset:offset + count]
+
+
+#XOR a chunk of width bits records with the keystream, from keystream bit start (a multiple of 8): only the first
+#planes bits of each record are encrypted
+def xorChunk(job):
+    chunk, key, salt, start, width, planes, nonce = job
+    bits = (numpy.frombuffer(chunk.encode('ascii'), dtype=numpy.uint8) - ord('0')).reshape(-1, width)
+    count = len(bits) * planes
+    stream = numpy.unpackbits(keystream(key, salt, start // 8, (count + 7) // 8, nonce))[:count]
+    bits[:, :planes] ^= stream.reshape(-1, planes)
+    return (bits.ravel() + ord('0')).tobytes().decode('ascii')
+
+
+#XOR bitstring[n:n + size] with the keystream of (key, salt), in chunks that may be spread over workers
+#With records of width bits, only their first (most significant) planes bits are XORed
+def xorifyKeystream(bitstring, n, size, key, salt, workers = 1, width = 1, planes = 1, nonce = b''):
+    chunkBits = KEYSTREAMCHUNK * width
+    jobs = [(bitstring[n + start:n + min(start + chunkBits, size)], key, salt, start // width * planes, width, planes, nonce) for start in range(0, size, chunkBits)]
+    return bitstring[:n] + ''.join(parallelMap(xorChunk, jobs, workers)) + bitstring[n + size:]
+
 
+#Number of high bit-planes of a width bits value encrypted by the selective mode (all of them if it is disabled)
+def selectedPlanes(bitstring, width):
+    planes = readHeaderPlanes(bitstring)
+    return width if planes == 0 else min(planes, width)
 
-def xorifyNormals (bitstring, k, key):
+
+def xorifyNormals (bitstring, k, key, workers = 1, nonce = b''):
+    if readHeaderFlags(bitstring) & FLAG_NO_NORMALS:
+        return bitstring
+
+    if not readHeaderCipher(bitstring) & CIPHER_COUNTER_KEYSTREAM:
+        return xorifyNormalsLegacy(bitstring, k, key)
+
+    vertexNb = int(bitstring[4:36], 2)
+    return xorifyKeystream(bitstring, headerSize + 3 * k * vertexNb, 17 * vertexNb, key, SALTNRM, workers, 17, selectedPlanes(bitstring, 17), nonce)
+
+
+#Legacy schemes, bit-exact with the first format: its files (read without a format marker, see
+#Quantization.stripFormatMarker) have an empty cipher byte, which selects them
+def xorifyNormalsLegacy (bitstring, k, key):
     random.seed(key + SALTNRM)
     vertexNb = int(bitstring[4:36], 2)
     bitstring = list(bitstring)
@@ -39,7 +119,7 @@ def gettransposition(key, vertexNb):
 
     return transpositionsX, transpositionsY, transpositionsZ
 
-def scramble(bitstring, k, key):
+def scrambleLegacy(bitstring, k, key):
     vertexNb = int(bitstring[4:36], 2)
     print ("vnb: " + str(vertexNb))
     print ("bin: " + bitstring[4:36])
@@ -78,7 +158,7 @@ def scramble(bitstring, k, key):
     return bitstring
 
 
-def unscramble(bitstring, k, key):
+def unscrambleLegacy(bitstring, k, key):
     vertexNb = int(bitstring[4:36], 2)
     print ("vnb: " + str(vertexNb))
     print ("bin: " + bitstring[4:36])
@@ -114,4 +194,288 @@ def unscramble(bitstring, k, key):
     vertexlen = len(vertexstring)
     bitstring = bitstring[:headerSize] + vertexstring + bitstring[headerSize+vertexlen:]
 
-    return bitstring
\ No newline at end of file
+    return bitstring
+
+
+#One keyed permutation of range(vertexNb) per axis, as a (3, vertexNb) array: the positions are sorted by random
+#64 bits keys drawn from SHAKE-256, so the same key and vertex count always give the same permutations
+#With a block index, the permutations are drawn from a key derived for that block. The nonce of the file is part of the
+#seed, so that two files with the same key and vertex count are not permuted the same way
+def getpermutations(key, vertexNb, block = None, nonce = b''):
+    seed = key + SALTPOS if block is None else key + SALTPOS + '/' + str(block)
+    stream = hashlib.shake_256(seed.encode() + nonce).digest(8 * 3 * vertexNb)
+    sortKeys = numpy.frombuffer(stream, dtype='<u8').reshape(3, vertexNb)
+    return numpy.argsort(sortKeys, axis=1, kind='stable')
+
+
+#Permute each coordinate axis of the positions independently: the i-th x is the x of the vertex permutation[0][i]...
+#Only the bits above the shift lowest bit-planes are permuted, the low planes stay in place
+def permutePositions(positions, permutations, shift = 0):
+    high = positions >> shift
+    high = numpy.stack([high[permutations[axis], axis] for axis in range(3)], axis=1)
+    return (high << shift) | (positions & ((1 << shift) - 1))
+
+
+def unpermutePositions(scrambled, permutations, shift = 0):
+    high = scrambled >> shift
+    positions = numpy.empty_like(high)
+    for axis in range(3):
+        positions[permutations[axis], axis] = high[:, axis]
+    return (positions << shift) | (scrambled & ((1 << shift) - 1))
+
+
+#(Un)scramble one block of SCRAMBLEBLOCK vertices (3 * k bits each), independent from the other blocks, so the
+#positions section can be decrypted block by block as it is read, or by several workers
+def scrambleBlock(job):
+    vertexstring, k, key, block, inverse, shift, nonce = job
+    positions = unpackBits(vertexstring, 0, len(vertexstring) // k, k).reshape(-1, 3)
+    permutations = getpermutations(key, len(positions), block, nonce)
+    positions = unpermutePositions(positions, permutations, shift) if inverse else permutePositions(positions, permutations, shift)
+    return packBits(positions.ravel(), k)
+
+
+def scrambleBlocks(bitstring, k, key, inverse, workers, nonce = b''):
+    vertexNb = int(bitstring[4:36], 2)
+    blockBits = 3 * k * SCRAMBLEBLOCK
+    end = headerSize + 3 * k * vertexNb
+    shift = k - selectedPlanes(bitstring, k)
+    jobs = [(bitstring[n:min(n + blockBits, end)], k, key, block, inverse, shift, nonce) for block, n in enumerate(range(headerSize, end, blockBits))]
+
+    return bitstring[:headerSize] + ''.join(parallelMap(scrambleBlock, jobs, workers)) + bitstring[end:]
+
+
+#Positions section as a (vertexNb, 3) array of quantized coordinates
+def readPositions(bitstring, k):
+    vertexNb = int(bitstring[4:36], 2)
+    return unpackBits(bitstring, headerSize, 3 * vertexNb, k).reshape(vertexNb, 3)
+
+
+def writePositions(bitstring, k, positions):
+    vertexstring = packBits(positions.ravel(), k)
+    return bitstring[:headerSize] + vertexstring + bitstring[headerSize + len(vertexstring):]
+
+
+def scramble(bitstring, k, key, workers = 1, nonce = b''):
+    cipher = readHeaderCipher(bitstring)
+    if cipher & CIPHER_BLOCK_PERMUTATION:
+        return scrambleBlocks(bitstring, k, key, False, workers, nonce)
+    if not cipher & CIPHER_KEYED_PERMUTATION:
+        return scrambleLegacy(bitstring, k, key)
+
+    positions = readPositions(bitstring, k)
+    return writePositions(bitstring, k, permutePositions(positions, getpermutations(key, len(positions), nonce=nonce), k - selectedPlanes(bitstring, k)))
+
+
+def unscramble(bitstring, k, key, workers = 1, nonce = b''):
+    cipher = readHeaderCipher(bitstring)
+    if cipher & CIPHER_BLOCK_PERMUTATION:
+        return scrambleBlocks(bitstring, k, key, True, workers, nonce)
+    if not cipher & CIPHER_KEYED_PERMUTATION:
+        return unscrambleLegacy(bitstring, k, key)
+
+    scrambled = readPositions(bitstring, k)
+    return writePositions(bitstring, k, unpermutePositions(scrambled, getpermutations(key, len(scrambled), nonce=nonce), k - selectedPlanes(bitstring, k)))
+
+
+#XOR each (start, size) section of the bitstring with its own part of the keystream of (key, salt, nonce), starting at
+#the section index times SECTIONSTRIDE, so that every section can be decrypted on its own
+def xorifySections(bitstring, bounds, key, salt, nonce = b''):
+    if len(nonce) == 0:
+        return xorifySectionsLegacy(bitstring, bounds, key, salt)
+
+    parts = []
+    end = 0
+    for i, (n, size) in enumerate(bounds):
+        parts.append(bitstring[end:n])
+        parts.append(xorChunk((bitstring[n:n + size], key, salt, 8 * i * SECTIONSTRIDE, 1, 1, nonce)))
+        end = n + size
+    parts.append(bitstring[end:])
+
+    return ''.join(parts)
+
+
+def xorifySectionsLegacy(bitstring, bounds, key, salt):
+    parts = []
+    end = 0
+    for i, (n, size) in enumerate(bounds):
+        stream = random.Random(key + salt + str(i)).getrandbits(size)
+        parts.append(bitstring[end:n])
+        parts.append(str('{0:0' + str(size) + 'b}').format(int(bitstring[n:n + size], 2) ^ stream) if size > 0 else '')
+        end = n + size
+    parts.append(bitstring[end:])
+
+    return ''.join(parts)
+
+
+#XOR the refinement batches of a progressive file, so that any prefix can be decrypted. The batch sizes stay in the clear
+def xorifyRefinements(bitstring, key, nonce = b'', start = None):
+    if not readHeaderFlags(bitstring) & FLAG_PROGRESSIVE:
+        return bitstring
+
+    return xorifySections(bitstring, batchesBounds(bitstring, start), key, SALTREF, nonce)
+
+
+#XOR the frames of an animation (the first one is encrypted with the positions), so that any frame can be
+#decrypted on its own. The frame sizes stay in the clear
+def xorifyFrames(bitstring, key, nonce = b'', start = None):
+    if not readHeaderFlags(bitstring) & FLAG_SEQUENCE:
+        return bitstring
+
+    _, bounds = framesBounds(bitstring, start)
+    return xorifySections(bitstring, bounds, key, SALTFRM, nonce)
+
+
+#Keyed BLAKE2b tag of the header, the payload size and the encrypted payload of a file with a nonce
+def payloadTag(key, nonce, header, encrypted):
+    subkey = hashlib.blake2b((key + SALTTAG).encode() + nonce, digest_size=32).digest()
+    message = header.encode('ascii') + len(encrypted).to_bytes(4, 'big') + encrypted.tobytes()
+    return hashlib.blake2b(message, key=subkey, digest_size=TAGSIZE // 8).digest()
+
+
+#XOR the payload bytes with the keystream: the header stays in the clear, followed by the payload size (32), the
+#encrypted payload and, with a nonce, its tag
+def writePayload(header, payload, key, nonce):
+    encrypted = payload ^ keystream(key, SALTPAY, 0, len(payload), nonce)
+    bitstring = header + '{0:032b}'.format(len(payload)) + packBits(encrypted, 8)
+    if len(nonce) > 0:
+        bitstring += packBits(numpy.frombuffer(payloadTag(key, nonce, header, encrypted), dtype=numpy.uint8), 8)
+    return bitstring
+
+
+#Payload bytes of an encrypted bitstring (without its nonce), once its tag is checked (the legacy files have none)
+def readPayload(bitstring, key, nonce):
+    size = int(bitstring[headerSize:headerSize + 32], 2)
+    n = headerSize + 32
+    encrypted = unpackBits(bitstring, n, size, 8).astype(numpy.uint8)
+    if len(nonce) > 0:
+        tag = unpackBits(bitstring, n + 8 * size, TAGSIZE // 8, 8).astype(numpy.uint8).tobytes()
+        if not hmac.compare_digest(tag, payloadTag(key, nonce, bitstring[:headerSize], encrypted)):
+            raise ValueError('Wrong password, or the file is corrupted')
+    return encrypted ^ keystream(key, SALTPAY, 0, size, nonce)
+
+
+#Entropy code everything after the header, and encrypt the resulting bytes
+def encryptPayload(bitstring, key, nonce = b''):
+    payload = numpy.frombuffer(encodePayload(bitstring), dtype=numpy.uint8)
+    return writePayload(bitstring[:headerSize], payload, key, nonce)
+
+
+def decryptPayload(bitstring, key, nonce = b''):
+    return decodePayload(bitstring[:headerSize], readPayload(bitstring, key, nonce).tobytes())
+
+
+#Digest of the key and the nonce, which tells a wrong key without decrypting anything
+def keyCheck(key, nonce):
+    return hashlib.blake2b((key + SALTCHK).encode() + nonce, digest_size=keyCheckSize // 8).digest()
+
+
+#Raise a ValueError if key is not the key of an encrypted bitstring (the legacy files have no key check)
+def checkKey(bitstring, key):
+    nonce = readHeaderNonce(bitstring)
+    if len(nonce) > 0 and not hmac.compare_digest(readHeaderKeyCheck(bitstring), keyCheck(key, nonce)):
+        raise ValueError('Wrong password')
+
+
+#Start of the refinements or frames of a plain bitstring (0 if it has none)
+def sectionsStart(bitstring):
+    if not readHeaderFlags(bitstring) & (FLAG_PROGRESSIVE | FLAG_SEQUENCE):
+        return 0
+    return clersSectionEnd(bitstring)
+
+
+#Write the nonce block after the header of an encrypted bitstring, flagged FLAG_NONCE: the nonce, the key check and the
+#start of the refinements or frames
+def insertNonce(bitstring, key, nonce, start):
+    block = packBits(numpy.frombuffer(nonce + keyCheck(key, nonce), dtype=numpy.uint8), 8) + '{0:032b}'.format(start)
+    flagged = writeHeaderFlags(bitstring, readHeaderFlags(bitstring) | FLAG_NONCE)
+    return flagged[:headerSize] + block + flagged[headerSize:]
+
+
+#Remove the nonce block following the header of an encrypted bitstring, so that its sections are where the plain
+#bitstring has them. Returns the bitstring and the nonce (empty for a legacy file)
+def stripNonce(bitstring):
+    nonce = readHeaderNonce(bitstring)
+    if len(nonce) == 0:
+        return bitstring, nonce
+    bitstring = writeHeaderFlags(bitstring, readHeaderFlags(bitstring) & ~FLAG_NONCE)
+    return bitstring[:headerSize] + bitstring[headerSize + nonceBlockSize:], nonce
+
+
+#Encrypt the sections of a plain bitstring (not a payload) with the keys of (key, nonce), its refinements or frames
+#starting at start
+def encryptSections(bitstring, k, key, workers, nonce, start):
+    bitstring = scramble(bitstring, k, key, workers, nonce)
+    bitstring = xorifyNormals(bitstring, k, key, workers, nonce)
+    bitstring = xorifyRefinements(bitstring, key, nonce, start)
+    return xorifyFrames(bitstring, key, nonce, start)
+
+
+def decryptSections(bitstring, k, key, workers, nonce, start):
+    bitstring = xorifyFrames(bitstring, key, nonce, start)
+    bitstring = xorifyRefinements(bitstring, key, nonce, start)
+    bitstring = xorifyNormals(bitstring, k, key, workers, nonce)
+    return unscramble(bitstring, k, key, workers, nonce)
+
+
+#Encrypt every section of a plain bitstring, with the schemes selected by the cipher byte of its header and keys
+#derived from a new random nonce (or the nonce given)
+@traced
+def encrypt(bitstring, k, key, workers = 1, nonce = None):
+    if nonce is None:
+        nonce = os.urandom(nonceSize // 8)
+
+    if readHeaderCipher(bitstring) & CIPHER_PAYLOAD:
+        return insertNonce(encryptPayload(bitstring, key, nonce), key, nonce, 0)
+
+    start = sectionsStart(bitstring)
+    return insertNonce(encryptSections(bitstring, k, key, workers, nonce, start), key, nonce, start)
+
+
+#Decrypt an encrypted bitstring, once its key check passed (a wrong key raises a ValueError)
+@traced
+def decrypt(bitstring, k, key, workers = 1):
+    checkKey(bitstring, key)
+    start = readHeaderSectionsStart(bitstring)
+    bitstring, nonce = stripNonce(bitstring)
+    if readHeaderCipher(bitstring) & CIPHER_PAYLOAD:
+        return decryptPayload(bitstring, key, nonce)
+
+    return decryptSections(bitstring, k, key, workers, nonce, start)
+
+
+#Replace the key of an encrypted bitstring: the sections are decrypted with the old key and encrypted with the new one
+#where they are, without decoding the mesh (an encrypted payload is decrypted and encrypted again as bytes), and the
+#file gets a new nonce
+#The old key is checked first. The legacy files have no key check: a legacy payload is decoded to check it, the other
+#legacy files cannot be checked, and the start of their refinements or frames is found by reading their CLERS section
+def rekey(bitstring, k, oldKey, newKey, workers = 1):
+    checkKey(bitstring, oldKey)
+    start = readHeaderSectionsStart(bitstring)
+    bitstring, nonce = stripNonce(bitstring)
+    newNonce = os.urandom(nonceSize // 8)
+
+    if readHeaderCipher(bitstring) & CIPHER_PAYLOAD:
+        payload = readPayload(bitstring, oldKey, nonce)
+        if len(nonce) == 0:
+            decodePayload(bitstring[:headerSize], payload.tobytes())
+        return insertNonce(writePayload(bitstring[:headerSize], payload, newKey, newNonce), newKey, newNonce, 0)
+
+    if start is None:
+        start = sectionsStart(bitstring)
+    bitstring = decryptSections(bitstring, k, oldKey, workers, nonce, start)
+    return insertNonce(encryptSections(bitstring, k, newKey, workers, newNonce, start), newKey, newNonce, start)
+
+
+#Rekey a file, written to a temporary file first so an interrupted rotation never leaves a half written file
+def rekeyFile(job):
+    filename, oldKey, newKey = job
+    bitstring = readFile(filename)
+    writeFile(rekey(bitstring, readHeader(bitstring)['k'], oldKey, newKey), filename + '.tmp')
+    os.replace(filename + '.tmp', filename)
+    return filename
+
+
+#Rekey every .rfcp file of a directory, one file per worker
+def rekeyDirectory(directory, oldKey, newKey, workers = None):
+    filenames = sorted(glob.glob(os.path.join(directory, '*.rfcp')))
+    return parallelMap(rekeyFile, [(filename, oldKey, newKey) for filename in filenames], workers)
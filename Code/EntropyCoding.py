@@ -0,0 +1,116 @@
+'''
+Entropy coding of the sections following the header, for the files encrypted with CIPHER_PAYLOAD.
+
+The positions and normals are turned into byte-aligned zigzagged deltas (in the vertex order of the file, where
+neighbouring vertices follow each other) and compressed with raw LZMA2, the rest of the bitstring (CLERS and the
+optional refinements or frames) is compressed as packed bytes. Each section keeps whichever of its raw or compressed
+bytes is the smallest. The payload is then encrypted as a whole by Encryption.encryptPayload, so its layout does not
+need to survive the encryption.
+
+Payload format: restbits(32), then for the positions, normals and rest sections: method(8), size(32), data(size bytes)
+'''
+
+import lzma
+import struct
+import numpy
+
+from Quantization import headerSize, readHeaderFlags, packBits, unpackBits, FLAG_NO_NORMALS
+from Sequence import zigzag, unzigzag
+from Tracing import traced
+
+METHOD_RAW = 0
+METHOD_LZMA = 1
+
+_filters = [{'id': lzma.FILTER_LZMA2, 'preset': 9 | lzma.PRESET_EXTREME}]
+
+
+def bitsToBytes(bitstring):
+	return numpy.packbits(numpy.frombuffer(bitstring.encode('ascii'), dtype=numpy.uint8) - ord('0')).tobytes()
+
+
+def bytesToBits(data, count):
+	bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))[:count]
+	return (bits + ord('0')).tobytes().decode('ascii')
+
+
+# Zigzagged deltas of the values along axis 0, one plane per column
+def toDeltas(values):
+	return zigzag(numpy.diff(values, axis=0, prepend=0)).T
+
+
+def fromDeltas(deltas):
+	return numpy.cumsum(unzigzag(deltas), axis=1).T
+
+
+def encodeSection(raw, transformed):
+	compressed = lzma.compress(transformed, format=lzma.FORMAT_RAW, filters=_filters)
+	method, data = (METHOD_LZMA, compressed) if len(compressed) < len(raw) else (METHOD_RAW, raw)
+	return struct.pack('>BI', method, len(data)) + data
+
+
+def decodeSection(payload, n):
+	method, size = struct.unpack('>BI', payload[n:n + 5])
+	data = payload[n + 5:n + 5 + size]
+	if method == METHOD_LZMA:
+		data = lzma.decompress(data, format=lzma.FORMAT_RAW, filters=_filters)
+	return method, data, n + 5 + size
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Bytes of the entropy coded sections of a (plain) bitstring, everything after the header
+@traced
+def encodePayload(bitstring):
+	k = int(bitstring[0:4], 2)
+	vertexCount = int(bitstring[4:36], 2)
+	normalsBits = 0 if readHeaderFlags(bitstring) & FLAG_NO_NORMALS else 17 * vertexCount
+
+	n = headerSize
+	positionsBits = bitstring[n:n + 3 * k * vertexCount]
+	positions = unpackBits(bitstring, n, 3 * vertexCount, k).reshape(-1, 3)
+	n += 3 * k * vertexCount
+	normalsBitstring = bitstring[n:n + normalsBits]
+	normals = unpackBits(bitstring, n, normalsBits // 17, 17).reshape(-1, 1)
+	n += normalsBits
+	rest = bitstring[n:]
+
+	# k is at most 15, so a zigzagged delta of two coordinates always fits on 16 bits
+	payload = struct.pack('>I', len(rest))
+	payload += encodeSection(bitsToBytes(positionsBits), toDeltas(positions).astype('>u2').tobytes())
+	payload += encodeSection(bitsToBytes(normalsBitstring), toDeltas(normals).astype('>u4').tobytes())
+	payload += encodeSection(bitsToBytes(rest), bitsToBytes(rest))
+
+	return payload
+
+
+# Bitstring (header included) from the header and the bytes of the entropy coded sections
+@traced
+def decodePayload(header, payload):
+	k = int(header[0:4], 2)
+	vertexCount = int(header[4:36], 2)
+	normalsBits = 0 if readHeaderFlags(header) & FLAG_NO_NORMALS else 17 * vertexCount
+
+	restBits, = struct.unpack('>I', payload[0:4])
+	n = 4
+	parts = [header[:headerSize]]
+
+	method, data, n = decodeSection(payload, n)
+	if method == METHOD_LZMA:
+		positions = fromDeltas(numpy.frombuffer(data, dtype='>u2').astype(numpy.int64).reshape(3, -1))
+		parts.append(packBits(positions.ravel(), k))
+	else:
+		parts.append(bytesToBits(data, 3 * k * vertexCount))
+
+	method, data, n = decodeSection(payload, n)
+	if method == METHOD_LZMA:
+		normals = fromDeltas(numpy.frombuffer(data, dtype='>u4').astype(numpy.int64).reshape(1, -1))
+		parts.append(packBits(normals.ravel(), 17))
+	else:
+		parts.append(bytesToBits(data, normalsBits))
+
+	method, data, n = decodeSection(payload, n)
+	parts.append(bytesToBits(data, restBits))
+
+	return ''.join(parts)
@@ -1,89 +1,70 @@
-import os
 import numpy
-import open3d
 import bitarray
 
+from array import array
+
+from Mesh import Mesh
+from Quantization import addFormatMarker, stripFormatMarker
+from Tracing import traced
+
+#Normalized sum of the normals, row by row
 def interpolate (A, B, C):
 	n = A + B + C
-	l = numpy.sqrt(pow(n[0], 2) + pow(n[1], 2) + pow(n[2], 2))
-	return n / l
+	l = numpy.sqrt(pow(n[:, 0], 2) + pow(n[:, 1], 2) + pow(n[:, 2], 2))
+	return n / l[:, None]
+
 
+#Face corner "v/vt/vn" (vt and vn optional) as 1-based indices, 0 when missing
+def cornerIndices(corner):
+	ids = corner.split("/")
+	return int(ids[0]), int(ids[1]) if len(ids) > 1 and ids[1] else 0, int(ids[2]) if len(ids) > 2 and ids[2] else 0
 
+
+#Each distinct v/vt/vn corner of the faces becomes a vertex, numbered in order of first appearance
+#The values are parsed into typed arrays (8 bytes per coordinate, 4 per index) instead of an object per vertex
+@traced
 def objImporter(filepath):
-	vertexIdDict = {} #Used to check if a vertex already exists
-	
-	#Positions & normals from the .obj
-	positions = []
-	normals = []
-
-	#Vertices & Vertex Normals from the mesh
-	vertices = []
-	vertexNormals = []
-	triangles = []
-	triangleNormals = []
+	positions = array('d')
+	normals = array('d')
+	corners = array('i')
 
 	with open(filepath) as file:
 		for line in file:
-			line = line.rstrip()
-			value = line.split(" ")
+			value = line.rstrip().split(" ")
 			if value[0] == "v":
-				x, y, z = float(value[1]), float(value[2]), float(value[3])
-				positions.append(numpy.array([x, y, z]))
-			if value[0] == "vn":
-				x, y, z = float(value[1]), float(value[2]), float(value[3])
-				normals.append(numpy.array([x, y, z]))
-			if value[0] == "f":
-				if value[1] not in vertexIdDict:
-					id = len(vertices)
-					vid = int(value[1].split("/")[0]) - 1
-					nid = int(value[1].split("/")[2]) - 1
-					vertices.append(positions[vid])
-					vertexNormals.append(normals[nid])
-					vertexIdDict[value[1]] = id
-				A = vertexIdDict[value[1]]
-
-				if value[2] not in vertexIdDict:
-					id = len(vertices)
-					vid = int(value[2].split("/")[0]) - 1
-					nid = int(value[2].split("/")[2]) - 1
-					vertices.append(positions[vid])
-					vertexNormals.append(normals[nid])
-					vertexIdDict[value[2]] = id
-				B = vertexIdDict[value[2]]
-				if value[3] not in vertexIdDict:
-					id = len(vertices)
-					vid = int(value[3].split("/")[0]) - 1
-					nid = int(value[3].split("/")[2]) - 1
-					vertices.append(positions[vid])
-					vertexNormals.append(normals[nid])
-					vertexIdDict[value[3]] = id
-				C = vertexIdDict[value[3]]
-				triangles.append(numpy.array([A, B, C]))
-				triangleNormals.append(interpolate(vertexNormals[A], vertexNormals[B], vertexNormals[C]))
-
-	mesh = open3d.geometry.TriangleMesh.create_sphere()
-	mesh.vertices = open3d.utility.Vector3dVector(vertices)
-	mesh.vertex_normals = open3d.utility.Vector3dVector(vertexNormals)
-	mesh.triangles = open3d.utility.Vector3iVector(triangles)
-	mesh.compute_triangle_normals()
-	print(numpy.asarray(mesh.triangle_normals))
-	print(triangleNormals)
-	print(numpy.asarray(open3d.utility.Vector3dVector(triangleNormals)))
-	mesh.triangle_normals = open3d.utility.Vector3dVector(triangleNormals)
-
-
-	print(numpy.asarray(mesh.vertices))
-	print(numpy.asarray(mesh.vertex_normals))
-	print(numpy.asarray(mesh.triangles))
-
-	#open3d.visualization.draw_geometries([mesh])
-
-	return mesh
+				positions.extend((float(value[1]), float(value[2]), float(value[3])))
+			elif value[0] == "vn":
+				normals.extend((float(value[1]), float(value[2]), float(value[3])))
+			elif value[0] == "f":
+				corners.extend(cornerIndices(value[1]) + cornerIndices(value[2]) + cornerIndices(value[3]))
+
+	positions = numpy.frombuffer(positions, dtype=numpy.float64).reshape(-1, 3)
+	normals = numpy.frombuffer(normals, dtype=numpy.float64).reshape(-1, 3)
+	corners = numpy.frombuffer(corners, dtype=numpy.int32).reshape(-1, 3)
+
+	# One key per distinct corner
+	keys = corners.astype(numpy.int64)
+	keys = (keys[:, 0] * (keys[:, 1].max(initial=0) + 1) + keys[:, 1]) * (keys[:, 2].max(initial=0) + 1) + keys[:, 2]
+	_, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+	order = numpy.argsort(first)
+	rank = numpy.empty(len(order), dtype=numpy.int64)
+	rank[order] = numpy.arange(len(order))
+	vertexCorners = corners[first[order]]
+
+	vertices = positions[vertexCorners[:, 0] - 1]
+	triangles = rank[inverse.reshape(-1)].reshape(-1, 3)
+	if len(vertexCorners) == 0 or (vertexCorners[:, 2] == 0).any():
+		return Mesh(vertices, triangles)
+
+	vertexNormals = normals[vertexCorners[:, 2] - 1]
+	triangleNormals = interpolate(vertexNormals[triangles[:, 0]], vertexNormals[triangles[:, 1]], vertexNormals[triangles[:, 2]])
+
+	return Mesh(vertices, triangles, vertexNormals, triangleNormals)
 
 
+@traced
 def objExporter(filepath, mesh):
-	os.system('rm ' + filepath)
-	file = open(filepath, "a")
+	file = open(filepath, "w")
 	for v in mesh.vertices:
 		file.write("v " + "{:.4f}".format(v[0]) + " " + "{:.4f}".format(v[1]) + " " + "{:.4f}".format(v[2]) + "\n")
 	for n in mesh.vertex_normals:
@@ -93,17 +74,19 @@ def objExporter(filepath, mesh):
 
 
 #Writes and Read from and to a bitstring
+#The file starts with the format marker (see Quantization.addFormatMarker)
+@traced
 def writeFile(bitstring, filename):
-	bitArray = bitarray.bitarray(list(map(int,bitstring)) + [0 for _ in range(8-(len(bitstring)%8))])
+	bitstring = addFormatMarker(bitstring)
+	bitArray = bitarray.bitarray(bitstring + '0' * (8 - (len(bitstring) % 8)))
 	with open(filename,"wb+") as f:
 		bitArray.tofile(f)
 
+#The bitstring following the format marker, the files written without it get the current header layout
+@traced
 def readFile(filename):
-	bitstring = ''
+	bitArray = bitarray.bitarray()
 	with open(filename, "rb") as f:
-		bytes = (list(map(str,numpy.fromfile(f,"u1"))))
-		for i in bytes:
-			bitstring += '{0:08b}'.format(int(i))
+		bitArray.frombytes(f.read())
 
-	#bitstring = bitstring[8:]
-	return bitstring
+	return stripFormatMarker(bitArray.to01())
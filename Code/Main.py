@@ -1,55 +1,72 @@
-from os import stat
-import tkinter as tk
+import os
 import traceback
-import copy
 import numpy
-
-from tkinter.ttk import Progressbar
-from tkinter import ttk
-from tkinter import filedialog
-from tkinter import scrolledtext
-
-
-
-
-import open3d
 import sys
 
-from EdgebreakerCompression import compress
-from EdgebreakerDecompression import decompress
-from MeshQualityEvaluation import evaluateWithHausdorff
-from Quantization import resizeMesh, writeHeader, printBitString, quantizeVertices, quantizedPositionsToBitstring, normalsToBitstring, clersToBitstring, readVerticesBits
-from Encryption import scramble, unscramble, xorifyNormals
+from Cleanup import preProcess
+from EdgebreakerCompression import compressComponents, compressChunks
+from EdgebreakerDecompression import decompressComponents, decompressChunks, reconstructVertexNormals
+from Quantization import CIPHER_DEFAULT, CIPHER_BLOCK_PERMUTATION, CIPHER_PAYLOAD, CIPHER_PLANES_SHIFT, FLAG_NO_NORMALS, FLAG_COMPONENTS, FLAG_CHUNKS, FLAG_PROGRESSIVE, FLAG_SEQUENCE, readHeaderFlags, resizeMesh, meshBounds, writeHeader, printBitString, quantizeVertices, quantizedPositionsToBitstring, normalsToBitstring, componentsClersToBitstring, chunksClersToBitstring, readVerticesBits
+from Encryption import encrypt, decrypt, rekeyFile, rekeyDirectory
+from Progressive import compressProgressive, refineMesh
+from Sequence import compressSequence, decompressSequence
 from ImportExport import objImporter, objExporter, writeFile, readFile
-from tkinter import *
+from Mesh import Mesh, toOpen3D
+from Profiling import profile, profiled
+from Tracing import span, traced
+
+#tkinter is only imported by the GUI (see main), the log widgets only need its insert index
+INSERT = 'insert'
 
 
 def showMesh(mesh):
+	import open3d
+
+	mesh = toOpen3D(mesh)
 	mesh.paint_uniform_color([0.6, 0.6, 0.6])
 	open3d.visualization.draw_geometries([mesh])
 
 
-def preProcess(mesh, doPrint = False):
-	if doPrint:
-		print(f'Before preprocessing:')
-		print(f'Vertices: {len(mesh.vertices)}')
-		print(f'Triangles: {len(mesh.triangles)}')
+#Decodes a decrypted bitstring into its quantized mesh, before rescaling (see cryptoExtract for levels and compact)
+def decodeMesh (bitstring, levels = None, compact = False):
+    deltas, normals, clers, dummies = readVerticesBits(bitstring, compact)
 
-	mesh = mesh.remove_degenerate_triangles()
-	mesh = mesh.remove_duplicated_triangles()
-	mesh = mesh.remove_duplicated_vertices()
-	mesh = mesh.remove_non_manifold_edges()
-	mesh = mesh.remove_unreferenced_vertices()
+    print(str(len(deltas)) + " " + str(0 if normals is None else len(normals)) + " " + str(len(clers)))
 
-	if doPrint:
-		print(f'After preprocessing:')
-		print(f'Vertices: {len(mesh.vertices)}')
-		print(f'Triangles: {len(mesh.triangles)}')
+    #Run the Edgebreaker decryption
+    if readHeaderFlags(bitstring) & FLAG_CHUNKS:
+        decompressedMesh = decompressChunks(clers, dummies, deltas, normals, False)
+    else:
+        decompressedMesh = decompressComponents(clers, deltas, normals, False)
 
-	return mesh
+    if readHeaderFlags(bitstring) & FLAG_PROGRESSIVE:
+        decompressedMesh = refineMesh(decompressedMesh, bitstring, levels)
 
+    return decompressedMesh
 
-def cryptoCompress (password, model, filename, outputWidget, outputBar):
+
+#Rescales a decoded mesh into the AABB of the header, rebuilding its normals if none were stored
+def resizeDecodedMesh (bitstring, mesh):
+    hasNormals = mesh.has_vertex_normals()
+    resizeMesh(bitstring, mesh, 10)
+
+    #No normals stored, rebuild them from the rescaled geometry
+    if not hasNormals:
+        reconstructVertexNormals(mesh)
+
+    return mesh
+
+
+#chunkTriangles > 0 compresses the mesh as independent spatial chunks of at most chunkTriangles triangles
+#progressive stores a decimated base mesh followed by refinement batches (see Progressive.py)
+#blockScrambling permutes the positions inside fixed-size blocks, which can be decrypted independently
+#planes > 0 only encrypts the planes highest bit-planes of the positions and normals (see selectiveEncryptionReport)
+#compressPayload entropy codes the sections and encrypts them with a stream cipher instead (see EntropyCoding.py)
+#compact keeps the quantized positions as integers and the normals as float32 to use less memory (see Mesh.compactTypes)
+#reportFilename decodes the compressed mesh and saves its quality metrics there as JSON (see Metrics.compressionReport)
+@traced
+@profiled('compress', label='model')
+def cryptoCompress (password, model, filename, outputWidget, outputBar, storeNormals = True, chunkTriangles = 0, progressive = False, blockScrambling = False, planes = 0, compressPayload = False, compact = False, reportFilename = None):
     outputWidget.insert(INSERT,'Starting Crypto Compression for\n')
     outputWidget.insert(INSERT,model + '\n')
     outputBar['value'] = 0
@@ -58,94 +75,251 @@ def cryptoCompress (password, model, filename, outputWidget, outputBar):
     outputBar['value'] = 20
     #Load, Quantize and Process our mesh
     outputWidget.insert(INSERT,'Importing...\n')
-    originalMesh = objImporter(model)
-    bkpMesh = copy.deepcopy(originalMesh)
+    with span('import', bytes=os.path.getsize(model)) as stage, profile('compress.import'):
+        originalMesh = objImporter(model)
+        stage.set(vertices=len(originalMesh.vertices), triangles=len(originalMesh.triangles))
+    importedMesh = Mesh(originalMesh.vertices, originalMesh.triangles, originalMesh.vertex_normals)
+    bounds = meshBounds(originalMesh)
 
     outputWidget.insert(INSERT,'Quantizing & Processing...\n')
-    quantizeVertices(originalMesh, k)
-    preProcess(originalMesh)
+    with span('quantization', k=k) as stage, profile('compress.quantization'):
+        quantizeVertices(originalMesh, k, compact)
+        preProcess(originalMesh)
+        stage.set(vertices=len(originalMesh.vertices), triangles=len(originalMesh.triangles))
 
     outputWidget.insert(INSERT,'Running EdgeBreaker...\n')
     outputBar['value'] = 40
-    #Run EdgeBreaker
-    clers, deltas, normals = compress(originalMesh, debug=False)
-    bitstring = writeHeader(bkpMesh, k, deltas)
+    #Run EdgeBreaker on every connected component, on every chunk, or on the progressive base mesh
+    refinementsBitstring = ''
+    with span('traversal') as stage, profile('compress.traversal'):
+        if progressive:
+            clers, deltas, normals, dummies, refinementsBitstring = compressProgressive(originalMesh, k, storeNormals=storeNormals)
+        elif chunkTriangles > 0:
+            clers, deltas, normals, dummies = compressChunks(originalMesh, chunkTriangles, debug=False, storeNormals=storeNormals)
+        else:
+            clers, deltas, normals, dummies = compressComponents(originalMesh, debug=False, storeNormals=storeNormals)
+        stage.set(blocks=len(clers), clersSymbols=sum(len(block) for block in clers), deltas=len(deltas))
+    flags = 0 if len(normals) > 0 else FLAG_NO_NORMALS
+    if progressive:
+        flags |= FLAG_CHUNKS | FLAG_PROGRESSIVE
+    elif chunkTriangles > 0 or any(len(componentDummies) > 0 for componentDummies in dummies):
+        #The components closed with dummy vertices are stored like chunks
+        flags |= FLAG_CHUNKS
+    elif len(clers) > 1:
+        flags |= FLAG_COMPONENTS
+    cipher = CIPHER_DEFAULT | CIPHER_BLOCK_PERMUTATION if blockScrambling else CIPHER_DEFAULT
+    if not 0 <= planes < 16:
+        raise ValueError('The number of encrypted bit-planes must be between 0 and 15')
+    cipher |= planes << CIPHER_PLANES_SHIFT
+    if compressPayload:
+        cipher = CIPHER_PAYLOAD
+    bitstring = writeHeader(originalMesh, k, deltas, flags, bounds, cipher=cipher)
 
     outputWidget.insert(INSERT,'Writing bitstring...\n')
     outputBar['value'] = 60
     #Add our deltas, normals and clers to our bitsting
-    verticesBitstring = quantizedPositionsToBitstring(deltas, k)
-    verticesBitstring = verticesBitstring.replace('-', '1') #NOTE: negative numbers can now occur, decompression should take this into account
-    #normals = originalMesh.vertex_normals #NOTE: Placeholder normal array
-    normalsBitstring = normalsToBitstring(normals, k)
-    clersBitstring = clersToBitstring(clers)
-
-    bitstring += verticesBitstring
-    bitstring += normalsBitstring
-    bitstring += clersBitstring
+    with span('sections') as stage, profile('compress.sections'):
+        verticesBitstring = quantizedPositionsToBitstring(deltas, k)
+        verticesBitstring = verticesBitstring.replace('-', '1') #NOTE: negative numbers can now occur, decompression should take this into account
+        #normals = originalMesh.vertex_normals #NOTE: Placeholder normal array
+        normalsBitstring = normalsToBitstring(normals, k) if len(normals) > 0 else ''
+        if flags & FLAG_CHUNKS:
+            clersBitstring = chunksClersToBitstring(clers, dummies)
+        else:
+            clersBitstring = componentsClersToBitstring(clers)
+
+        bitstring += verticesBitstring
+        bitstring += normalsBitstring
+        bitstring += clersBitstring
+        bitstring += refinementsBitstring
+        stage.set(positionsBits=len(verticesBitstring), normalsBits=len(normalsBitstring), clersBits=len(clersBitstring), refinementsBits=len(refinementsBitstring))
 
     print(f'{len(verticesBitstring)} - {len(normalsBitstring)} - {len(clersBitstring)}')
 
     outputWidget.insert(INSERT,'Encrypting...\n')
     outputBar['value'] = 80
     #From our bitstring, scramble positions and normals
-    bitstring = scramble(bitstring, 10, password)
-    bitstring = xorifyNormals(bitstring, 10, password)
+    plainBitstring = bitstring
+    with span('encryption', bits=len(bitstring)) as stage, profile('compress.encryption'):
+        bitstring = encrypt(bitstring, 10, password)
+        stage.set(encryptedBits=len(bitstring))
+
+    if reportFilename is not None:
+        from Metrics import compressionReport, writeReport
+
+        outputWidget.insert(INSERT,'Measuring quality...\n')
+        decodedMesh = decodeMesh(plainBitstring)
+        decodedQuantizedMesh = Mesh(decodedMesh.vertices, decodedMesh.triangles, decodedMesh.vertex_normals)
+        resizeDecodedMesh(plainBitstring, decodedMesh)
+        writeReport(compressionReport(importedMesh, decodedMesh, bitstring, originalMesh, decodedQuantizedMesh), reportFilename)
 
     printBitString(bitstring)
 
     print(str(len(deltas)) + " " + str(len(normals)) + " " + str(len(clers)))
-    writeFile(bitstring, filename)
+    with span('write', bytes=(len(bitstring) + 8) // 8), profile('compress.write'):
+        writeFile(bitstring, filename)
     #open3d.visualization.draw_geometries([mesh])
     outputWidget.insert(INSERT,'Done !\n')
     outputWidget.insert(INSERT,'Saved file :\n')
     outputWidget.insert(INSERT,filename + '\n')
     outputBar['value'] = 100
 
-def cryptoExtract (password, filename, modelFilename, outputWidget, outputBar):
+#levels limits the number of refinement batches applied to a progressive file (all of them if None)
+#compact decodes the quantized positions as integers and the normals as float32 (see Mesh.compactTypes)
+#show opens the decoded mesh in the Open3D viewer
+@traced
+@profiled('extract', label='filename')
+def cryptoExtract (password, filename, modelFilename, outputWidget, outputBar, levels = None, compact = False, show = True):
     outputWidget.insert(INSERT,'Starting Exctraction for\n')
     outputWidget.insert(INSERT,filename + '\n')
 
     outputBar['value'] = 0
 
-    bitstring = readFile(filename)
+    with span('read', bytes=os.path.getsize(filename)), profile('extract.read'):
+        bitstring = readFile(filename)
 
     outputWidget.insert(INSERT,'Decrypting...\n')
     outputBar['value'] = 20
     #Decrypt our bitstring
-    bitstring = xorifyNormals(bitstring, 10, password)
-    bitstring = unscramble(bitstring, 10, password)
+    with span('decryption', bits=len(bitstring)) as stage, profile('extract.decryption'):
+        bitstring = decrypt(bitstring, 10, password)
+        stage.set(decryptedBits=len(bitstring))
 
 
     outputWidget.insert(INSERT,'Reading Data...\n')
     outputBar['value'] = 40
-    #Read the bitsting and extract data
-    deltas, normals, clers = readVerticesBits(bitstring)
-
-    print(str(len(deltas)) + " " + str(len(normals)) + " " + str(len(clers)))
+    #Read the bitsting, extract data and run the Edgebreaker decryption
+    with span('traversal') as stage, profile('extract.traversal'):
+        decompressedMesh = decodeMesh(bitstring, levels, compact)
+        stage.set(vertices=len(decompressedMesh.vertices), triangles=len(decompressedMesh.triangles))
 
     outputWidget.insert(INSERT,'Extracting...\n')
     outputBar['value'] = 60
-    #Run the Edgebreaker decryption
-    decompressedMesh = decompress(clers, deltas, normals, False)
-
-    resizeMesh(bitstring, decompressedMesh, 10)
+    with span('dequantization'), profile('extract.dequantization'):
+        resizeDecodedMesh(bitstring, decompressedMesh)
 
     outputWidget.insert(INSERT,'Writing file...\n')
     outputBar['value'] = 80
-    objExporter(modelFilename, decompressedMesh)
+    with span('export', vertices=len(decompressedMesh.vertices), triangles=len(decompressedMesh.triangles)), profile('extract.export'):
+        objExporter(modelFilename, decompressedMesh)
 
     outputWidget.insert(INSERT,'Done !\n')
     outputWidget.insert(INSERT,'Saved file :\n')
     outputWidget.insert(INSERT,modelFilename + '\n')
     outputBar['value'] = 100
 
-    showMesh(decompressedMesh)
+    if show:
+        showMesh(decompressedMesh)
 
     return decompressedMesh
 
 
+#Replaces the password of a .rfcp file, or of every .rfcp file of a directory, without recompressing the meshes
+def cryptoRekey (oldPassword, newPassword, filename, outputWidget, outputBar, workers = None):
+    outputWidget.insert(INSERT,'Starting Rekeying for\n')
+    outputWidget.insert(INSERT,filename + '\n')
+    outputBar['value'] = 0
+
+    if os.path.isdir(filename):
+        filenames = rekeyDirectory(filename, oldPassword, newPassword, workers)
+    else:
+        filenames = [rekeyFile((filename, oldPassword, newPassword))]
+
+    outputWidget.insert(INSERT,'Done !\n')
+    outputWidget.insert(INSERT,'Rekeyed ' + str(len(filenames)) + ' file(s)\n')
+    outputBar['value'] = 100
+
+    return filenames
+
+
+#Compresses an animation: a list of .obj files sharing the same triangles, only the positions changing
+@traced
+@profiled('compressSequence', label='filename')
+def cryptoCompressSequence (password, models, filename, outputWidget, outputBar, keyframeInterval = 30, compressPayload = False):
+    outputWidget.insert(INSERT,'Starting Crypto Compression for ' + str(len(models)) + ' frames\n')
+    outputBar['value'] = 0
+
+    k = 10
+    outputWidget.insert(INSERT,'Importing...\n')
+    with span('import', frames=len(models), bytes=sum(os.path.getsize(model) for model in models)) as stage, profile('compressSequence.import'):
+        meshes = [objImporter(model) for model in models]
+        triangles = numpy.asarray(meshes[0].triangles)
+        for mesh in meshes:
+            if not numpy.array_equal(numpy.asarray(mesh.triangles), triangles):
+                raise ValueError('The frames of the sequence do not share the same triangles')
+        stage.set(vertices=len(meshes[0].vertices), triangles=len(triangles))
+
+    outputWidget.insert(INSERT,'Running EdgeBreaker on the first frame & encoding frames...\n')
+    outputBar['value'] = 40
+    with span('traversal', keyframeInterval=keyframeInterval) as stage, profile('compressSequence.traversal'):
+        bounds, clers, deltas, dummies, framesBitstring = compressSequence([numpy.asarray(mesh.vertices) for mesh in meshes], triangles, k, keyframeInterval)
+        stage.set(blocks=len(clers), clersSymbols=sum(len(block) for block in clers), deltas=len(deltas))
+
+    outputWidget.insert(INSERT,'Writing bitstring...\n')
+    outputBar['value'] = 60
+    with span('sections') as stage, profile('compressSequence.sections'):
+        bitstring = writeHeader(meshes[0], k, deltas, FLAG_NO_NORMALS | FLAG_CHUNKS | FLAG_SEQUENCE, bounds, CIPHER_PAYLOAD if compressPayload else CIPHER_DEFAULT)
+        bitstring += quantizedPositionsToBitstring(deltas, k)
+        bitstring += chunksClersToBitstring(clers, dummies)
+        bitstring += framesBitstring
+        stage.set(framesBits=len(framesBitstring))
+
+    outputWidget.insert(INSERT,'Encrypting...\n')
+    outputBar['value'] = 80
+    with span('encryption', bits=len(bitstring)) as stage, profile('compressSequence.encryption'):
+        bitstring = encrypt(bitstring, 10, password)
+        stage.set(encryptedBits=len(bitstring))
+
+    with span('write', bytes=(len(bitstring) + 8) // 8), profile('compressSequence.write'):
+        writeFile(bitstring, filename)
+    outputWidget.insert(INSERT,'Done !\n')
+    outputWidget.insert(INSERT,'Saved file :\n')
+    outputWidget.insert(INSERT,filename + '\n')
+    outputBar['value'] = 100
+
+#Extracts the frames of an animation (all of them, or the ones in indices), frame i is saved as modelFilename_i.obj
+@traced
+@profiled('extractSequence', label='filename')
+def cryptoExtractSequence (password, filename, modelFilename, outputWidget, outputBar, indices = None):
+    outputWidget.insert(INSERT,'Starting Exctraction for\n')
+    outputWidget.insert(INSERT,filename + '\n')
+    outputBar['value'] = 0
+
+    with span('read', bytes=os.path.getsize(filename)), profile('extractSequence.read'):
+        bitstring = readFile(filename)
+
+    outputWidget.insert(INSERT,'Decrypting...\n')
+    outputBar['value'] = 20
+    with span('decryption', bits=len(bitstring)) as stage, profile('extractSequence.decryption'):
+        bitstring = decrypt(bitstring, 10, password)
+        stage.set(decryptedBits=len(bitstring))
+
+    outputWidget.insert(INSERT,'Extracting...\n')
+    outputBar['value'] = 60
+    with span('traversal') as stage, profile('extractSequence.traversal'):
+        meshes = decompressSequence(bitstring, indices)
+        stage.set(frames=len(meshes))
+
+    outputWidget.insert(INSERT,'Writing files...\n')
+    outputBar['value'] = 80
+    if indices is None:
+        indices = range(len(meshes))
+    with span('export', frames=len(meshes)), profile('extractSequence.export'):
+        for index, mesh in zip(indices, meshes):
+            objExporter(modelFilename[:-4] + '_' + str(index) + '.obj', mesh)
+
+    outputWidget.insert(INSERT,'Done !\n')
+    outputBar['value'] = 100
+
+    return meshes
+
+
 def main():
+    import tkinter as tk
+
+    from tkinter import filedialog, scrolledtext
+    from tkinter.ttk import Progressbar
+
     file = ""
 
     window = tk.Tk()
@@ -158,10 +332,10 @@ def main():
     logBox = scrolledtext.ScrolledText(window)
     logBox.grid(column=1, row=20, pady=15)
 
-    fileLabel = Label(window, text="File")
+    fileLabel = tk.Label(window, text="File")
     fileLabel.grid(column=0, row=10, padx=10, pady=5)
 
-    fileText = Entry(window, width=30)
+    fileText = tk.Entry(window, width=30)
     fileText.grid(column=1, row=10, padx=10, pady=5)
 
     def fileBtnClicked ():
@@ -172,17 +346,18 @@ def main():
         filestr.replace("}", "")
         fileText.delete(0, tk.END)
         fileText.insert(0, filestr)
-    fileBtn = Button(window, text="Search", command=fileBtnClicked)
+    fileBtn = tk.Button(window, text="Search", command=fileBtnClicked)
     fileBtn.grid(column=2, row=10, padx=10, pady=5)
 
-    passwordLabel = Label(window, text="Password")
+    passwordLabel = tk.Label(window, text="Password")
     passwordLabel.grid(column=0, row=13, padx=10, pady=5)
 
-    passwordText = Entry(window,width=30, show="•")
+    passwordText = tk.Entry(window,width=30, show="•")
     passwordText.grid(column=1, row=13, padx=10, pady=5)
 
-    padding = Label(window, text="")
-    padding.grid(column=0, row=14)
+    storeNormals = tk.BooleanVar(window, value=True)
+    storeNormalsCheck = tk.Checkbutton(window, text="Store normals", variable=storeNormals)
+    storeNormalsCheck.grid(column=1, row=14, padx=10, pady=5)
 
     def startBtnClicked ():
         filename = fileText.get()
@@ -195,14 +370,14 @@ def main():
             elif filename.endswith(".obj"):
                 modelFilename = filename
                 compressedFilename = filename[:-4] + ".rfcp"
-                cryptoCompress(password, modelFilename, compressedFilename, logBox, bar)
+                cryptoCompress(password, modelFilename, compressedFilename, logBox, bar, storeNormals.get())
         except Exception as e:
             print(e)
             traceback.print_exc()
             logBox.insert(INSERT,'\nFatal Error, Aborting\n\n')
             bar['value'] = 0
 
-    startBtn = Button(window, text="Start", command=startBtnClicked)
+    startBtn = tk.Button(window, text="Start", command=startBtnClicked)
     startBtn.grid(column=0, row=15, padx=10, pady=10)
 
    
@@ -0,0 +1,113 @@
+'''
+Lightweight triangle mesh used by the codec: contiguous float64 positions and normals, int32 triangles.
+A compact mesh keeps its quantized positions as uint16 (int32 above 16 bits) and its normals as float32 instead,
+see compactTypes.
+
+It exposes the attributes of open3d.geometry.TriangleMesh the codec relies on (vertices, vertex_normals, triangles,
+triangle_normals, has_vertex_normals...), so the codec functions accept either of them. The arrays are stored as
+given when they already have the right type and layout, numpy.asarray(mesh.vertices) never copies them.
+Open3D is only imported to show a mesh (toOpen3D).
+'''
+
+import numpy
+
+
+def asVectors(values, dtype):
+	if values is None:
+		return numpy.empty((0, 3), dtype=dtype)
+	return numpy.ascontiguousarray(values, dtype=dtype).reshape(-1, 3)
+
+
+# Types of the positions and normals of a compact mesh quantized on k bits
+def compactTypes(k):
+	return numpy.uint16 if k <= 16 else numpy.int32, numpy.float32
+
+
+class Mesh:
+	def __init__(self, vertices = None, triangles = None, vertex_normals = None, triangle_normals = None, positionType = numpy.float64, normalType = numpy.float64):
+		self.positionType = positionType
+		self.normalType = normalType
+		self.vertices = vertices
+		self.triangles = triangles
+		self.vertex_normals = vertex_normals
+		self.triangle_normals = triangle_normals
+
+	@property
+	def vertices(self):
+		return self._vertices
+
+	@vertices.setter
+	def vertices(self, values):
+		self._vertices = asVectors(values, self.positionType)
+
+	@property
+	def vertex_normals(self):
+		return self._vertexNormals
+
+	@vertex_normals.setter
+	def vertex_normals(self, values):
+		self._vertexNormals = asVectors(values, self.normalType)
+
+	@property
+	def triangles(self):
+		return self._triangles
+
+	@triangles.setter
+	def triangles(self, values):
+		self._triangles = asVectors(values, numpy.int32)
+
+	@property
+	def triangle_normals(self):
+		return self._triangleNormals
+
+	@triangle_normals.setter
+	def triangle_normals(self, values):
+		self._triangleNormals = asVectors(values, self.normalType)
+
+	def has_vertex_normals(self):
+		return len(self._vertices) > 0 and len(self._vertexNormals) == len(self._vertices)
+
+	def has_triangle_normals(self):
+		return len(self._triangles) > 0 and len(self._triangleNormals) == len(self._triangles)
+
+	# Change the types of the positions and normals, converting the current arrays
+	def setTypes(self, positionType, normalType):
+		self.positionType = positionType
+		self.normalType = normalType
+		self.vertices = self._vertices
+		self.vertex_normals = self._vertexNormals
+		self.triangle_normals = self._triangleNormals
+		return self
+
+	def compute_triangle_normals(self):
+		vertices = self._vertices.astype(numpy.float64, copy=False)
+		a = vertices[self._triangles[:, 0]]
+		normals = numpy.cross(vertices[self._triangles[:, 1]] - a, vertices[self._triangles[:, 2]] - a)
+		self.triangle_normals = normals / numpy.maximum(numpy.linalg.norm(normals, axis=1), 1e-12)[:, None]
+		return self
+
+
+# Mesh from anything exposing the same attributes (like an Open3D mesh), its arrays are copied only if needed
+def toMesh(mesh):
+	if isinstance(mesh, Mesh):
+		return mesh
+
+	return Mesh(
+		numpy.asarray(mesh.vertices),
+		numpy.asarray(mesh.triangles),
+		numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None,
+		numpy.asarray(mesh.triangle_normals) if mesh.has_triangle_normals() else None
+	)
+
+
+# Open3D mesh to visualize a mesh
+def toOpen3D(mesh):
+	import open3d
+
+	open3dMesh = open3d.geometry.TriangleMesh(open3d.utility.Vector3dVector(numpy.asarray(mesh.vertices, dtype=numpy.float64)), open3d.utility.Vector3iVector(mesh.triangles))
+	if mesh.has_vertex_normals():
+		open3dMesh.vertex_normals = open3d.utility.Vector3dVector(numpy.asarray(mesh.vertex_normals, dtype=numpy.float64))
+	if mesh.has_triangle_normals():
+		open3dMesh.triangle_normals = open3d.utility.Vector3dVector(numpy.asarray(mesh.triangle_normals, dtype=numpy.float64))
+
+	return open3dMesh
@@ -1,31 +1,227 @@
 
 import math
-import open3d
+import numpy
+import os
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
 
-def closestPointID(kdtree, point):
-	[k, idx, dist] = kdtree.search_knn_vector_3d(point, 1)
-	return idx[0]
+from Encryption import encrypt, decrypt, stripNonce
+from ImportExport import readFile
+from Quantization import headerSize, fibonacci_sphere, readHeaderCipher, readHeaderFlags, writeHeaderCipher, unpackBits, bin_to_float, FLAG_NO_NORMALS, CIPHER_PLANES_SHIFT
 
 
-def calculateDistance(p1, p2):
-	return math.sqrt(math.pow(p1[0] - p2[0], 2) + math.pow(p1[1] - p2[1], 2) + math.pow(p1[2] - p2[2], 2))
+# Cells of the grid search around the cell of a point, itself included
+_neighbourCells = numpy.stack(numpy.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing='ij'), axis=-1).reshape(-1, 3)
 
 
-def evaluateWithHausdorff(originalMesh, compressedMesh):
-	hausdorffDistance = 0
+# Squared distance from each point to the closest target and the id of that target, by brute force (targets split to
+# bound the memory)
+def bruteClosestSquaredDistances(points, targets, blockSize = 1000000):
+	best = numpy.full(len(points), numpy.inf)
+	ids = numpy.full(len(points), -1)
+	step = max(1, blockSize // max(len(points), 1))
+	for start in range(0, len(targets), step):
+		squared = ((points[:, None, :] - targets[None, start:start + step, :]) ** 2).sum(axis=2)
+		blockIds = squared.argmin(axis=1)
+		blockBest = squared[numpy.arange(len(points)), blockIds]
+		closer = blockBest < best
+		best[closer] = blockBest[closer]
+		ids[closer] = start + blockIds[closer]
+	return best, ids
 
-	# Create a KdTree to quickly find closest points
-	pcd = open3d.geometry.PointCloud(originalMesh.vertices)
-	kdtree = open3d.geometry.KDTreeFlann(pcd)
 
-	# Calculate Hausdorff distance from compressedMesh to originalMesh
-	for p in compressedMesh.vertices:
-		distance = calculateDistance(p, originalMesh.vertices[closestPointID(kdtree, p)])
-		hausdorffDistance = max(distance, hausdorffDistance)
+# Targets sorted by the key of their cell in a grid of cellSize cells over their AABB, with their original ids
+def buildGrid(targets, cellSize):
+	low = targets.min(axis=0)
+	dims = numpy.floor((targets.max(axis=0) - low) / cellSize).astype(numpy.int64) + 1
+	cells = numpy.floor((targets - low) / cellSize).astype(numpy.int64)
+	keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+	order = numpy.argsort(keys, kind='stable')
+	return targets[order], keys[order], order, low, cellSize, dims
 
-	return hausdorffDistance
+
+# Squared distance from each point to the closest target and the id of that target, looking in the 27 grid cells
+# around each point. A closest target found further than a cell is not guaranteed to be the closest one, these points
+# get infinity (and the id -1)
+# The (point, candidate target) pairs are compared by batches of about pairsPerBatch to bound the memory
+def gridClosestSquaredDistances(points, grid, pairsPerBatch = 4000000):
+	sortedTargets, sortedKeys, order, low, cellSize, dims = grid
+	cells = numpy.floor((points - low) / cellSize).astype(numpy.int64)[:, None, :] + _neighbourCells[None, :, :]
+	inside = ((cells >= 0) & (cells < dims)).all(axis=2)
+	keys = (cells[..., 0] * dims[1] + cells[..., 1]) * dims[2] + cells[..., 2]
+	starts = numpy.searchsorted(sortedKeys, keys, 'left')
+	counts = numpy.where(inside, numpy.searchsorted(sortedKeys, keys, 'right') - starts, 0)
+
+	best = numpy.full(len(points), numpy.inf)
+	ids = numpy.full(len(points), -1)
+	pairs = numpy.cumsum(counts.sum(axis=1))
+	bounds = numpy.r_[0, numpy.unique(numpy.searchsorted(pairs, numpy.arange(pairsPerBatch, pairs[-1], pairsPerBatch), 'right')), len(points)] if len(points) > 0 else [0]
+	for start, end in zip(bounds[:-1], bounds[1:]):
+		batchCounts = counts[start:end].ravel()
+		total = int(batchCounts.sum())
+		if total == 0:
+			continue
+
+		# Every (point, candidate target) pair of the batch, grouped by point; the closest candidate of each point is
+		# the first one at its smallest distance
+		owners = numpy.repeat(numpy.arange(start, end), counts[start:end].sum(axis=1))
+		candidates = numpy.repeat(starts[start:end].ravel() - numpy.cumsum(batchCounts) + batchCounts, batchCounts) + numpy.arange(total)
+		squared = ((sortedTargets[candidates] - points[owners]) ** 2).sum(axis=1)
+		first = numpy.flatnonzero(numpy.r_[True, owners[1:] != owners[:-1]])
+		best[owners[first]] = numpy.minimum.reduceat(squared, first)
+		closest = numpy.minimum.reduceat(numpy.where(squared == best[owners], candidates, len(sortedTargets)), first)
+		ids[owners[first]] = order[closest]
+
+	far = best > cellSize * cellSize
+	best[far] = numpy.inf
+	ids[far] = -1
+	return best, ids
+
+
+# Distance from each point to the closest target point and the id of that target, all the points being queried at once
+# Uses SciPy's kd-tree when it is installed, a NumPy grid search otherwise, both on workers threads (None for every core)
+def closestPoints(points, targets, workers = None, chunkSize = 32768):
+	points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+	targets = numpy.asarray(targets, dtype=numpy.float64).reshape(-1, 3)
+	if len(targets) == 0:
+		return numpy.full(len(points), numpy.inf), numpy.full(len(points), -1)
+
+	try:
+		from scipy.spatial import cKDTree
+	except ImportError:
+		cKDTree = None
+
+	if cKDTree is not None:
+		return cKDTree(targets).query(points, workers=-1 if workers is None else workers)
+
+	# Cells holding about 2 targets if they filled the AABB, shrunk while the occupied cells hold more (the targets
+	# of a mesh lie on a surface, not in a volume)
+	extent = float((targets.max(axis=0) - targets.min(axis=0)).max())
+	cellSize = max(extent / max(len(targets) / 2, 1) ** (1 / 3), 1e-12)
+	for _ in range(4):
+		grid = buildGrid(targets, cellSize)
+		occupancy = len(targets) / (numpy.count_nonzero(numpy.diff(grid[1])) + 1)
+		if occupancy <= 4:
+			break
+		cellSize /= numpy.sqrt(occupancy / 2)
+
+	# The points without a target in their 27 cells are searched again in grids of 4 times larger cells, the last
+	# ones (far outside the targets) by brute force
+	best = numpy.empty(len(points))
+	ids = numpy.empty(len(points), dtype=numpy.int64)
+	remaining = numpy.arange(len(points))
+	with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+		while len(remaining) > 0 and grid[4] <= 4 * extent:
+			chunks = [points[remaining[start:start + chunkSize]] for start in range(0, len(remaining), chunkSize)]
+			results = list(pool.map(lambda chunk: gridClosestSquaredDistances(chunk, grid), chunks))
+			best[remaining] = numpy.concatenate([squared for squared, _ in results])
+			ids[remaining] = numpy.concatenate([chunkIds for _, chunkIds in results])
+			remaining = remaining[numpy.isinf(best[remaining])]
+			if len(remaining) > 0:
+				grid = buildGrid(targets, 4 * grid[4])
+
+	if len(remaining) > 0:
+		best[remaining], ids[remaining] = bruteClosestSquaredDistances(points[remaining], targets)
+	return numpy.sqrt(best), ids
+
+
+# Distance from each point to the closest target point (see closestPoints)
+def closestDistances(points, targets, workers = None):
+	distances, _ = closestPoints(points, targets, workers)
+	return distances
+
+
+# count points uniformly distributed on the surface of the triangles, from a seeded generator so that evaluations
+# can be reproduced
+def sampleSurface(vertices, triangles, count, seed = 0):
+	vertices = numpy.asarray(vertices, dtype=numpy.float64)
+	triangles = numpy.asarray(triangles)
+	a = vertices[triangles[:, 0]]
+	b = vertices[triangles[:, 1]]
+	c = vertices[triangles[:, 2]]
+	areas = 0.5 * numpy.linalg.norm(numpy.cross(b - a, c - a), axis=1)
+	if count <= 0 or areas.sum() == 0:
+		return numpy.empty((0, 3))
+
+	generator = numpy.random.default_rng(seed)
+	chosen = generator.choice(len(triangles), count, p=areas / areas.sum())
+	r1 = numpy.sqrt(generator.random(count))[:, None]
+	r2 = generator.random(count)[:, None]
+	return (1 - r1) * a[chosen] + r1 * (1 - r2) * b[chosen] + r1 * r2 * c[chosen]
+
+
+# Points of a mesh the distances are measured on: its vertices, and samples points on its triangles
+def meshPoints(mesh, samples, seed):
+	vertices = numpy.asarray(mesh.vertices, dtype=numpy.float64)
+	if samples <= 0:
+		return vertices
+	return numpy.concatenate([vertices, sampleSurface(vertices, numpy.asarray(mesh.triangles), samples, seed)])
+
+
+# Hausdorff distances in both directions: from the points of the original mesh to the closest points of the compressed
+# mesh, and the other way around. The points are the vertices, and samples points on the triangles of each mesh when
+# samples > 0 (closer to the distance between the surfaces)
+def hausdorffDistances(originalMesh, compressedMesh, samples = 0, workers = None, seed = 0):
+	originalPoints = meshPoints(originalMesh, samples, seed)
+	compressedPoints = meshPoints(compressedMesh, samples, seed + 1)
+
+	forward = closestDistances(originalPoints, compressedPoints, workers)
+	backward = closestDistances(compressedPoints, originalPoints, workers)
+	return float(forward.max(initial=0)), float(backward.max(initial=0))
+
+
+# Symmetric Hausdorff distance between the meshes (see hausdorffDistances)
+def evaluateWithHausdorff(originalMesh, compressedMesh, samples = 0, workers = None):
+	return max(hausdorffDistances(originalMesh, compressedMesh, samples, workers))
+
+
+# Distortion seen by an attacker without the key, for each number of encrypted bit-planes in planesList (0 for all):
+# the encrypted positions and normals are read as is and compared to the decrypted ones, in the vertex order of the file
+# Position errors are relative to the diagonal of the AABB, normal errors are angles in degrees
+def selectiveEncryptionReport(filename, password, planesList = range(1, 11)):
+	bitstring = readFile(filename)
+	bitstring = decrypt(bitstring, 10, password)
+
+	k = int(bitstring[0:4], 2)
+	vertexCount = int(bitstring[4:36], 2)
+	min = numpy.array([bin_to_float(bitstring[36 + 32 * axis:68 + 32 * axis]) for axis in range(3)])
+	max = numpy.array([bin_to_float(bitstring[132 + 32 * axis:164 + 32 * axis]) for axis in range(3)])
+	scale = (max - min) / (pow(2, k) - 1)
+	diagonal = numpy.linalg.norm(max - min)
+	hasNormals = not readHeaderFlags(bitstring) & FLAG_NO_NORMALS
+	fibSphere = numpy.asarray(fibonacci_sphere()) if hasNormals else None
+
+	def read(bitstring):
+		positions = unpackBits(bitstring, headerSize, 3 * vertexCount, k).reshape(-1, 3)
+		normals = unpackBits(bitstring, headerSize + 3 * k * vertexCount, vertexCount, 17) if hasNormals else None
+		return positions, normals
+
+	positions, normals = read(bitstring)
+
+	report = []
+	for planes in planesList:
+		cipher = (readHeaderCipher(bitstring) & ((1 << CIPHER_PLANES_SHIFT) - 1)) | (planes << CIPHER_PLANES_SHIFT)
+		encrypted = writeHeaderCipher(bitstring, cipher)
+		encrypted, _ = stripNonce(encrypt(encrypted, 10, password))
+		encryptedPositions, encryptedNormals = read(encrypted)
+
+		errors = numpy.linalg.norm((encryptedPositions - positions) * scale, axis=1) / diagonal
+		entry = {
+			'planes': planes,
+			'encryptedBitsRatio': (planes if 0 < planes < k else k) / k,
+			'positionsRmsError': float(numpy.sqrt(numpy.mean(errors ** 2))),
+			'positionsMaxError': float(errors.max()),
+			'displacedVerticesRatio': float(numpy.mean(errors > 0)),
+		}
+		if hasNormals:
+			cosines = numpy.clip(numpy.sum(fibSphere[encryptedNormals] * fibSphere[normals], axis=1), -1, 1)
+			entry['normalsMeanAngle'] = float(numpy.degrees(numpy.arccos(cosines)).mean())
+		report.append(entry)
+
+		print(f"M={planes}: {entry}")
+
+	return report
 
 
 def main():
@@ -0,0 +1,152 @@
+'''
+Quality metrics of a compression, all computed on whole arrays so they can run after every compression.
+
+- roundtripErrors checks that the decoded quantized mesh is exactly the one given to the encoder: same integer positions
+  and same triangles, whatever the vertex order chosen by Edgebreaker.
+- surfaceMetrics measures the distances between an original and a decoded mesh, in both directions: Hausdorff
+  (largest distance), RMS and mean distance from the points of one mesh to the closest points of the other.
+- normalMetrics measures the angles between the decoded normals and the normals of the closest original vertices,
+  whichever codec produced them (Fibonacci sphere indices, or normals rebuilt from the geometry).
+
+compressionReport gathers them into one dictionary, which writeReport saves as JSON.
+'''
+
+import json
+import numpy
+
+from EdgebreakerDecompression import matchVertices
+from MeshQualityEvaluation import closestPoints, meshPoints
+
+
+# Triangles as rows starting with their smallest vertex id (same cyclic order), to compare them as sets
+def canonicalTriangles(triangles):
+	triangles = numpy.asarray(triangles).reshape(-1, 3)
+	rotations = (numpy.argmin(triangles, axis=1)[:, None] + numpy.arange(3)) % 3
+	return numpy.take_along_axis(triangles, rotations, axis=1)
+
+
+# Number of rows of a which are not in b, counting repeated rows
+def missingRows(a, b):
+	rows, inverse = numpy.unique(numpy.concatenate([a, b]).reshape(-1, 3), axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	countsA = numpy.bincount(inverse[:len(a)], minlength=len(rows))
+	countsB = numpy.bincount(inverse[len(a):], minlength=len(rows))
+	return int(numpy.maximum(countsA - countsB, 0).sum())
+
+
+def angles(a, b):
+	a = numpy.asarray(a, dtype=numpy.float64)
+	b = numpy.asarray(b, dtype=numpy.float64)
+	cosines = (a * b).sum(axis=1) / numpy.maximum(numpy.linalg.norm(a, axis=1) * numpy.linalg.norm(b, axis=1), 1e-12)
+	return numpy.degrees(numpy.arccos(numpy.clip(cosines, -1, 1)))
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Differences between the quantized mesh given to the encoder and the decoded one, before rescaling: vertices and
+# triangles missing from either side, vertices decoded more than once, and the angles between the decoded normals and
+# the encoder's (the loss of the normal codec, when both meshes have normals)
+# exact is True when the positions and triangles are the same
+def roundtripErrors(inputMesh, decodedMesh):
+	inputVertices = numpy.asarray(inputMesh.vertices, dtype=numpy.int64)
+	decodedVertices = numpy.asarray(decodedMesh.vertices, dtype=numpy.int64)
+
+	# Input vertex of every decoded vertex, by position (positions are unique after the preprocessing)
+	ids = matchVertices(decodedVertices, inputVertices)
+	matched = ids[ids >= 0]
+	errors = {
+		'missingVertices': int(len(inputVertices) - len(numpy.unique(matched))),
+		'extraVertices': int((ids < 0).sum()),
+		'duplicatedVertices': int(len(matched) - len(numpy.unique(matched))),
+	}
+
+	# Decoded triangles in the ids of the input vertices (the ones with an unmatched vertex can only be extra)
+	decodedTriangles = ids[numpy.asarray(decodedMesh.triangles)]
+	unmatched = (decodedTriangles < 0).any(axis=1)
+	inputTriangles = canonicalTriangles(inputMesh.triangles)
+	decodedTriangles = canonicalTriangles(decodedTriangles[~unmatched])
+	errors['missingTriangles'] = missingRows(inputTriangles, decodedTriangles)
+	errors['extraTriangles'] = missingRows(decodedTriangles, inputTriangles) + int(unmatched.sum())
+
+	errors['exact'] = all(count == 0 for count in errors.values())
+
+	if inputMesh.has_vertex_normals() and decodedMesh.has_vertex_normals() and len(matched) > 0:
+		normalErrors = angles(numpy.asarray(decodedMesh.vertex_normals)[ids >= 0], numpy.asarray(inputMesh.vertex_normals)[matched])
+		errors['normalsMeanAngle'] = float(normalErrors.mean())
+		errors['normalsMaxAngle'] = float(normalErrors.max())
+
+	return errors
+
+
+# Distances between the surfaces of the meshes, measured from the points of each mesh (its vertices, and samples points
+# on its triangles when samples > 0) to the closest points of the other: forward from the original to the decoded mesh,
+# backward from the decoded to the original one. The symmetric values take both point sets together
+# Distances are also given relative to the diagonal of the AABB of the original mesh
+def surfaceMetrics(originalMesh, decodedMesh, samples = 0, workers = None, seed = 0):
+	originalPoints = meshPoints(originalMesh, samples, seed)
+	decodedPoints = meshPoints(decodedMesh, samples, seed + 1)
+	forward, _ = closestPoints(originalPoints, decodedPoints, workers)
+	backward, _ = closestPoints(decodedPoints, originalPoints, workers)
+	both = numpy.concatenate([forward, backward])
+
+	metrics = {}
+	for name, distances in (('Forward', forward), ('Backward', backward), ('', both)):
+		metrics['hausdorff' + name] = float(distances.max(initial=0))
+		metrics['rms' + name] = float(numpy.sqrt(numpy.mean(distances ** 2))) if len(distances) > 0 else 0.0
+		metrics['mean' + name] = float(distances.mean()) if len(distances) > 0 else 0.0
+
+	vertices = numpy.asarray(originalMesh.vertices, dtype=numpy.float64)
+	diagonal = float(numpy.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0))) if len(vertices) > 0 else 0.0
+	metrics['diagonal'] = diagonal
+	for name in ('hausdorff', 'rms', 'mean'):
+		metrics[name + 'Relative'] = metrics[name] / diagonal if diagonal > 0 else 0.0
+
+	return metrics
+
+
+# Angles in degrees between the normal of every decoded vertex and the normal of the closest original vertex
+# Empty if either mesh has no normals
+def normalMetrics(originalMesh, decodedMesh, workers = None):
+	if not originalMesh.has_vertex_normals() or not decodedMesh.has_vertex_normals():
+		return {}
+
+	_, ids = closestPoints(decodedMesh.vertices, originalMesh.vertices, workers)
+	errors = angles(decodedMesh.vertex_normals, numpy.asarray(originalMesh.vertex_normals)[ids])
+	return {
+		'normalsMeanAngle': float(errors.mean()),
+		'normalsMaxAngle': float(errors.max()),
+	}
+
+
+# Report of a compression: the sizes, the exact roundtrip check on the quantized meshes when they are given, and the
+# distances and normal errors between the original and the decoded (rescaled) meshes
+# The bits per vertex and per triangle are those of the encoded mesh: the quantized and cleaned inputMesh, or the decoded
+# mesh when it is not given (the original mesh of an OBJ has one vertex per distinct face corner)
+def compressionReport(originalMesh, decodedMesh, bitstring, inputMesh = None, decodedQuantizedMesh = None, samples = 0, workers = None):
+	encodedMesh = inputMesh if inputMesh is not None else decodedMesh
+	vertexCount = len(encodedMesh.vertices)
+	triangleCount = len(encodedMesh.triangles)
+	report = {
+		'vertices': len(originalMesh.vertices),
+		'triangles': len(originalMesh.triangles),
+		'encodedVertices': vertexCount,
+		'encodedTriangles': triangleCount,
+		'decodedVertices': len(decodedMesh.vertices),
+		'decodedTriangles': len(decodedMesh.triangles),
+		'bits': len(bitstring),
+		'bitsPerVertex': len(bitstring) / vertexCount if vertexCount > 0 else 0.0,
+		'bitsPerTriangle': len(bitstring) / triangleCount if triangleCount > 0 else 0.0,
+	}
+	if inputMesh is not None and decodedQuantizedMesh is not None:
+		report['roundtrip'] = roundtripErrors(inputMesh, decodedQuantizedMesh)
+	report['surface'] = surfaceMetrics(originalMesh, decodedMesh, samples, workers)
+	report['normals'] = normalMetrics(originalMesh, decodedMesh, workers)
+
+	return report
+
+
+def writeReport(report, filename):
+	with open(filename, 'w') as file:
+		json.dump(report, file, indent=4)
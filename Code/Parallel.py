@@ -0,0 +1,30 @@
+import os
+
+
+_defaultWorkers = None
+
+
+# Number of workers of the maps called with workers = None (every core when None), like 1 in the processes which are
+# already one worker of many (see Batch.py)
+def setDefaultWorkers(workers):
+	global _defaultWorkers
+	_defaultWorkers = workers
+
+
+# Maps function over jobs, in a process pool when there is more than one job and more than one worker
+# The function must be defined at module level so the workers can import it
+def parallelMap(function, jobs, workers = None):
+	jobs = list(jobs)
+
+	if workers is None:
+		workers = _defaultWorkers or os.cpu_count() or 1
+	workers = min(workers, len(jobs))
+
+	if workers <= 1:
+		return [function(job) for job in jobs]
+
+	# Imported here: multiprocessing takes longer to import than most single-process runs take
+	from concurrent.futures import ProcessPoolExecutor
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		return list(executor.map(function, jobs))
@@ -0,0 +1,165 @@
+'''
+Performance regression gate: runs a fixed set of models through the benchmark (see Benchmark.py) and compares the time
+of the compression, encryption, decryption and decompression stages, the peak memory and the bits per vertex with a
+baseline committed next to this file (PerfBaseline.json).
+
+A metric regresses when it is worse than the baseline by more than its relative tolerance (and, for the times, by more
+than timeFloor seconds, under which the differences are noise). Times are the fastest of the runs, and the models with
+a time regression are measured again, keeping the fastest of both measures, so that a busy machine does not fail the
+gate on its own. The gate prints every compared metric and exits with 1 when one of them regresses, 0 otherwise. It
+runs headless, nothing is shown.
+
+	python PerfGate.py							# check against the baseline
+	python PerfGate.py --tolerance time=0.5		# looser time tolerance
+	python PerfGate.py --update					# save the current numbers as the new baseline
+
+Times depend on the machine: the baseline is only meaningful on the machine it was made on, update it there.
+'''
+
+import argparse
+import json
+import os
+import sys
+
+from Benchmark import benchmark
+
+# Models of the gate: small and medium models of Models/, and synthetic meshes of both kinds of topology
+MODELS = ('bunny_simple.obj', 'suzanne.obj', 'Igea_simple.obj', 'sphere:20000', 'terrain:20000')
+
+# Stages summed into each compared time
+GROUPS = {
+	'compressTime': ('compress.quantization', 'compress.traversal', 'compress.sections'),
+	'encryptTime': ('compress.encryption',),
+	'decryptTime': ('extract.decryption',),
+	'decompressTime': ('extract.traversal', 'extract.dequantization'),
+}
+
+# Relative tolerance of each kind of metric
+TOLERANCES = {
+	'time': 0.25,
+	'peakMemory': 0.15,
+	'bitsPerVertex': 0.001,
+}
+
+_baselineFilename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PerfBaseline.json')
+_modelsDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Models')
+
+
+def metricKind(metric):
+	return 'time' if metric.endswith('Time') else metric
+
+
+# Compared metrics of a benchmark result: the fastest run of each group of stages, the peak memory and the bits per
+# vertex
+def gateMetrics(result):
+	metrics = {group: sum(result['stages'][stage]['min'] for stage in stages) for group, stages in GROUPS.items()}
+	metrics['peakMemory'] = result['peakMemory']
+	metrics['bitsPerVertex'] = result['bitsPerVertex']
+	return metrics
+
+
+def measure(models = MODELS, warmup = 1, repeat = 5):
+	paths = [model if ':' in model else os.path.join(_modelsDirectory, model) for model in models]
+	results = benchmark(paths, warmup, repeat)
+
+	measured = {}
+	for result in results['models']:
+		if 'error' in result:
+			raise RuntimeError(f"{result['model']}: {result['error']}")
+		measured[result['model']] = gateMetrics(result)
+
+	return results['environment'], measured
+
+
+# Every (model, metric, baseline, current, change, regressed) of the comparison, the models and metrics missing from
+# either side (or without a value) being reported as regressions
+def compare(baseline, measured, tolerances, timeFloor = 0.01):
+	rows = []
+	for model in sorted(set(baseline) | set(measured)):
+		if model not in baseline or model not in measured:
+			rows.append((model, 'missing from the ' + ('baseline' if model not in baseline else 'run'), None, None, None, True))
+			continue
+
+		metrics = list(baseline[model]) + [metric for metric in measured[model] if metric not in baseline[model]]
+		for metric in metrics:
+			reference = baseline[model].get(metric)
+			current = measured[model].get(metric)
+			if reference is None or current is None:
+				rows.append((model, metric + ' missing from the ' + ('baseline' if reference is None else 'run'), None, None, None, True))
+				continue
+
+			change = (current - reference) / reference if reference else 0.0
+			regressed = change > tolerances[metricKind(metric)]
+			if metricKind(metric) == 'time':
+				regressed = regressed and current - reference > timeFloor
+			rows.append((model, metric, reference, current, change, regressed))
+
+	return rows
+
+
+# Measures of the models with a time regression taken again, keeping the fastest time of both measures
+def confirmRegressions(rows, measured, warmup, repeat):
+	models = sorted({model for model, metric, _, _, _, regressed in rows if regressed and metricKind(metric) == 'time'})
+	if len(models) == 0:
+		return measured
+
+	_, remeasured = measure(models, warmup, repeat)
+	for model in models:
+		for metric, value in remeasured[model].items():
+			if metricKind(metric) == 'time':
+				measured[model][metric] = min(measured[model].get(metric, value), value)
+
+	return measured
+
+
+def printComparison(rows):
+	print(f"{'model':<20}{'metric':<16}{'baseline':>14}{'current':>14}{'change':>10}")
+	for model, metric, reference, current, change, regressed in rows:
+		if reference is None:
+			print(f"{model:<20}{metric:<16}{'':>38}  REGRESSION")
+			continue
+		print(f"{model:<20}{metric:<16}{reference:>14.4g}{current:>14.4g}{change:>+10.1%}" + ('  REGRESSION' if regressed else ''))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Performance regression gate of the codec')
+	parser.add_argument('--baseline', default=_baselineFilename, help='baseline JSON file')
+	parser.add_argument('--update', action='store_true', help='save the current numbers as the baseline instead of checking them')
+	parser.add_argument('--tolerance', action='append', default=[], metavar='KIND=VALUE', help='relative tolerance of time, peakMemory or bitsPerVertex')
+	parser.add_argument('--warmup', type=int, default=1)
+	parser.add_argument('--repeat', type=int, default=5)
+	arguments = parser.parse_args()
+
+	tolerances = dict(TOLERANCES)
+	if os.path.exists(arguments.baseline):
+		with open(arguments.baseline) as file:
+			tolerances.update(json.load(file).get('tolerances', {}))
+	for tolerance in arguments.tolerance:
+		kind, value = tolerance.split('=')
+		if kind not in TOLERANCES:
+			parser.error(f'unknown tolerance {kind}, expected one of {", ".join(TOLERANCES)}')
+		tolerances[kind] = float(value)
+
+	environment, measured = measure(warmup=arguments.warmup, repeat=arguments.repeat)
+
+	if arguments.update:
+		with open(arguments.baseline, 'w') as file:
+			json.dump({'environment': environment, 'tolerances': tolerances, 'models': measured}, file, indent=4)
+		print(f'Baseline saved to {arguments.baseline}')
+		return 0
+
+	with open(arguments.baseline) as file:
+		baseline = json.load(file)
+
+	rows = compare(baseline['models'], measured, tolerances)
+	measured = confirmRegressions(rows, measured, arguments.warmup, arguments.repeat)
+	rows = compare(baseline['models'], measured, tolerances)
+	printComparison(rows)
+
+	regressions = sum(row[-1] for row in rows)
+	print(f'{regressions} regression(s)' if regressions else 'No regression')
+	return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,291 @@
+'''
+Profiling of the pipeline stages, switched on from the command line or the environment instead of editing the code.
+
+	with profile('compress.traversal'):
+		clers, deltas, normals, dummies = compressComponents(mesh, storeNormals=storeNormals)
+
+	@profiled('compress')
+	def cryptoCompress(...): ...
+
+A stage is only profiled when its name matches one of the enabled patterns (fnmatch patterns, like "compress",
+"compress.*" or "*"). Profiling is disabled by default, profile then returns a shared object doing nothing. It is
+enabled by enable(stages), or for every process by the environment:
+
+	RFCP_PROFILE=compress.*,extract		# patterns of the profiled stages
+	RFCP_PROFILE_DIR=profiles			# directory of the outputs (profiles by default)
+	RFCP_PROFILE_SAMPLING=0.005			# sampling mode, every 5 ms
+
+Every stage gets one output per file, named after the label given by setLabel (the model or compressed file being
+processed, "process<pid>" by default): <directory>/<stage>/<label>.prof, a cProfile dump to open with pstats or
+snakeviz. The runs of a stage with the same label accumulate into the same output, saved again at the end of every
+run. Only the outermost profiled stage of a thread is profiled by cProfile, the stages it holds are part of its output.
+
+cProfile traces every call, which makes long runs several times slower. The sampling mode only records the stack of
+the profiled thread every interval seconds: <directory>/<stage>/<label>.samples holds one "frame;frame;... count" line
+per stack (the collapsed format of flamegraph.pl and speedscope), and nested stages all get their samples.
+
+aggregate(directory) merges the outputs of every file of a stage, of a batch run in any number of processes, into
+<directory>/aggregate/<stage>.prof (or .samples) and writes the functions taking the most time in every stage to
+<directory>/aggregate/summary.txt:
+
+	python Profiling.py profiles
+'''
+
+import argparse
+import collections
+import functools
+import glob
+import io
+import os
+import sys
+import threading
+import time
+
+
+_patterns = []					# Patterns of the profiled stages, profiling is disabled when empty
+_directory = 'profiles'
+_interval = None				# Sampling interval in seconds, None for cProfile
+_label = None
+_profiles = {}					# (stage, label): cProfile.Profile, or the Counter of the collapsed stacks when sampling
+_lock = threading.Lock()
+_local = threading.local()
+_sessions = []					# Open sampled stages
+_sampler = None
+
+
+# cProfile, fnmatch, inspect and pstats are only imported once profiling is enabled, which keeps them out of the
+# startup of the short processes
+def isProfiled(stage):
+	import fnmatch
+
+	return any(fnmatch.fnmatchcase(stage, pattern) for pattern in _patterns)
+
+
+def currentLabel():
+	return _label or f'process{os.getpid()}'
+
+
+def outputFilename(directory, stage, label, extension):
+	return os.path.join(directory, stage, label.replace(os.sep, '_') + extension)
+
+
+# Stack of a frame as "function (file:line);..." from the outermost call
+def collapsedStack(frame):
+	names = []
+	while frame is not None:
+		names.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+		frame = frame.f_back
+	return ';'.join(reversed(names))
+
+
+def sampleStacks(interval):
+	while _interval is not None and len(_patterns) > 0:
+		frames = sys._current_frames()
+		with _lock:
+			for session in _sessions:
+				if session.threadId in frames:
+					session.samples[collapsedStack(frames[session.threadId])] += 1
+		time.sleep(interval)
+
+
+class Profile:
+	def __init__(self, stage):
+		self.stage = stage
+
+	def __enter__(self):
+		key = self.key = (self.stage, currentLabel())
+		if _interval is not None:
+			self.threadId = threading.get_ident()
+			with _lock:
+				self.samples = _profiles.setdefault(key, collections.Counter())
+				_sessions.append(self)
+			return self
+
+		import cProfile
+
+		# cProfile replaces the profiler of the thread: the stages inside a profiled stage are left to it
+		self.profiler = None
+		if getattr(_local, 'active', False):
+			return self
+		with _lock:
+			self.profiler = _profiles.setdefault(key, cProfile.Profile())
+		_local.active = True
+		self.profiler.enable()
+		return self
+
+	def __exit__(self, *exception):
+		if _interval is not None:
+			with _lock:
+				_sessions.remove(self)
+			save(*self.key, self.samples)
+		elif self.profiler is not None:
+			self.profiler.disable()
+			_local.active = False
+			save(*self.key, self.profiler)
+		return False
+
+
+class NullProfile:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		return False
+
+
+_nullProfile = NullProfile()
+
+
+# Saves the output of a stage and label, with every run so far (the worker processes of multiprocessing do not run the
+# atexit functions, so the outputs are saved as soon as a stage ends)
+def save(stage, label, profile):
+	os.makedirs(os.path.join(_directory, stage), exist_ok=True)
+	if isinstance(profile, collections.Counter):
+		with _lock:
+			samples = profile.most_common()
+		with open(outputFilename(_directory, stage, label, '.samples'), 'w') as file:
+			for stack, count in samples:
+				file.write(f'{stack} {count}\n')
+	else:
+		profile.dump_stats(outputFilename(_directory, stage, label, '.prof'))
+
+
+def readSamples(filename):
+	samples = collections.Counter()
+	with open(filename) as file:
+		for line in file:
+			stack, _, count = line.rstrip('\n').rpartition(' ')
+			if stack:
+				samples[stack] += int(count)
+	return samples
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+def isEnabled():
+	return len(_patterns) > 0
+
+
+# Context manager profiling the code it holds when stage is enabled
+def profile(stage):
+	if len(_patterns) == 0 or not isProfiled(stage):
+		return _nullProfile
+	return Profile(stage)
+
+
+# Decorator profiling the function as stage when it is enabled, labelled by its argument named label when given (the
+# file it processes)
+def profiled(stage, label = None):
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if len(_patterns) == 0:
+				return function(*args, **kwargs)
+			if label is not None:
+				import inspect
+
+				setLabel(inspect.signature(function).bind(*args, **kwargs).arguments[label])
+			with profile(stage):
+				return function(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+# Name of the outputs of the next profiled stages (the file being processed)
+def setLabel(label):
+	global _label
+	_label = os.path.basename(label) if label else None
+
+
+# Starts profiling the stages matching stages (a comma separated string or a list of fnmatch patterns), saving the
+# outputs to directory; every interval seconds in the sampling mode when interval is given
+def enable(stages, directory = 'profiles', interval = None):
+	global _patterns, _directory, _interval, _sampler
+	disable()
+
+	_patterns = stages.split(',') if isinstance(stages, str) else list(stages)
+	_directory = directory
+	_interval = interval
+	if interval is not None:
+		_sampler = threading.Thread(target=sampleStacks, args=(interval,), daemon=True)
+		_sampler.start()
+
+
+# Stops profiling (the outputs are already saved)
+def disable():
+	global _patterns, _interval, _sampler
+	_patterns = []
+	if _sampler is not None:
+		_sampler.join()
+		_sampler = None
+	_interval = None
+	_profiles.clear()
+
+
+# Merges the outputs of every file of every stage of directory into directory/aggregate, and writes the top functions
+# of every stage to directory/aggregate/summary.txt
+# Returns the summary
+def aggregate(directory = 'profiles', top = 20):
+	import pstats
+
+	output = os.path.join(directory, 'aggregate')
+	os.makedirs(output, exist_ok=True)
+	summary = io.StringIO()
+
+	for stageDirectory in sorted(glob.glob(os.path.join(directory, '*', ''))):
+		stage = os.path.basename(os.path.dirname(stageDirectory))
+		if stage == 'aggregate':
+			continue
+
+		profiles = sorted(glob.glob(os.path.join(stageDirectory, '*.prof')))
+		if len(profiles) > 0:
+			stats = pstats.Stats(*profiles, stream=summary)
+			stats.dump_stats(os.path.join(output, stage + '.prof'))
+			summary.write(f'==== {stage}: {len(profiles)} file(s)\n')
+			stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+
+		sampleFiles = sorted(glob.glob(os.path.join(stageDirectory, '*.samples')))
+		if len(sampleFiles) > 0:
+			samples = collections.Counter()
+			for filename in sampleFiles:
+				samples.update(readSamples(filename))
+			with open(os.path.join(output, stage + '.samples'), 'w') as file:
+				for stack, count in samples.most_common():
+					file.write(f'{stack} {count}\n')
+
+			# Samples of every function at the top of the stack (its own time)
+			total = sum(samples.values())
+			own = collections.Counter()
+			for stack, count in samples.items():
+				own[stack.rpartition(';')[2]] += count
+			summary.write(f'==== {stage}: {len(sampleFiles)} file(s), {total} samples\n')
+			for function, count in own.most_common(top):
+				summary.write(f'{count:>10} {count / total:>7.1%}  {function}\n')
+			summary.write('\n')
+
+	with open(os.path.join(output, 'summary.txt'), 'w') as file:
+		file.write(summary.getvalue())
+
+	return summary.getvalue()
+
+
+if os.environ.get('RFCP_PROFILE'):
+	enable(os.environ['RFCP_PROFILE'], os.environ.get('RFCP_PROFILE_DIR', 'profiles'), float(os.environ['RFCP_PROFILE_SAMPLING']) if os.environ.get('RFCP_PROFILE_SAMPLING') else None)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Merges the profiles of every file of every stage')
+	parser.add_argument('directory', nargs='?', default='profiles', help='directory of the profiles (RFCP_PROFILE_DIR)')
+	parser.add_argument('--top', type=int, default=20, help='functions listed per stage')
+	arguments = parser.parse_args()
+
+	print(aggregate(arguments.directory, arguments.top))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,359 @@
+'''
+Progressive level-of-detail stream.
+
+The mesh is decimated by rounds of vertex removals. Each round removes an independent set of interior vertices,
+and each hole is retriangulated with a fan. The decimated base mesh is compressed with Edgebreaker (as chunks),
+and the rounds are stored in reverse order as refinement batches. Each batch holds one record per removed vertex:
+its position, its normal and its ring of neighbours. A batch can be applied as soon as it is read, so a reader can
+stop after any prefix of the batches and still get a valid mesh.
+'''
+
+import numpy
+
+from EdgebreakerCompression import compressChunks
+from EdgebreakerDecompression import decompressChunks, matchVertices
+from Mesh import Mesh
+from Quantization import readHeaderFlags, clersSectionEnd, normalsToBitstring, fibonacci_sphere, FLAG_NO_NORMALS
+from Tracing import traced
+
+
+_maxValence = 12			# Vertices with more neighbours are never removed (valence is stored on 4 bits)
+
+
+# ------------------------------------------------------------
+# Decimation
+# ------------------------------------------------------------
+
+# Ordered ring of neighbours of an interior vertex, oriented like its triangles (None if the vertex is not interior)
+def orderedRing(v, star, triangles):
+	following = {}
+	for t in star:
+		a, b, c = triangles[t]
+		if a == v:
+			following[b] = c
+		elif b == v:
+			following[c] = a
+		else:
+			following[a] = b
+
+	if len(following) != len(star):
+		return None
+
+	first = next(iter(following))
+	ring = [first]
+	while True:
+		nextVertex = following.get(ring[-1])
+		if nextVertex is None:
+			return None
+		if nextVertex == first:
+			break
+		ring.append(nextVertex)
+		if len(ring) > len(star):
+			return None
+
+	return ring if len(ring) == len(star) else None
+
+
+def edgeKey(a, b):
+	return (a, b) if a < b else (b, a)
+
+
+def cross(u, v):
+	return (u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0])
+
+
+def triangleNormal(vertices, a, b, c):
+	pa, pb, pc = vertices[a], vertices[b], vertices[c]
+	return cross((pb[0] - pa[0], pb[1] - pa[1], pb[2] - pa[2]), (pc[0] - pa[0], pc[1] - pa[1], pc[2] - pa[2]))
+
+
+# Rotation of the ring so that the fan from its first vertex creates neither an existing edge nor a flipped triangle
+def fanStart(v, ring, vertices, edges, vertexTriangles):
+	n = len(ring)
+
+	if n == 3:
+		# The fan is a single triangle, which must not exist already
+		if len(vertexTriangles[ring[0]] & vertexTriangles[ring[1]] & vertexTriangles[ring[2]] - vertexTriangles[v]) > 0:
+			return None
+
+	starNormal = [0, 0, 0]
+	for i in range(n):
+		normal = triangleNormal(vertices, v, ring[i], ring[(i + 1) % n])
+		starNormal = [starNormal[0] + normal[0], starNormal[1] + normal[1], starNormal[2] + normal[2]]
+
+	for start in range(n):
+		r = ring[start:] + ring[:start]
+		if any(edgeKey(r[0], r[i]) in edges for i in range(2, n - 1)):
+			continue
+
+		flipped = False
+		for i in range(1, n - 1):
+			normal = triangleNormal(vertices, r[0], r[i], r[i + 1])
+			if normal[0] * starNormal[0] + normal[1] * starNormal[1] + normal[2] * starNormal[2] <= 0:
+				flipped = True
+				break
+
+		if not flipped:
+			return start
+
+	return None
+
+
+# Decimate the mesh down to about minVertices vertices, in at most maxBatches rounds
+# Returns the base triangles and the rounds, each round being a list of (removed vertex id, ordered ring of vertex ids)
+def decimate(vertices, triangles, minVertices, maxBatches = 32):
+	points = vertices.tolist()
+	triangles = [tuple(t) for t in triangles.tolist()]
+	vertexCount = len(vertices)
+
+	vertexTriangles = [set() for _ in range(vertexCount)]
+	edges = set()
+	for i, (a, b, c) in enumerate(triangles):
+		vertexTriangles[a].add(i)
+		vertexTriangles[b].add(i)
+		vertexTriangles[c].add(i)
+		edges.update((edgeKey(a, b), edgeKey(b, c), edgeKey(c, a)))
+
+	aliveCount = int(numpy.count_nonzero(numpy.bincount(numpy.asarray(triangles).ravel(), minlength=vertexCount)))
+	rounds = []
+
+	while len(rounds) < maxBatches and aliveCount > minVertices:
+		current = numpy.asarray([t for t in triangles if t is not None])
+
+		# Boundary vertices can't be removed: they are the ends of half-edges without twin
+		starts = current.ravel().astype(numpy.int64)
+		ends = current[:, [1, 2, 0]].ravel().astype(numpy.int64)
+		boundary = ~numpy.isin(ends * vertexCount + starts, starts * vertexCount + ends)
+
+		# Remove the flattest vertices first: distance to the average of their neighbours
+		neighbourSum = numpy.stack([numpy.bincount(starts, weights=vertices[ends, axis], minlength=vertexCount) for axis in range(3)], axis=1)
+		valence = numpy.bincount(starts, minlength=vertexCount)
+		score = numpy.linalg.norm(vertices - neighbourSum / numpy.maximum(valence, 1)[:, None], axis=1)
+
+		locked = valence == 0
+		locked[starts[boundary]] = True
+		locked[valence > _maxValence] = True
+
+		records = []
+		for v in numpy.argsort(score, kind='stable').tolist():
+			if locked[v] or aliveCount - len(records) <= minVertices:
+				continue
+
+			star = vertexTriangles[v]
+			ring = orderedRing(v, star, triangles)
+			if ring is None:
+				continue
+
+			start = fanStart(v, ring, points, edges, vertexTriangles)
+			if start is None:
+				continue
+			ring = ring[start:] + ring[:start]
+
+			# Replace the star of v by the fan from ring[0]
+			for t in star:
+				for u in triangles[t]:
+					if u != v:
+						vertexTriangles[u].discard(t)
+				triangles[t] = None
+			vertexTriangles[v] = set()
+			for u in ring:
+				edges.discard(edgeKey(v, u))
+
+			for i in range(1, len(ring) - 1):
+				t = len(triangles)
+				triangles.append((ring[0], ring[i], ring[i + 1]))
+				vertexTriangles[ring[0]].add(t)
+				vertexTriangles[ring[i]].add(t)
+				vertexTriangles[ring[i + 1]].add(t)
+				edges.add(edgeKey(ring[0], ring[i + 1]))
+
+			locked[v] = True
+			locked[ring] = True
+			records.append((v, ring))
+
+		if len(records) == 0:
+			break
+
+		aliveCount -= len(records)
+		rounds.append(records)
+
+	return numpy.asarray([t for t in triangles if t is not None]), rounds
+
+
+# ------------------------------------------------------------
+# Refinement batches
+# ------------------------------------------------------------
+
+#Batch format: batchbits(32), recordnb(32), then for each record:
+#valence(4), x(k), y(k), z(k), normal(17, unless the file has no normals), ring ids (valence * idbits)
+#idbits is the bit length of the vertex count before the batch, batchbits the size of the batch after its own field
+#normalsBitstring holds the 17 bit normal of each record ('' if the file has no normals)
+def batchToBitstring(positions, normalsBitstring, rings, k, vertexCount):
+	idBits = max(1, (vertexCount - 1).bit_length())
+
+	bitstring = '{0:032b}'.format(len(rings))
+	for i in range(len(rings)):
+		bitstring += '{0:04b}'.format(len(rings[i]))
+		for axis in range(3):
+			bitstring += str('{0:0' + str(k) + 'b}').format(int(positions[i][axis]))
+		bitstring += normalsBitstring[17 * i:17 * (i + 1)]
+		for u in rings[i]:
+			bitstring += str('{0:0' + str(idBits) + 'b}').format(u)
+
+	return '{0:032b}'.format(len(bitstring)) + bitstring
+
+
+def readBatchBits(bitstring, n, k, vertexCount, hasNormals, fibSphere):
+	idBits = max(1, (vertexCount - 1).bit_length())
+
+	recordCount = int(bitstring[n:n + 32], 2)
+	n += 32
+
+	positions = numpy.zeros([recordCount, 3])
+	normals = numpy.zeros([recordCount, 3]) if hasNormals else None
+	rings = []
+	for i in range(recordCount):
+		valence = int(bitstring[n:n + 4], 2)
+		n += 4
+		for axis in range(3):
+			positions[i][axis] = int(bitstring[n:n + k], 2)
+			n += k
+		if hasNormals:
+			normals[i] = fibSphere[int(bitstring[n:n + 17], 2)]
+			n += 17
+		rings.append([int(bitstring[n + idBits * j:n + idBits * (j + 1)], 2) for j in range(valence)])
+		n += idBits * valence
+
+	return positions, normals, rings
+
+
+# Start and size (after the size field) of every complete batch in the bitstring, which may be a prefix of a file
+# n is the start of the refinements when it is already known, which saves reading the CLERS section
+def batchesBounds(bitstring, n = None):
+	if n is None:
+		n = clersSectionEnd(bitstring)
+	batchCount = int(bitstring[n:n + 32], 2)
+	n += 32
+
+	bounds = []
+	for _ in range(batchCount):
+		if n + 32 > len(bitstring):
+			break
+		batchBits = int(bitstring[n:n + 32], 2)
+		n += 32
+		if n + batchBits > len(bitstring):
+			break
+		bounds.append((n, batchBits))
+		n += batchBits
+
+	return bounds
+
+
+# Split the vertices removed in a batch by valence, and apply them: remove the fans and put back the stars
+def applyBatch(vertices, normals, triangles, batch):
+	positions, batchNormals, rings = batch
+	firstId = len(vertices)
+
+	removed = []
+	added = []
+	valences = numpy.array([len(ring) for ring in rings])
+	for valence in numpy.unique(valences).tolist():
+		records = numpy.flatnonzero(valences == valence)
+		ringIds = numpy.array([rings[i] for i in records.tolist()])
+		ids = firstId + records
+
+		for i in range(1, valence - 1):
+			removed.append(numpy.stack([ringIds[:, 0], ringIds[:, i], ringIds[:, i + 1]], axis=1))
+		for i in range(valence):
+			added.append(numpy.stack([ids, ringIds[:, i], ringIds[:, (i + 1) % valence]], axis=1))
+
+	# Match the fan triangles whatever their rotation, with sorted vertex ids
+	removed = numpy.concatenate(removed)
+	_, inverse = numpy.unique(numpy.sort(numpy.concatenate([triangles, removed]), axis=1), axis=0, return_inverse=True)
+	inverse = inverse.reshape(-1)
+	kept = ~numpy.isin(inverse[:len(triangles)], inverse[len(triangles):])
+
+	vertices = numpy.concatenate([vertices, positions])
+	if normals is not None:
+		normals = numpy.concatenate([normals, batchNormals])
+	triangles = numpy.concatenate([triangles[kept], numpy.concatenate(added)])
+
+	return vertices, normals, triangles
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Compress the (quantized) mesh as a base mesh of about baseRatio of its vertices, followed by refinement batches
+# Returns the CLERS, deltas, normals and dummies of the base mesh (see compressChunks) and the refinement section
+@traced
+def compressProgressive(mesh, k, baseRatio = 0.05, storeNormals = True, workers = None):
+	vertices = numpy.asarray(mesh.vertices)
+	normals = numpy.asarray(mesh.vertex_normals) if mesh.has_vertex_normals() else None
+	storeNormals = storeNormals and normals is not None
+
+	baseTriangles, rounds = decimate(vertices, numpy.asarray(mesh.triangles), int(baseRatio * len(vertices)))
+	print(f'Progressive base mesh: {len(baseTriangles)} triangles, {len(rounds)} refinement batches')
+
+	baseIds = numpy.unique(baseTriangles)
+	localIds = numpy.full(len(vertices), -1)
+	localIds[baseIds] = numpy.arange(len(baseIds))
+	baseMesh = Mesh(vertices[baseIds], localIds[baseTriangles], None if normals is None else normals[baseIds])
+
+	clers, deltas, outputNormals, dummies = compressChunks(baseMesh, len(baseTriangles), False, storeNormals, workers)
+
+	# Vertex ids as seen by the decoder: the base mesh in decompression order, then the vertices of each batch
+	decoded = numpy.asarray(decompressChunks(clers, dummies, deltas, None, False, workers).vertices)
+	decoderIds = numpy.full(len(vertices), -1)
+	decoderIds[baseIds[matchVertices(decoded, vertices[baseIds])]] = numpy.arange(len(decoded))
+
+	# Normals of all the batches at once, the Fibonacci sphere being costly to build
+	rounds = rounds[::-1]
+	removedIds = numpy.array([v for records in rounds for v, _ in records], dtype=numpy.int64)
+	normalsBitstring = normalsToBitstring(normals[removedIds], k) if storeNormals and len(removedIds) > 0 else ''
+
+	vertexCount = len(decoded)
+	bitstring = '{0:032b}'.format(len(rounds))
+	for records in rounds:
+		batchIds = numpy.array([v for v, _ in records])
+		rings = [decoderIds[ring].tolist() for _, ring in records]
+
+		batchNormalsBitstring = ''
+		if storeNormals:
+			first = vertexCount - len(decoded)
+			batchNormalsBitstring = normalsBitstring[17 * first:17 * (first + len(records))]
+
+		bitstring += batchToBitstring(vertices[batchIds], batchNormalsBitstring, rings, k, vertexCount)
+
+		decoderIds[batchIds] = vertexCount + numpy.arange(len(records))
+		vertexCount += len(records)
+
+	return clers, deltas, outputNormals, dummies, bitstring
+
+
+# Apply the refinement batches of the bitstring (at most levels of them, all if None) to the decompressed base mesh
+# The bitstring may be a prefix of the file: the batches that are not complete are ignored
+@traced
+def refineMesh(mesh, bitstring, levels = None):
+	k = int(bitstring[0:4], 2)
+	hasNormals = not readHeaderFlags(bitstring) & FLAG_NO_NORMALS
+
+	vertices = numpy.asarray(mesh.vertices)
+	normals = numpy.asarray(mesh.vertex_normals) if hasNormals else None
+	triangles = numpy.asarray(mesh.triangles)
+
+	bounds = batchesBounds(bitstring)
+	if levels is not None:
+		bounds = bounds[:levels]
+
+	fibSphere = fibonacci_sphere() if hasNormals and len(bounds) > 0 else None
+	for n, _ in bounds:
+		batch = readBatchBits(bitstring, n, k, len(vertices), hasNormals, fibSphere)
+		vertices, normals, triangles = applyBatch(vertices, normals, triangles, batch)
+
+	refined = Mesh(vertices, triangles, normals)
+	if normals is not None:
+		refined.compute_triangle_normals()
+
+	return refined
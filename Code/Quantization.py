@@ -3,7 +3,6 @@ import bcolors
 import sys
 import os
 from numpy.core.numeric import indices
-import open3d
 import copy
 import numpy
 import struct
@@ -11,7 +10,43 @@ import math
 import random
 from codecs import decode
 
-headerSize = 228
+from Cleanup import edgeValences
+from Mesh import compactTypes
+from Tracing import traced
+
+headerSize = 244
+legacyHeaderSize = 228		# Header of the files written without a format marker: no flags and cipher bytes
+
+# Format marker written in front of the header of every file: the magic "RFCP", then the format version
+FORMAT_MAGIC = ''.join('{0:08b}'.format(c) for c in b'RFCP')
+FORMAT_VERSION = 1
+formatMarkerSize = 40
+
+# Header flags, stored in the byte following the AABB
+FLAG_NO_NORMALS = 0x01		# No normals section, normals are rebuilt from the geometry on decode
+FLAG_COMPONENTS = 0x02		# CLERS section holds a component count followed by one CLERS block per connected component
+FLAG_CHUNKS = 0x04			# CLERS section holds a chunk count followed by one CLERS block and dummy vertex list per chunk
+FLAG_PROGRESSIVE = 0x08		# The sections hold a decimated base mesh, followed by refinement batches (see Progressive.py)
+FLAG_SEQUENCE = 0x10		# The sections hold the first frame of an animation, followed by the other frames (see Sequence.py)
+FLAG_NONCE = 0x20			# The header is followed by the nonce block of the file (see Encryption.py)
+
+# Fields of the nonce block, following the header of the files flagged FLAG_NONCE
+nonceSize = 128				# Random nonce of the file, mixed into every key
+keyCheckSize = 64			# Digest of the key and the nonce, checked before decrypting
+sectionsStartSize = 32		# Start of the refinements or frames (following the CLERS section) in the plain bitstring
+nonceBlockSize = nonceSize + keyCheckSize + sectionsStartSize
+
+# Cipher flags, stored in the last byte of the header: the encryption schemes used by Encryption.py
+# (a cleared flag selects the legacy scheme, which decrypts the files of the first format: see stripFormatMarker)
+CIPHER_KEYED_PERMUTATION = 0x01		# Positions are permuted with keyed NumPy permutations instead of random transpositions
+CIPHER_COUNTER_KEYSTREAM = 0x02		# Normals are XORed with a BLAKE2b counter-mode keystream instead of random.randint bits
+CIPHER_BLOCK_PERMUTATION = 0x04		# Positions are permuted inside blocks of vertices, each with its own key, instead of globally
+CIPHER_PAYLOAD = 0x08				# The sections are entropy coded and stream-ciphered as one payload (see EntropyCoding.py),
+									# the other cipher flags are then unused
+CIPHER_PLANES_SHIFT = 4				# The high nibble is the number M of encrypted high bit-planes of each coordinate and
+									# normal index (0 to encrypt all of them), the low planes stay in the clear
+
+CIPHER_DEFAULT = CIPHER_KEYED_PERMUTATION | CIPHER_COUNTER_KEYSTREAM
 
 # https://newbedev.com/how-to-convert-a-binary-string-into-a-float-value
 def float_to_bin(num):
@@ -26,166 +61,102 @@ def bin_to_float(binary):
 # https://stackoverflow.com/a/26127012
 # Edited so it uses numpy instead of vanilla arrays
 def fibonacci_sphere(samples=131072): #NOTE: might be 131071
-    points = numpy.zeros([samples, 3])
     phi = math.pi * (3. - math.sqrt(5.))  # golden angle in radians
 
-    for i in range(samples):
-        y = 1 - (i / float(samples - 1)) * 2  # y goes from 1 to -1
-        radius = math.sqrt(1 - y * y)  # radius at y
+    i = numpy.arange(samples)
+    y = 1 - (i / float(samples - 1)) * 2  # y goes from 1 to -1
+    radius = numpy.sqrt(1 - y * y)  # radius at y
 
-        theta = phi * i  # golden angle increment
+    theta = phi * i  # golden angle increment
 
-        x = math.cos(theta) * radius
-        z = math.sin(theta) * radius
+    return numpy.stack([numpy.cos(theta) * radius, y, numpy.sin(theta) * radius], axis=1)
 
-        points[i] = numpy.array([x, y, z])
 
-    return points
+#Id of the closest point of the Fibonacci sphere to each normal
+#The points are sorted by decreasing y, so only the ids whose y is within searchRadius of the normal's are compared;
+#the few normals whose closest candidate is further than searchRadius are compared to every point
+def closestNormalIds(normals, fibSphere, chunkSize = 128):
+    samples = len(fibSphere)
+    normals = numpy.asarray(normals, dtype=numpy.float64).reshape(-1, 3)
+    normals = normals / numpy.maximum(numpy.linalg.norm(normals, axis=1), 1e-12)[:, None]
 
+    searchRadius = 2 * math.sqrt(4 * math.pi / samples)
+    window = int(searchRadius * (samples - 1) / 2) + 1
+    offsets = numpy.arange(-window, window + 1)
+
+    ids = numpy.empty(len(normals), dtype=numpy.int64)
+    for start in range(0, len(normals), chunkSize):
+        chunk = normals[start:start + chunkSize]
+        centers = numpy.rint((1 - chunk[:, 1]) * (samples - 1) / 2).astype(numpy.int64)
+        candidates = numpy.clip(centers[:, None] + offsets, 0, samples - 1)
+        dots = numpy.einsum('ijk,ik->ij', fibSphere[candidates], chunk)
+        best = numpy.argmax(dots, axis=1)
+        ids[start:start + chunkSize] = candidates[numpy.arange(len(chunk)), best]
+
+        # Distance between unit vectors from their dot product
+        far = numpy.flatnonzero(2 - 2 * dots[numpy.arange(len(chunk)), best] > searchRadius * searchRadius)
+        if len(far) > 0:
+            ids[start + far] = numpy.argmax(chunk[far] @ fibSphere.T, axis=1)
+
+    return ids
 
-def closestNormalID(kdFibSphere, normal):
-    [k, idx, _] = kdFibSphere.search_knn_vector_3d(normal, 5)
-    return idx[0]
 
 def remap(value, minFrom, maxFrom, minTo, maxTo):
     return ((value - minFrom) / (maxFrom - minFrom)) * (maxTo - minTo) + minTo
 
+#Weld the vertices of a quantized mesh by position, drop its degenerate and duplicated triangles, and the triangles
+#with an edge shared by more than 2 triangles when another of their edges is on the border
 def simplify(mesh):
     meshTri = numpy.asarray(mesh.triangles)
-    meshPos = numpy.asarray(mesh.vertices)
-
-    addedvertices = {}
-    vertices = []
-    triangles = []
-    trianglesFixed = []
-
-    addedEdges = {}
-    addedTris = {}
-
-    for tri in meshTri:
-        meshPosA = meshPos[(tri[0])]
-        cellstrA = str(meshPosA)
-
-        meshPosB = meshPos[(tri[1])]
-        cellstrB = str(meshPosB)
-        
-        meshPosC = meshPos[(tri[2])]
-        cellstrC = str(meshPosC)
-
-        if cellstrA != cellstrB and cellstrB != cellstrC and cellstrC != cellstrA:
-            triarray = [cellstrA, cellstrB, cellstrC]
-            triarray.sort()
-            tristr = ''.join(triarray)
-            if tristr not in addedTris:
-                if cellstrA not in addedvertices: 
-                    addedvertices[cellstrA] = len(vertices)
-                    vertices.append(meshPosA)
-                if cellstrB not in addedvertices: 
-                    addedvertices[cellstrB] = len(vertices)
-                    vertices.append(meshPosB)
-                if cellstrC not in addedvertices: 
-                    addedvertices[cellstrC] = len(vertices)
-                    vertices.append(meshPosC)
-                
-                triangles.append(numpy.array([addedvertices[cellstrA], addedvertices[cellstrB], addedvertices[cellstrC]]))
-                addedTris[tristr] = 0 #value does not matter, we only need the key
-                #print(edgeAB)
-
-                edgeAB = cellstrA + " " + cellstrB
-                if cellstrA > cellstrB: edgeAB = cellstrB + " " + cellstrA
-                edgeBC = cellstrB + " " + cellstrC
-                if cellstrB > cellstrC: edgeBC = cellstrC + " " + cellstrB
-                edgeCA = cellstrC + " " + cellstrA
-                if cellstrC > cellstrA: edgeCA = cellstrA + " " + cellstrC
-
-                if edgeAB in addedEdges: addedEdges[edgeAB] = addedEdges[edgeAB] + 1
-                else: addedEdges[edgeAB] = 1
-                if edgeBC in addedEdges: addedEdges[edgeBC] = addedEdges[edgeBC] + 1
-                else: addedEdges[edgeBC] = 1
-                if edgeCA in addedEdges: addedEdges[edgeCA] = addedEdges[edgeCA] + 1
-                else: addedEdges[edgeCA] = 1
-
-    
-    for tri in triangles:
-        meshPosA = vertices[(tri[0])]
-        cellstrA = str(meshPosA)
-
-        meshPosB = vertices[(tri[1])]
-        cellstrB = str(meshPosB)
-        
-        meshPosC = vertices[(tri[2])]
-        cellstrC = str(meshPosC)
-
-        edgeAB = cellstrA + " " + cellstrB
-        if cellstrA > cellstrB: edgeAB = cellstrB + " " + cellstrA
-        edgeBC = cellstrB + " " + cellstrC
-        if cellstrB > cellstrC: edgeBC = cellstrC + " " + cellstrB
-        edgeCA = cellstrC + " " + cellstrA
-        if cellstrC > cellstrA: edgeCA = cellstrA + " " + cellstrC
-
-        add = True
-        if addedEdges[edgeAB] > 2:
-            if addedEdges[edgeBC] == 1 or addedEdges[edgeCA] == 1:
-                add = False
-
-        if addedEdges[edgeBC] > 2:
-            if addedEdges[edgeAB] == 1 or addedEdges[edgeCA] == 1:
-                add = False
-
-        if addedEdges[edgeCA] > 2:
-            if addedEdges[edgeBC] == 1 or addedEdges[edgeAB] == 1:
-                add = False
-
-        if add:
-            trianglesFixed.append(tri)
-        else:
-            print ("ignoring " + cellstrA + ", " + cellstrB + ", " + cellstrC)
-
-
-    mesh.triangles = open3d.utility.Vector3iVector(trianglesFixed)
-    mesh.vertices = open3d.utility.Vector3dVector(vertices)
-    
-    print (mesh.triangles)
-    print (numpy.asarray(mesh.triangles))
-    print (mesh.vertices)
-    print (numpy.asarray(mesh.vertices))
+    meshPos = numpy.rint(numpy.asarray(mesh.vertices)).astype(numpy.int64)
+
+    #Weld, then drop the degenerate triangles and the duplicated ones (same vertices in any order), keeping the first
+    positions, welded = numpy.unique(meshPos, axis=0, return_inverse=True)
+    triangles = welded.reshape(-1)[meshTri].reshape(-1, 3)
+    triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 2] != triangles[:, 0])]
+    _, first = numpy.unique(numpy.sort(triangles, axis=1), axis=0, return_index=True)
+    triangles = triangles[numpy.sort(first)]
+
+    #Vertices in the order they first appear in the triangles
+    used, firstUse = numpy.unique(triangles.ravel(), return_index=True)
+    order = used[numpy.argsort(firstUse)]
+    newIds = numpy.empty(len(positions), dtype=numpy.int64)
+    newIds[order] = numpy.arange(len(order))
+    triangles = newIds[triangles]
+
+    #Number of triangles on each edge of each triangle
+    edgeIds, edgeCounts = edgeValences(triangles, len(order))
+    valences = edgeCounts[edgeIds].reshape(-1, 3)
+
+    #An edge with a valence above 2 is never on the border, so the rule reduces to both conditions on the whole triangle
+    ignored = (valences > 2).any(axis=1) & (valences == 1).any(axis=1)
+    if ignored.any():
+        print(f'ignoring {int(ignored.sum())} triangles on non-manifold edges')
+
+    mesh.triangles = triangles[~ignored]
+    mesh.vertices = positions[order]
 
 #quantize vertices, returning their bitstream header
-#bits out format : k(4), vertexnb(32), minx(32), miny(32), minz(32), maxx(32), maxy(32), maxz(32), v1(3 * 2^k), v2(3 * 2^k), ... , vn(3 * 2^k)
-#                 |                            HEADER (228 bits)                                 |                  VERTICES                  |
-def quantizeVertices(mesh, k):
+#bits out format : k(4), vertexnb(32), minx(32), miny(32), minz(32), maxx(32), maxy(32), maxz(32), flags(8), cipher(8), v1(3 * 2^k), v2(3 * 2^k), ... , vn(3 * 2^k)
+#                 |                                       HEADER (244 bits)                                       |                  VERTICES                  |
+#compact keeps the quantized positions as integers and the normals as float32 (see Mesh.compactTypes)
+@traced
+def quantizeVertices(mesh, k, compact = False):
     vertices = numpy.asarray(mesh.vertices)
 
     # * * * * * * * * * *
     # * * POSITIONS * * *
     # * * * * * * * * * *
     #Compute AABB
-    min = numpy.array([999999.9, 999999.9, 999999.9])
-    max = numpy.array([-999999.9, -999999.9, -999999.9])
-
-    for vertex in vertices:
-        if vertex[0] > max[0]: max[0] = vertex[0]
-        if vertex[1] > max[1]: max[1] = vertex[1]
-        if vertex[2] > max[2]: max[2] = vertex[2]
-        if vertex[0] < min[0]: min[0] = vertex[0]
-        if vertex[1] < min[1]: min[1] = vertex[1]
-        if vertex[2] < min[2]: min[2] = vertex[2]
+    min, max = meshBounds(mesh)
 
-    #Normalize coordinates into a unit AABB
-    for vertex in vertices:
-        vertex[0] = remap(vertex[0], min[0], max[0], 0, 1)
-        vertex[1] = remap(vertex[1], min[1], max[1], 0, 1)
-        vertex[2] = remap(vertex[2], min[2], max[2], 0, 1)
-
-    #Quantize
+    #Normalize coordinates into a unit AABB and quantize
     kpow = pow(2, k) - 1
-    for vertex in vertices:
-        x = int(round(kpow * vertex[0]))
-        y = int(round(kpow * vertex[1]))
-        z = int(round(kpow * vertex[2]))
-        vertex[0] = x
-        vertex[1] = y
-        vertex[2] = z
+    quantized = numpy.rint(kpow * remap(vertices, min, max, 0, 1))
+
+    if compact:
+        mesh.setTypes(*compactTypes(k))
+    mesh.vertices = quantized
 
 def quantizeVerticesRescale(mesh, k):
     vertices = numpy.asarray(mesh.vertices)
@@ -258,6 +229,7 @@ def quantizeVerticesRescale(mesh, k):
 
 
 #Returns the bitstring representing the positions of our mesh
+@traced
 def quantizedPositionsToBitstring(vertices, k):
     bitstring = ''
     for vertex in vertices:
@@ -269,22 +241,12 @@ def quantizedPositionsToBitstring(vertices, k):
     return bitstring
 
 #Returns the bitstring representing the normals of our mesh
+@traced
 def normalsToBitstring(normals, k):
-    print(normals)
-
-    bitstring = ''
     # * * * * * * * * * *
     # * * * NORMALS * * *
     # * * * * * * * * * *
-    fibSphere = fibonacci_sphere()
-    pcd = open3d.geometry.PointCloud()
-    pcd.points = open3d.utility.Vector3dVector(fibSphere)    
-    kdFibSphere = open3d.geometry.KDTreeFlann(pcd)
-
-    for normal in normals:
-        id = closestNormalID(kdFibSphere, normal)
-        bitstring += '{0:017b}'.format(int(id))
-    return bitstring
+    return packBits(closestNormalIds(normals, fibonacci_sphere()), 17)
 
 def clersToBitstring(clers):
     clersList = list(clers)
@@ -298,6 +260,30 @@ def clersToBitstring(clers):
     print(bitstring)
     return bitstring
 
+#Several connected components: component count (32) followed by one CLERS block per component
+#A single component keeps the plain CLERS block
+@traced
+def componentsClersToBitstring(clersList):
+    if len(clersList) == 1:
+        return clersToBitstring(clersList[0])
+
+    bitstring = '{0:032b}'.format(len(clersList))
+    for clers in clersList:
+        bitstring += clersToBitstring(clers)
+    return bitstring
+
+#Spatial chunks: chunk count (32) followed, for each chunk, by its CLERS block, its dummy vertex count (32)
+#and the index of each dummy vertex within the chunk (32 each)
+@traced
+def chunksClersToBitstring(clersList, dummiesList):
+    bitstring = '{0:032b}'.format(len(clersList))
+    for i in range(len(clersList)):
+        bitstring += clersToBitstring(clersList[i])
+        bitstring += '{0:032b}'.format(len(dummiesList[i]))
+        for dummy in dummiesList[i]:
+            bitstring += '{0:032b}'.format(dummy)
+    return bitstring
+
 
 def printbin(bitstring, start, end, colorstart = 0, colorend = 0, rangevalue = 8):
     r = 0
@@ -327,20 +313,35 @@ def printBitString(bitstring):
     print("K: " + str(k))
     print("VertexCount: " + str(vertexCount))
 
+    # Flags
+    flags = readHeaderFlags(bitstring)
+    print("Flags: " + '{0:08b}'.format(flags))
+    print("Cipher: " + '{0:08b}'.format(readHeaderCipher(bitstring)))
+
     printbin(bitstring, 0, 4)
-    printbin(bitstring, 4, 228)
+    printbin(bitstring, 4, headerSize)
 
     n = headerSize
+    if flags & FLAG_NONCE:
+        print("Nonce: " + readHeaderNonce(bitstring).hex())
+        n += nonceBlockSize
+
+    # The sections of an encrypted payload have no fixed layout
+    if readHeaderCipher(bitstring) & CIPHER_PAYLOAD:
+        print("Payload: " + str(int(bitstring[n:n + 32], 2)) + " bytes")
+        return
+
     printbin(bitstring, n, n + (12*k), n, n + 3 * k, k)
     print ('...')
     n += 3 * k * vertexCount
     printbin(bitstring, n - (12 * k), n, n - 3 * k, n, k)
 
-    kn = 17
-    printbin(bitstring, n, n + (kn * 10), n, n + kn, 17)
-    print ('...')
-    n += kn * vertexCount
-    printbin(bitstring, n - (kn * 10), n, n - kn, n, 17)
+    if not flags & FLAG_NO_NORMALS:
+        kn = 17
+        printbin(bitstring, n, n + (kn * 10), n, n + kn, 17)
+        print ('...')
+        n += kn * vertexCount
+        printbin(bitstring, n - (kn * 10), n, n - kn, n, 17)
 
     printbin(bitstring, n, n + 100, n, n + 1, 1)
     print ('...')
@@ -349,7 +350,15 @@ def printBitString(bitstring):
 
 
 
-def writeHeader (mesh, k, deltas):
+#AABB of the vertices of a mesh, as (min, max)
+def meshBounds(mesh):
+    vertices = numpy.asarray(mesh.vertices)
+    return vertices.min(axis=0), vertices.max(axis=0)
+
+
+#bounds = (min, max) overrides the AABB of the mesh (e.g. the AABB of a whole animation)
+@traced
+def writeHeader (mesh, k, deltas, flags = 0, bounds = None, cipher = CIPHER_DEFAULT):
     vertices = numpy.asarray(mesh.vertices)
 
     print("vnb @ quantization: " + str(len(vertices)))
@@ -363,16 +372,7 @@ def writeHeader (mesh, k, deltas):
     # * * POSITIONS * * *
     # * * * * * * * * * *
     #Compute AABB
-    min = numpy.array([999999.9, 999999.9, 999999.9])
-    max = numpy.array([-999999.9, -999999.9, -999999.9])
-
-    for vertex in vertices:
-        if vertex[0] > max[0]: max[0] = vertex[0]
-        if vertex[1] > max[1]: max[1] = vertex[1]
-        if vertex[2] > max[2]: max[2] = vertex[2]
-        if vertex[0] < min[0]: min[0] = vertex[0]
-        if vertex[1] < min[1]: min[1] = vertex[1]
-        if vertex[2] < min[2]: min[2] = vertex[2]
+    min, max = bounds if bounds is not None else meshBounds(mesh)
 
     bitstring += float_to_bin(numpy.float32(min[0]))
     bitstring += float_to_bin(numpy.float32(min[1]))
@@ -381,9 +381,101 @@ def writeHeader (mesh, k, deltas):
     bitstring += float_to_bin(numpy.float32(max[1]))
     bitstring += float_to_bin(numpy.float32(max[2]))    
 
+    bitstring += '{0:08b}'.format(flags)
+    bitstring += '{0:08b}'.format(cipher)
+
     return bitstring
 
 
+#Bitstring of a file: the format marker, followed by the bitstring
+def addFormatMarker(bitstring):
+    return FORMAT_MAGIC + '{0:08b}'.format(FORMAT_VERSION) + bitstring
+
+
+#Bitstring of a file without its format marker
+#A file without a marker has the 228 bits header of the first format: it gets empty flags and cipher bytes, which read
+#it as a single CLERS block and decrypt it with the legacy schemes (see Encryption.py)
+def stripFormatMarker(bitstring):
+    if not bitstring.startswith(FORMAT_MAGIC):
+        return bitstring[:legacyHeaderSize] + '{0:08b}'.format(0) + '{0:08b}'.format(0) + bitstring[legacyHeaderSize:]
+
+    version = int(bitstring[len(FORMAT_MAGIC):formatMarkerSize], 2)
+    if version > FORMAT_VERSION:
+        raise ValueError(f'Unsupported file format version {version} (this version reads up to {FORMAT_VERSION})')
+    return bitstring[formatMarkerSize:]
+
+
+def readHeaderFlags(bitstring):
+    return int(bitstring[legacyHeaderSize:legacyHeaderSize + 8], 2)
+
+
+def writeHeaderFlags(bitstring, flags):
+    return bitstring[:legacyHeaderSize] + '{0:08b}'.format(flags) + bitstring[legacyHeaderSize + 8:]
+
+
+def readHeaderCipher(bitstring):
+    return int(bitstring[236:244], 2)
+
+
+def readHeaderPlanes(bitstring):
+    return readHeaderCipher(bitstring) >> CIPHER_PLANES_SHIFT
+
+
+#Fields of the header, which is never encrypted
+def readHeader(bitstring):
+    return {
+        'k': int(bitstring[0:4], 2),
+        'vertexCount': int(bitstring[4:36], 2),
+        'min': [bin_to_float(bitstring[36 + 32 * i:68 + 32 * i]) for i in range(3)],
+        'max': [bin_to_float(bitstring[132 + 32 * i:164 + 32 * i]) for i in range(3)],
+        'flags': readHeaderFlags(bitstring),
+        'cipher': readHeaderCipher(bitstring),
+        'nonce': readHeaderNonce(bitstring).hex() or None,
+    }
+
+
+#Nonce following the header (empty if the file has none)
+def readHeaderNonce(bitstring):
+    if not readHeaderFlags(bitstring) & FLAG_NONCE:
+        return b''
+    return int(bitstring[headerSize:headerSize + nonceSize], 2).to_bytes(nonceSize // 8, 'big')
+
+
+def readHeaderKeyCheck(bitstring):
+    n = headerSize + nonceSize
+    return int(bitstring[n:n + keyCheckSize], 2).to_bytes(keyCheckSize // 8, 'big')
+
+
+#Start of the refinements or frames stored in the nonce block (None if the file has none, the legacy files must find
+#it with clersSectionEnd)
+def readHeaderSectionsStart(bitstring):
+    if not readHeaderFlags(bitstring) & FLAG_NONCE:
+        return None
+    n = headerSize + nonceSize + keyCheckSize
+    return int(bitstring[n:n + sectionsStartSize], 2)
+
+
+def writeHeaderCipher(bitstring, cipher):
+    return bitstring[:236] + '{0:08b}'.format(cipher) + bitstring[244:]
+
+
+#Bitstring of the values (non-negative integers), each written on width bits
+def packBits(values, width):
+    if width == 0 or len(values) == 0:
+        return ''
+    bits = (numpy.asarray(values, dtype=numpy.int64)[:, None] >> numpy.arange(width - 1, -1, -1)) & 1
+    return (bits.astype(numpy.uint8) + ord('0')).tobytes().decode('ascii')
+
+
+#count values of width bits read from the bitstring at n
+def unpackBits(bitstring, n, count, width):
+    if width == 0 or count == 0:
+        return numpy.zeros(count, dtype=numpy.int64)
+    bits = numpy.frombuffer(bitstring[n:n + count * width].encode('ascii'), dtype=numpy.uint8).reshape(count, width) - ord('0')
+    return bits.astype(numpy.int64) @ (1 << numpy.arange(width - 1, -1, -1, dtype=numpy.int64))
+
+
+@traced
 def resizeMesh(bitstring, mesh, k):
     vertices = numpy.asarray(mesh.vertices)
 
@@ -403,15 +495,13 @@ def resizeMesh(bitstring, mesh, k):
     max = numpy.array([maxx, maxy, maxz])
 
     kpow = pow(2, k) - 1
-    for v in vertices:
-        v[0] = remap(v[0], 0, kpow, min[0], max[0])
-        v[1] = remap(v[1], 0, kpow, min[1], max[1])
-        v[2] = remap(v[2], 0, kpow, min[2], max[2])
-
-    mesh.vertices = open3d.utility.Vector3dVector(vertices)
+    mesh.setTypes(numpy.float64, mesh.normalType)
+    mesh.vertices = remap(vertices, 0, kpow, min, max)
 
 
-def readVerticesBits(bitstring):
+#compact reads the positions as integers and the normals as float32 (see Mesh.compactTypes)
+@traced
+def readVerticesBits(bitstring, compact = False):
     print("bitstring len: " + str(len(bitstring)))
 
     # K
@@ -436,41 +526,68 @@ def readVerticesBits(bitstring):
 
     print(f'AAAAAAAA {min} -> {max}')
 
+    positionType, normalType = compactTypes(k) if compact else (numpy.float64, numpy.float64)
+
     # Vertices
     n = headerSize
-    kpow = pow(2, k) - 1
-    vertices = numpy.zeros([vertexCount, 3])
-
-    for i in range(0, vertexCount):
-        x = int(bitstring[n:n + k], 2)
-        n += k
-        y = int(bitstring[n:n + k], 2)
-        n += k
-        z = int(bitstring[n:n + k], 2)
-        n += k
-
-        #if the MSB is 1, convert to negative
-        #if x >= 512: x = (x - 512) * -1
-        #if y >= 512: y = (y - 512) * -1
-        #if z >= 512: z = (z - 512) * -1
-
-        vertex = numpy.array([x, y, z])
-        vertices[i] = vertex
-
-    # Normals
-    fibSphere = fibonacci_sphere()
-    kn = 17
-    normals = numpy.zeros([vertexCount, 3])
-    for i in range(0, vertexCount):
-        x = int(bitstring[n:n + kn], 2)
-        n += kn
-        normals[i] = fibSphere[x]
+    vertices = unpackBits(bitstring, n, 3 * vertexCount, k).reshape(-1, 3).astype(positionType)
+    n += 3 * k * vertexCount
+
+    # Normals (none stored when the flag is set, the decoder rebuilds them)
+    normals = None
+    if not readHeaderFlags(bitstring) & FLAG_NO_NORMALS:
+        kn = 17
+        normals = fibonacci_sphere()[unpackBits(bitstring, n, vertexCount, kn)].astype(normalType)
+        n += kn * vertexCount
 
     # CLERS
+    clersList, dummiesList, n = readClersSectionBits(bitstring, n, readHeaderFlags(bitstring))
+
+    return vertices, normals, clersList, dummiesList
+
+
+#Index following the CLERS section, where the progressive refinements or the animation frames start
+def clersSectionEnd(bitstring):
+    k = int(bitstring[0:4], 2)
+    vertexCount = int(bitstring[4:36], 2)
+    flags = readHeaderFlags(bitstring)
+
+    n = headerSize + 3 * k * vertexCount
+    if not flags & FLAG_NO_NORMALS:
+        n += 17 * vertexCount
+
+    _, _, n = readClersSectionBits(bitstring, n, flags)
+    return n
+
+
+#Reads the CLERS section starting at n: one block per connected component or per chunk (followed by the chunk
+#dummy vertices). Returns the CLERS strings, the dummy vertex lists and the index following the section
+def readClersSectionBits(bitstring, n, flags):
+    componentCount = 1
+    if flags & (FLAG_COMPONENTS | FLAG_CHUNKS):
+        componentCount = int(bitstring[n:n + 32], 2)
+        n += 32
+
+    clersList = []
+    dummiesList = []
+    for _ in range(componentCount):
+        clers, n = readClersBits(bitstring, n)
+        clersList.append(clers)
+
+        if flags & FLAG_CHUNKS:
+            dummyCount = int(bitstring[n:n + 32], 2)
+            n += 32
+            dummiesList.append([int(bitstring[n + 32 * i:n + 32 * (i + 1)], 2) for i in range(dummyCount)])
+            n += 32 * dummyCount
+
+    return clersList, dummiesList, n
+
+
+#Reads a CLERS block (length + codes) starting at n, returns the CLERS string and the index following the block
+def readClersBits(bitstring, n):
     clers = ""
     clerslen = int(bitstring[n:n + 32], 2)
     print(f'{clerslen} @ {n} : {bitstring[n:n + 32]}')
-    print(f'{bitstring[n - 512: n + 512]}')
     n += 32
     i = n
     for _ in range(0, clerslen):
@@ -490,5 +607,4 @@ def readVerticesBits(bitstring):
             clers += "S"
             i += 3
 
-    return vertices, normals, clers
-
+    return clers, i
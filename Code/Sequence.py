@@ -0,0 +1,175 @@
+'''
+Temporal compression of animated meshes with a fixed connectivity.
+
+The first frame is compressed once with Edgebreaker (connectivity and positions, normals are rebuilt from the
+geometry on decode). Every other frame only stores its quantized positions, in the vertex order of the decoder:
+keyframes store them as is, the other frames store the residual against a prediction from the previous frames.
+Keyframes come back every keyframeInterval frames, so a frame is decoded from the keyframe preceding it.
+'''
+
+import numpy
+
+from EdgebreakerCompression import compressChunks
+from EdgebreakerDecompression import decompressChunks, matchVertices, reconstructVertexNormals
+from Mesh import Mesh
+from Quantization import bin_to_float, clersSectionEnd, packBits, readVerticesBits, remap, unpackBits
+from Tracing import traced
+
+
+# ------------------------------------------------------------
+# Residuals
+# ------------------------------------------------------------
+
+# Signed residuals to non-negative integers: 0, -1, 1, -2, 2... → 0, 1, 2, 3, 4...
+def zigzag(values):
+	return numpy.where(values < 0, -2 * values - 1, 2 * values)
+
+
+def unzigzag(values):
+	return numpy.where(values % 2 == 1, -(values + 1) // 2, values // 2)
+
+
+# ------------------------------------------------------------
+# Frames
+# ------------------------------------------------------------
+
+# Quantize the positions of every frame in the AABB of the whole animation
+def quantizeFrames(frames, k):
+	frames = numpy.asarray(frames, dtype=numpy.float64)
+	min = frames.reshape(-1, 3).min(axis=0)
+	max = frames.reshape(-1, 3).max(axis=0)
+	extent = numpy.where(max > min, max - min, 1)
+
+	kpow = pow(2, k) - 1
+	return numpy.rint((frames - min) / extent * kpow).astype(numpy.int64), (min, max)
+
+
+def isKeyframe(index, keyframeInterval):
+	return index % keyframeInterval == 0
+
+
+# Prediction of a frame: the previous frame, extrapolated linearly when the frame before it is decoded as well
+def predictFrame(index, keyframeInterval, previous, beforePrevious):
+	if isKeyframe(index - 1, keyframeInterval):
+		return previous
+	return 2 * previous - beforePrevious
+
+
+#Frame format: framebits(32), then for a keyframe the positions (3 * k bits per vertex),
+#and for any other frame the residual width (5) followed by the zigzagged residuals (3 * width bits per vertex)
+def frameToBitstring(index, keyframeInterval, k, frame, previous, beforePrevious):
+	if isKeyframe(index, keyframeInterval):
+		bitstring = packBits(frame.ravel(), k)
+	else:
+		residuals = zigzag(frame - predictFrame(index, keyframeInterval, previous, beforePrevious)).ravel()
+		width = int(residuals.max()).bit_length() if len(residuals) > 0 else 0
+		bitstring = '{0:05b}'.format(width) + packBits(residuals, width)
+
+	return '{0:032b}'.format(len(bitstring)) + bitstring
+
+
+def readFrameBits(bitstring, n, index, keyframeInterval, k, vertexCount, previous, beforePrevious):
+	if isKeyframe(index, keyframeInterval):
+		return unpackBits(bitstring, n, 3 * vertexCount, k).reshape(-1, 3)
+
+	width = int(bitstring[n:n + 5], 2)
+	residuals = unzigzag(unpackBits(bitstring, n + 5, 3 * vertexCount, width)).reshape(-1, 3)
+	return predictFrame(index, keyframeInterval, previous, beforePrevious) + residuals
+
+
+# Start and size (after the size field) of every frame stored after the first one
+# n is the start of the frames when it is already known, which saves reading the CLERS section
+def framesBounds(bitstring, n = None):
+	if n is None:
+		n = clersSectionEnd(bitstring)
+	frameCount = int(bitstring[n:n + 32], 2)
+	keyframeInterval = int(bitstring[n + 32:n + 64], 2)
+	n += 64
+
+	bounds = []
+	for _ in range(frameCount - 1):
+		frameBits = int(bitstring[n:n + 32], 2)
+		n += 32
+		bounds.append((n, frameBits))
+		n += frameBits
+
+	return keyframeInterval, bounds
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Compress an animation: frames is a list of (vertexCount, 3) position arrays sharing the triangles
+# Vertices at the same quantized position in every frame are welded; other than those, the quantized first frame
+# must not have two vertices at the same position, since the decoder identifies them by it
+# Returns the AABB of the animation, the CLERS, deltas and dummies of the first frame (see compressChunks)
+# and the frames section
+@traced
+def compressSequence(frames, triangles, k, keyframeInterval = 30, workers = None):
+	quantized, bounds = quantizeFrames(frames, k)
+
+	# Weld the vertices that stay at the same quantized position in every frame (like the seams of an .obj),
+	# so that the first frame can be compressed as a connected mesh
+	_, first, inverse = numpy.unique(quantized.transpose(1, 0, 2).reshape(quantized.shape[1], -1), axis=0, return_index=True, return_inverse=True)
+	quantized = quantized[:, first]
+	triangles = inverse.reshape(-1)[triangles]
+	triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 2] != triangles[:, 0])]
+
+	firstFrame = Mesh(quantized[0], triangles)
+	clers, deltas, _, dummies = compressChunks(firstFrame, len(triangles), False, False, workers)
+
+	# Vertex order of the decoder, in which all the frames are stored
+	decoded = numpy.asarray(decompressChunks(clers, dummies, deltas, None, False, workers).vertices)
+	order = matchVertices(decoded, quantized[0].astype(numpy.float64))
+	if len(decoded) != len(numpy.unique(triangles)) or (order < 0).any():
+		raise ValueError('The first frame of the sequence has several vertices at the same quantized position')
+
+	quantized = quantized[:, order]
+
+	bitstring = '{0:032b}'.format(len(frames))
+	bitstring += '{0:032b}'.format(keyframeInterval)
+	for i in range(1, len(frames)):
+		bitstring += frameToBitstring(i, keyframeInterval, k, quantized[i], quantized[i - 1], quantized[i - 2] if i >= 2 else None)
+
+	return bounds, clers, deltas, dummies, bitstring
+
+
+# Decompress the frames of a (decrypted) sequence bitstring, all of them or only the ones in indices
+# Each frame is decoded from the keyframe preceding it, frames are returned as rescaled meshes with their normals
+@traced
+def decompressSequence(bitstring, indices = None):
+	k = int(bitstring[0:4], 2)
+	kpow = pow(2, k) - 1
+	min = numpy.array([bin_to_float(bitstring[36 + 32 * axis:68 + 32 * axis]) for axis in range(3)])
+	max = numpy.array([bin_to_float(bitstring[132 + 32 * axis:164 + 32 * axis]) for axis in range(3)])
+
+	deltas, _, clers, dummies = readVerticesBits(bitstring)
+	firstFrame = decompressChunks(clers, dummies, deltas, None)
+	triangles = numpy.asarray(firstFrame.triangles)
+
+	keyframeInterval, bounds = framesBounds(bitstring)
+	frameCount = len(bounds) + 1
+	if indices is None:
+		indices = range(frameCount)
+
+	meshes = []
+	decodedIndex = None
+	for index in indices:
+		# Decode from the keyframe preceding the frame, unless the last decoded frame is on the way
+		start = index - index % keyframeInterval
+		if decodedIndex is None or decodedIndex > index or decodedIndex < start:
+			frame = numpy.asarray(firstFrame.vertices).astype(numpy.int64)
+			previous = None
+			decodedIndex = start - 1 if start > 0 else 0
+
+		for i in range(decodedIndex + 1, index + 1):
+			n, _ = bounds[i - 1]
+			previous, frame = frame, readFrameBits(bitstring, n, i, keyframeInterval, k, len(frame), frame, previous)
+		decodedIndex = index
+
+		mesh = Mesh(remap(frame, 0, kpow, min, max), triangles)
+		reconstructVertexNormals(mesh)
+		meshes.append(mesh)
+
+	return meshes
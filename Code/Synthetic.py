@@ -0,0 +1,181 @@
+'''
+Deterministic synthetic meshes of a chosen size, to benchmark the codec on larger meshes than the ones of Models/.
+
+- sphere: icosahedron whose faces are subdivided into frequency² triangles, projected onto the sphere (closed, genus 0)
+- torus: surface of a slab of voxels pierced by genus square holes (closed, any genus)
+- terrain: height field on a grid, made of seeded random waves (open, one boundary)
+
+The requested number of triangles is matched as closely as the shape allows. The meshes are manifold, their vertices
+are all distinct and their vertex normals are computed, so they can be given to the codec in memory, or saved as .obj.
+'''
+
+import math
+import numpy
+
+from EdgebreakerDecompression import reconstructVertexNormals
+from Mesh import Mesh
+
+
+_shapes = {}
+
+
+def shape(function):
+	_shapes[function.__name__] = function
+	return function
+
+
+# Vertices of the lattice points given by their integer keys, as ids numbered in order of first appearance
+def weldLattice(keys):
+	_, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+	order = numpy.argsort(first)
+	rank = numpy.empty(len(order), dtype=numpy.int64)
+	rank[order] = numpy.arange(len(order))
+	return first[order], rank[inverse.reshape(-1)]
+
+
+def withNormals(vertices, triangles):
+	mesh = Mesh(vertices, triangles)
+	reconstructVertexNormals(mesh)
+	return mesh
+
+
+def icosahedron():
+	t = (1 + math.sqrt(5)) / 2
+	vertices = numpy.array([
+		[-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+		[0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+		[t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1],
+	], dtype=numpy.float64)
+	triangles = numpy.array([
+		[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+		[1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+		[3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+		[4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1],
+	])
+	return vertices, triangles
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+# Sphere of 20 * frequency² triangles (the closest to triangles)
+@shape
+def sphere(triangles, radius = 1.0, seed = 0):
+	frequency = max(1, round(math.sqrt(triangles / 20)))
+	corners, faces = icosahedron()
+
+	# Lattice points (i, j) of every face, i + j <= frequency: corner weights (frequency - i - j, i, j)
+	i, j = numpy.nonzero(numpy.add.outer(numpy.arange(frequency + 1), numpy.arange(frequency + 1)) <= frequency)
+	weights = numpy.stack([frequency - i - j, i, j], axis=1)
+	pointIds = numpy.full((frequency + 2, frequency + 2), -1)
+	pointIds[i, j] = numpy.arange(len(i))
+
+	# The points on an edge or corner are shared by several faces: their key is made of their (corner, weight) pairs,
+	# sorted by corner, with the corners of weight 0 left out
+	faceCorners = numpy.repeat(faces, len(i), axis=0).reshape(len(faces), len(i), 3)
+	faceWeights = numpy.broadcast_to(weights, faceCorners.shape)
+	faceCorners = numpy.where(faceWeights > 0, faceCorners, 12)
+	order = numpy.argsort(faceCorners, axis=2)
+	faceCorners = numpy.take_along_axis(faceCorners, order, axis=2)
+	faceWeights = numpy.take_along_axis(faceWeights, order, axis=2)
+	keys = numpy.zeros(faceCorners.shape[:2], dtype=numpy.int64)
+	for axis in range(3):
+		keys = (keys * 13 + faceCorners[..., axis]) * (frequency + 1) + faceWeights[..., axis]
+	first, ids = weldLattice(keys.ravel())
+	ids = ids.reshape(len(faces), len(i))
+
+	# Points of the faces, projected onto the sphere
+	positions = numpy.einsum('pc,fcx->fpx', weights / frequency, corners[faces]).reshape(-1, 3)[first]
+	vertices = radius * positions / numpy.linalg.norm(positions, axis=1)[:, None]
+
+	# Upward (i, j), (i + 1, j), (i, j + 1) and downward (i + 1, j), (i + 1, j + 1), (i, j + 1) triangles of every face
+	up = numpy.nonzero(numpy.add.outer(numpy.arange(frequency), numpy.arange(frequency)) <= frequency - 1)
+	down = numpy.nonzero(numpy.add.outer(numpy.arange(frequency), numpy.arange(frequency)) <= frequency - 2)
+	local = numpy.concatenate([
+		numpy.stack([pointIds[up[0], up[1]], pointIds[up[0] + 1, up[1]], pointIds[up[0], up[1] + 1]], axis=1),
+		numpy.stack([pointIds[down[0] + 1, down[1]], pointIds[down[0] + 1, down[1] + 1], pointIds[down[0], down[1] + 1]], axis=1),
+	])
+	triangles = ids[:, local].reshape(-1, 3)
+
+	return withNormals(vertices, triangles)
+
+
+# Surface of a slab of voxels pierced by genus square holes in a row, about triangles triangles
+@shape
+def torus(triangles, genus = 1, seed = 0):
+	# A slab of (2 * genus + 1) x 3 blocks of size x size x (size / 2) voxels, every other block of the middle row
+	# being a hole: 2 triangles per voxel face, 4 * size² per block on the top and bottom, and (8 * genus + 8) * size²
+	# on the sides of the slab and of the holes
+	genus = max(1, int(genus))
+	blocks = (2 * genus + 1) * 3 - genus
+	size = max(2, round(math.sqrt(triangles / (4 * blocks + 8 * genus + 8))))
+	depth = max(1, size // 2)
+
+	occupied = numpy.ones(((2 * genus + 1) * size, 3 * size, depth), dtype=bool)
+	for hole in range(genus):
+		occupied[(2 * hole + 1) * size:(2 * hole + 2) * size, size:2 * size, :] = False
+
+	# Boundary faces between an occupied voxel and an empty one, along each axis, as quads of lattice points
+	# oriented outwards
+	padded = numpy.pad(occupied, 1)
+	quads = []
+	for axis in range(3):
+		change = padded[tuple(slice(1, None) if a == axis else slice(1, -1) for a in range(3))].astype(numpy.int8) - padded[tuple(slice(None, -1) if a == axis else slice(1, -1) for a in range(3))]
+		u, v = (axis + 1) % 3, (axis + 2) % 3
+		du, dv = numpy.eye(3, dtype=numpy.int64)[[u, v]]
+		for sign in (1, -1):
+			origin = numpy.argwhere(change == -sign)		# -1: the voxel before the face is occupied, facing +axis
+			corners = [origin, origin + du, origin + du + dv, origin + dv]
+			if sign == -1:
+				corners = corners[::-1]
+			quads.append(numpy.stack(corners, axis=1))
+	quads = numpy.concatenate(quads)
+
+	dims = numpy.array(occupied.shape) + 1
+	keys = (quads[..., 0] * dims[1] + quads[..., 1]) * dims[2] + quads[..., 2]
+	first, ids = weldLattice(keys.ravel())
+	ids = ids.reshape(-1, 4)
+
+	vertices = quads.reshape(-1, 3)[first] / size
+	triangles = numpy.concatenate([ids[:, [0, 1, 2]], ids[:, [0, 2, 3]]])
+
+	return withNormals(vertices, triangles)
+
+
+# Height field on a grid of about triangles triangles, heights made of seeded random waves
+@shape
+def terrain(triangles, amplitude = 0.1, seed = 0):
+	size = max(1, round(math.sqrt(triangles / 2)))
+	x, y = numpy.meshgrid(numpy.linspace(0, 1, size + 1), numpy.linspace(0, 1, size + 1), indexing='ij')
+
+	generator = numpy.random.default_rng(seed)
+	heights = numpy.zeros_like(x)
+	for octave in range(6):
+		frequency = 2 ** octave
+		angle, phase = generator.random(2) * 2 * math.pi
+		heights += numpy.sin(2 * math.pi * frequency * (x * math.cos(angle) + y * math.sin(angle)) + phase) / frequency
+	heights += generator.normal(0, 0.01, heights.shape)
+	vertices = numpy.stack([x, y, amplitude * heights], axis=-1).reshape(-1, 3)
+
+	ids = numpy.arange((size + 1) ** 2).reshape(size + 1, size + 1)
+	a = ids[:-1, :-1].ravel()
+	b = ids[1:, :-1].ravel()
+	c = ids[1:, 1:].ravel()
+	d = ids[:-1, 1:].ravel()
+	triangles = numpy.concatenate([numpy.stack([a, b, c], axis=1), numpy.stack([a, c, d], axis=1)])
+
+	return withNormals(vertices, triangles)
+
+
+# Mesh from a "shape:triangles[:parameter]" specification, like "sphere:100000" or "torus:50000:3" (the parameter is
+# the radius of a sphere, the genus of a torus or the amplitude of a terrain); only the terrain depends on the seed
+def syntheticMesh(specification, seed = 0):
+	name, triangles, *parameters = specification.split(':')
+	if name not in _shapes:
+		raise ValueError(f'Unknown synthetic shape {name}, expected one of {", ".join(_shapes)}')
+	return _shapes[name](int(float(triangles)), *map(float, parameters), seed=seed)
+
+
+def isSynthetic(specification):
+	return specification.split(':')[0] in _shapes and not specification.endswith('.obj')
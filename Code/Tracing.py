@@ -0,0 +1,309 @@
+'''
+Lightweight tracing of the pipeline: nested timing spans, counters and sizes, saved as a Chrome trace (to open in
+chrome://tracing or https://ui.perfetto.dev) or as JSON lines (one event per line, written as soon as the span ends).
+
+	with span('encrypt', bits=len(bitstring)) as s:
+		bitstring = encrypt(bitstring, 10, password)
+		s.set(outputBits=len(bitstring))
+	counter('vertices', count=len(mesh.vertices))
+
+	@traced
+	def objImporter(filepath): ...
+
+Tracing is disabled by default: span then returns a shared object doing nothing, and a traced function calls the
+function directly, which costs a function call and a test. It is enabled by enable(filename), or for every process by
+the RFCP_TRACE environment variable holding the name of the trace file. A JSON lines trace (a name ending with .jsonl)
+gets the events of every process; the other processes started with RFCP_TRACE save their Chrome trace next to the
+first one, with their process id added to its name.
+
+Every event is a Chrome trace event: complete events ("ph": "X") for the spans, with their start and duration in
+microseconds, counter events ("ph": "C") for the counters. The arguments of a span hold the sizes given to it, and its
+depth and parent span.
+
+The memory mode (enableMemory, or RFCP_TRACE_MEMORY=1 along with RFCP_TRACE) adds the memory of every span to its arguments: the memory
+traced by tracemalloc when the span ends (memoryCurrent), its difference with the start of the span (memoryAllocated),
+the peak traced memory during the span (memoryPeak), and the peak resident set size sampled during the span (rssPeak).
+The spans up to sitesDepth deep also get the lines which allocated the most memory still held when they end
+(topSites), the snapshots this takes being counted in the traced memory. tracemalloc slows the code down a lot: the
+times of a trace in memory mode are not the usual ones.
+'''
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+_enabled = False
+_filename = None
+_jsonLines = None			# File the events are appended to, in JSON lines mode
+_events = []				# Events of the Chrome trace, saved when tracing is disabled or at exit
+_lock = threading.Lock()
+_local = threading.local()
+_collectors = []			# Event lists of the open collect blocks
+
+_memory = False				# Memory mode
+_sites = 3					# Number of top allocation sites of a span
+_sitesDepth = 1				# Deepest spans getting their top allocation sites
+_memorySpans = []			# Open spans, whose peak RSS is updated by the sampler
+_sampler = None
+_tracemallocStarted = False	# tracemalloc was started by the memory mode, which stops it
+
+
+def timestamp():
+	return time.perf_counter_ns() / 1000
+
+
+# Resident set size of the process in bytes (None where /proc is not available)
+def residentMemory():
+	try:
+		with open('/proc/self/statm') as file:
+			return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		return None
+
+
+# Updates the peak RSS of the open spans every interval seconds, while the memory mode is on
+def sampleResidentMemory(interval):
+	while _memory:
+		updateResidentPeaks()
+		time.sleep(interval)
+
+
+def updateResidentPeaks():
+	rss = residentMemory()
+	if rss is None:
+		return
+	with _lock:
+		for span in _memorySpans:
+			span.rssPeak = max(span.rssPeak, rss)
+
+
+# Snapshot of the traced memory, without the memory of tracemalloc itself
+def takeSnapshot():
+	return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def record(event):
+	if len(_collectors) > 0:
+		with _lock:
+			for events in _collectors:
+				events.append(event)
+	if _filename is None:
+		return
+	if _jsonLines is not None:
+		line = json.dumps(event) + '\n'
+		with _lock:
+			_jsonLines.write(line)
+			_jsonLines.flush()
+	else:
+		with _lock:
+			_events.append(event)
+
+
+def openSpans():
+	if not hasattr(_local, 'spans'):
+		_local.spans = []
+	return _local.spans
+
+
+class Span:
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+
+	# Adds sizes (or any JSON value) to the arguments of the span
+	def set(self, **args):
+		self.args.update(args)
+
+	def __enter__(self):
+		spans = openSpans()
+		self.args['depth'] = len(spans)
+		if len(spans) > 0:
+			self.args['parent'] = spans[-1].name
+		spans.append(self)
+		if _memory:
+			self.enterMemory(spans)
+		self.start = timestamp()
+		return self
+
+	def __exit__(self, *exception):
+		end = timestamp()
+		spans = openSpans()
+		spans.pop()
+		if _memory and hasattr(self, 'memoryStart'):
+			self.exitMemory(spans)
+		if exception[0] is not None:
+			self.args['error'] = exception[0].__name__
+		record({'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': end - self.start, 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': self.args})
+		return False
+
+	# The peak traced memory is reset for every span, after handing the peak reached so far to the parent span
+	def enterMemory(self, spans):
+		current, peak = tracemalloc.get_traced_memory()
+		if len(spans) > 1 and hasattr(spans[-2], 'memoryPeak'):
+			spans[-2].memoryPeak = max(spans[-2].memoryPeak, peak)
+		tracemalloc.reset_peak()
+		self.memoryStart = current
+		self.memoryPeak = current
+		self.rssPeak = residentMemory() or 0
+		with _lock:
+			_memorySpans.append(self)
+		self.snapshot = takeSnapshot() if _sites > 0 and self.args['depth'] <= _sitesDepth else None
+
+	def exitMemory(self, spans):
+		current, peak = tracemalloc.get_traced_memory()
+		self.memoryPeak = max(self.memoryPeak, peak)
+		updateResidentPeaks()
+		with _lock:
+			_memorySpans.remove(self)
+		if len(spans) > 0 and hasattr(spans[-1], 'memoryPeak'):
+			spans[-1].memoryPeak = max(spans[-1].memoryPeak, self.memoryPeak)
+		tracemalloc.reset_peak()
+
+		self.args.update(memoryCurrent=current, memoryAllocated=current - self.memoryStart, memoryPeak=self.memoryPeak, rssPeak=self.rssPeak)
+		if self.snapshot is not None:
+			differences = takeSnapshot().compare_to(self.snapshot, 'lineno')
+			self.args['topSites'] = [{'site': f'{os.path.basename(difference.traceback[0].filename)}:{difference.traceback[0].lineno}', 'size': difference.size_diff, 'count': difference.count_diff} for difference in differences[:_sites] if difference.size_diff > 0]
+			self.snapshot = None
+
+
+class NullSpan:
+	def set(self, **args):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		return False
+
+
+_nullSpan = NullSpan()
+
+
+# ------------------------------------------------------------
+# ONLY "PUBLIC" FUNCTIONS (TO IMPORT)
+# ------------------------------------------------------------
+
+def isEnabled():
+	return _enabled
+
+
+# Context manager timing the code it holds as a span named name, args are sizes or any JSON value to attach to it
+def span(name, **args):
+	if not _enabled:
+		return _nullSpan
+	return Span(name, args)
+
+
+# Decorator running the function in a span named after it
+def traced(function):
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		if not _enabled:
+			return function(*args, **kwargs)
+		with Span(function.__name__, {}):
+			return function(*args, **kwargs)
+
+	return wrapper
+
+
+# Records the values of a counter (each keyword is a series of the counter)
+def counter(name, **values):
+	if _enabled:
+		record({'name': name, 'ph': 'C', 'ts': timestamp(), 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': values})
+
+
+# Context manager collecting the events recorded while it is open (by every thread) into the list it gives, whether the
+# trace is saved or not: with collect() as events: ...
+@contextlib.contextmanager
+def collect():
+	events = []
+	with _lock:
+		_collectors.append(events)
+	try:
+		yield events
+	finally:
+		with _lock:
+			_collectors[:] = [collector for collector in _collectors if collector is not events]
+
+
+# Starts recording the events, to save to filename (JSON lines if it ends with .jsonl, a Chrome trace otherwise)
+# Without a filename the spans are measured but not saved, their events can still be collected (see collect)
+def enable(filename = None):
+	global _enabled, _filename, _jsonLines
+	disable()
+
+	_filename = filename
+	if filename is not None and filename.endswith('.jsonl'):
+		_jsonLines = open(filename, 'a')
+	_enabled = True
+
+
+# Starts the memory mode: tracemalloc and the RSS sampling every interval seconds (see the module description)
+# The memory is only measured by the spans, while tracing is enabled
+def enableMemory(sites = 3, sitesDepth = 1, interval = 0.01):
+	global _memory, _sites, _sitesDepth, _sampler, _tracemallocStarted
+	disableMemory()
+
+	_sites = sites
+	_sitesDepth = sitesDepth
+	_tracemallocStarted = not tracemalloc.is_tracing()
+	if _tracemallocStarted:
+		tracemalloc.start()
+	_memory = True
+	_sampler = threading.Thread(target=sampleResidentMemory, args=(interval,), daemon=True)
+	_sampler.start()
+
+
+def disableMemory():
+	global _memory, _sampler, _tracemallocStarted
+	_memory = False
+	if _sampler is not None:
+		_sampler.join()
+		_sampler = None
+	if _tracemallocStarted:
+		tracemalloc.stop()
+		_tracemallocStarted = False
+
+
+# Stops recording and saves the trace, returns the events of a Chrome trace (empty in JSON lines mode)
+def disable():
+	global _enabled, _filename, _jsonLines, _events
+	events = _events
+	if _enabled and _filename is not None and _jsonLines is None:
+		with open(_filename, 'w') as file:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+	if _jsonLines is not None:
+		_jsonLines.close()
+
+	_enabled = False
+	_filename = None
+	_jsonLines = None
+	_events = []
+	return events
+
+
+# Chrome trace from a JSON lines trace
+def jsonLinesToChromeTrace(jsonLinesFilename, filename):
+	with open(jsonLinesFilename) as file:
+		events = [json.loads(line) for line in file if line.strip()]
+	with open(filename, 'w') as file:
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+if os.environ.get('RFCP_TRACE'):
+	_root, _extension = os.path.splitext(os.environ['RFCP_TRACE'])
+	if _extension != '.jsonl' and os.environ.setdefault('RFCP_TRACE_PID', str(os.getpid())) != str(os.getpid()):
+		enable(f'{_root}.{os.getpid()}{_extension}')
+	else:
+		enable(os.environ['RFCP_TRACE'])
+# tracemalloc slows everything down, it is not started for a trace that is not recorded
+if os.environ.get('RFCP_TRACE_MEMORY') == '1' and _enabled:
+	enableMemory()
+atexit.register(disable)
@@ -6,7 +6,6 @@
 import bitarray
 import builtins
 import copy
-import cProfile
 import math
 import numpy
 import open3d
@@ -14,8 +13,6 @@ import os
 import sys
 import time
 
-from pstats import Stats
-
 
 # ------------------------------------------------------------
 # Project code
@@ -28,6 +25,7 @@ from Code.Quantization import readVerticesBits
 from Code.Encryption import scramble, xorifyNormals
 from Code.Encryption import unscramble
 from Code.Huffman import makeCodebook
+from Code.Profiling import profiled
 
 
 # ------------------------------------------------------------
@@ -315,20 +313,7 @@ def readFile(filename):
 # Main
 # ------------------------------------------------------------
 
-def doProfiling():
-	with cProfile.Profile() as pr:
-		main()
-	
-	with open('profiling_stats.txt', 'w') as stream:
-		stats = Stats(pr, stream=stream)
-		stats.strip_dirs()
-		stats.sort_stats('time')
-		stats.dump_stats('.prof_stats')
-		stats.print_stats()
-
-	return 0
-
-
+@profiled('main')
 def main():
 	#testFunction()
 		
@@ -353,8 +338,4 @@ def main():
 
 
 if __name__ == '__main__':
-	do_profiling = True
-	if do_profiling:
-		sys.exit(doProfiling())
-	else:
-		sys.exit(main())
+	sys.exit(main())